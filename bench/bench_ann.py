@@ -0,0 +1,113 @@
+# Recall@k and latency of IVFIndex (approximate search) against EmbeddingStore.search (exact search).
+#
+# Runs on an existing store or on synthetic clustered vectors shaped like text-embedding-3 outputs. Example:
+#     python bench/bench_ann.py --rows 200000 --dimensions 1536 --nprobe 1 4 16 64
+#     python bench/bench_ann.py --store ~/my_store --queries 200
+# With --store, the queries are vectors of the store plus a little noise.
+
+
+import argparse
+import tempfile
+import shutil
+import json
+import time
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OAI_API_KEY", "fake")  # Importing the package builds the OpenAI client - no call is made
+from henryobj.vectors import EmbeddingStore, IVFIndex
+
+
+def synthetic_vectors(nb_rows: int, dimensions: int, nb_topics: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Normalized vectors drawn around nb_topics random directions - real embeddings are clustered too, uniform noise would not be.
+    """
+    topics = rng.normal(size=(nb_topics, dimensions))
+    vectors = topics[rng.integers(0, nb_topics, size=nb_rows)] + rng.normal(scale=1.5, size=(nb_rows, dimensions))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+def fill_store(store: EmbeddingStore, vectors: np.ndarray, batch: int = 10000) -> None:
+    """
+    Adds the vectors to the store by batches, with their position as id.
+    """
+    for start in range(0, len(vectors), batch):
+        block = vectors[start:start + batch]
+        store.add([str(start + i) for i in range(len(block))], block)
+
+def make_queries(store: EmbeddingStore, nb_queries: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Vectors of the store moved by some noise - so the queries look like the data without being in it.
+    """
+    base = store.get_vectors(np.sort(rng.choice(len(store), size=nb_queries, replace=False)))
+    return base + rng.normal(scale=0.5 / np.sqrt(store.dimensions), size=base.shape).astype(np.float32)
+
+def run(store: EmbeddingStore, queries: np.ndarray, k: int, nprobes: list[int], nlist: int = None) -> list[dict]:
+    """
+    Trains an index on the store then measures recall@k and latency for each nprobe. The first line is the exact search.
+    """
+    start = time.perf_counter()
+    exact = [store.search_rows(query, k)[0] for query in queries]
+    exact_ms = (time.perf_counter() - start) / len(queries) * 1000
+    reports = [{"method": "exact", "nprobe": "-", "recall_at_k": 1.0, "ms_per_query": round(exact_ms, 3), "scanned_pct": 100.0}]
+
+    start = time.perf_counter()
+    index = IVFIndex(store, nlist).train()
+    train_s = time.perf_counter() - start
+    sizes = index.cluster_sizes()
+    for nprobe in nprobes:
+        nprobe = min(nprobe, index.nlist)
+        start = time.perf_counter()
+        found = [index.search_rows(query, k, nprobe)[0] for query in queries]
+        ms = (time.perf_counter() - start) / len(queries) * 1000
+        recall = np.mean([len(np.intersect1d(a, b)) / max(1, len(b)) for a, b in zip(found, exact)])
+        scanned = np.mean([sizes[np.argsort(-(index.centroids @ store.prepare_query(query)))[:nprobe]].sum() for query in queries]) / len(store)
+        reports.append({"method": f"ivf (nlist={index.nlist}, train {train_s:.1f}s)", "nprobe": nprobe, "recall_at_k": round(float(recall), 4),
+                        "ms_per_query": round(ms, 3), "scanned_pct": round(100 * float(scanned), 2)})
+    return reports
+
+def print_report(reports: list[dict]) -> None:
+    """
+    Prints the reports as an aligned table - one column per key of the reports.
+    """
+    columns = list(reports[0])
+    widths = [max(len(column), *(len(str(report[column])) for report in reports)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for report in reports:
+        print("  ".join(str(report[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall@k of IVFIndex against the exact search")
+    parser.add_argument("--store", default=None, help="Existing EmbeddingStore folder. Synthetic vectors otherwise")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--topics", type=int, default=500, help="Clusters of the synthetic data")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=None, help="Defaults to 4 * sqrt(rows)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the reports as JSON")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    folder = None
+    if args.store:
+        store = EmbeddingStore(args.store)
+    else:
+        folder = tempfile.mkdtemp(prefix="bench_ann_")
+        store = EmbeddingStore(folder, args.dimensions)
+        fill_store(store, synthetic_vectors(args.rows, args.dimensions, args.topics, rng))
+    try:
+        reports = run(store, make_queries(store, min(args.queries, len(store)), rng), args.k, args.nprobe, args.nlist)
+        if args.json:
+            print(json.dumps(reports, indent=2))
+        else:
+            print(f"{len(store)} vectors of {store.dimensions} dimensions, recall@{args.k}")
+            print_report(reports)
+    finally:
+        if folder:
+            shutil.rmtree(folder, ignore_errors=True)
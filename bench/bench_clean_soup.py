@@ -0,0 +1,116 @@
+# Time of clean_soup / clean_lexbor_tree per page, on link-heavy test pages and optionally a folder of saved pages.
+#
+# The test pages have N links in one block, one per line (a tag cloud, an index...) - with only whitespace between them, the old
+# usefulness test of the links read the text of the whole block again for every link. Example:
+#     python bench/bench_clean_soup.py --links 100 1000 5000 --corpus ~/saved_pages --ref HEAD~1
+# --ref also runs the benchmark on the package as it is in a git commit (extracted with git archive) to compare before / after.
+#
+# Note: before the cleaning was rewritten, clean_soup always printed token counts with tiktoken, which needs its encodings cached locally.
+
+
+from contextlib import redirect_stdout
+
+import subprocess
+import argparse
+import tempfile
+import shutil
+import json
+import time
+import glob
+import sys
+import os
+import io
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.environ.get("BENCH_PACKAGE_PATH", REPO_PATH)) # The child of --ref imports the old package
+from henryobj import web
+
+# Not web.HTML_PARSERS - older versions of web.py only have BeautifulSoup, their run skips selectolax
+HTML_PARSERS = ("html.parser", "lxml", "selectolax")
+
+
+def link_page(links: int) -> str:
+    """
+    A page made of a short text and a block of links, one per line.
+    """
+    items = "\n".join(f'  <a href="/pages/{i}">Page {i}</a>' for i in range(links))
+    return f"<html><body><main><h1>Index</h1><p>All the pages of the site.</p>\n<div>\n{items}\n</div>\n</main></body></html>"
+
+def load_corpus(folder: str) -> list[tuple[str, str]]:
+    """
+    Returns (url, html) for each .html file of the folder - as bench_parsers.py.
+    """
+    pages = []
+    for path in sorted(glob.glob(os.path.join(os.path.expanduser(folder), "**", "*.htm*"), recursive=True)):
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            pages.append((f"https://{os.path.basename(path).replace('_', '/')}", f.read()))
+    return pages
+
+def time_cleaning(name: str, pages: list[tuple[str, str]], parser: str, repeat: int) -> dict:
+    """
+    Best time over repeat runs to clean the pages - the parsing is done beforehand and not timed.
+    """
+    timings = []
+    for _ in range(repeat):
+        if parser == "selectolax":
+            trees = [(web.parse_lexbor(html), url) for url, html in pages]
+            clean = web.clean_lexbor_tree
+        else:
+            trees = [(web.BeautifulSoup(html, parser), url) for url, html in pages]
+            clean = web.clean_soup
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()): # The old clean_soup printed for every page
+            for tree, url in trees:
+                clean(tree, url)
+        timings.append(time.perf_counter() - start)
+    return {"pages": name, "parser": parser, "ms_per_page": round(min(timings) / len(pages) * 1000, 2)}
+
+def run(links: list[int], corpus: str, parsers: list[str], repeat: int) -> list[dict]:
+    reports = []
+    for parser in parsers:
+        if parser == "selectolax" and not hasattr(web, "parse_lexbor"): continue
+        if hasattr(web, "get_html_parser") and web.get_html_parser(parser) != parser: continue # Not installed - get_html_parser warned
+        for count in links:
+            reports.append(time_cleaning(f"{count} links", [(f"https://example.com/{count}", link_page(count))], parser, repeat))
+        if corpus:
+            reports.append(time_cleaning(os.path.basename(os.path.normpath(corpus)), load_corpus(corpus), parser, repeat))
+    return reports
+
+def run_ref(ref: str, argv: list[str]) -> list[dict]:
+    """
+    Runs this benchmark in a child interpreter on the package of a git commit and returns its reports.
+    """
+    folder = tempfile.mkdtemp(prefix="henryobj-ref-")
+    try:
+        archive = subprocess.run(["git", "-C", REPO_PATH, "archive", ref, "henryobj"], capture_output=True, check=True).stdout
+        subprocess.run(["tar", "-x", "-C", folder], input=archive, check=True)
+        env = dict(os.environ, BENCH_PACKAGE_PATH=folder)
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), *argv, "--json"], env=env, capture_output=True, text=True, check=True).stdout
+        return json.loads(output)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the cleaning of pages by web.py")
+    parser.add_argument("--links", nargs="+", type=int, default=[100, 1000, 5000], help="Links of the test pages")
+    parser.add_argument("--corpus", default=None, help="Folder of saved .html pages")
+    parser.add_argument("--parsers", nargs="+", default=["html.parser", "selectolax"], choices=HTML_PARSERS)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs - the fastest is kept")
+    parser.add_argument("--ref", default=None, help="Also run on the package of this git commit (e.g. HEAD~1)")
+    parser.add_argument("--json", action="store_true", help="Print the reports as JSON")
+    args = parser.parse_args()
+
+    reports = {"current": run(args.links, args.corpus, args.parsers, args.repeat)}
+    if args.ref:
+        argv = ["--links", *map(str, args.links), "--parsers", *args.parsers, "--repeat", str(args.repeat)] + (["--corpus", args.corpus] if args.corpus else [])
+        reports[args.ref] = run_ref(args.ref, argv)
+    if args.json:
+        print(json.dumps(reports["current"] if len(reports) == 1 else reports, indent=2))
+    else:
+        labels = list(reports)
+        by_label = {label: {(r["pages"], r["parser"]): r["ms_per_page"] for r in reports[label]} for label in labels}
+        print(f"{'pages':<20}{'parser':<13}" + "".join(f"{label + ' ms/page':>22}" for label in labels))
+        for report in reports["current"]:
+            key = (report["pages"], report["parser"])
+            print(f"{report['pages']:<20}{report['parser']:<13}" + "".join(f"{by_label[label].get(key, '-'):>22}" for label in labels))
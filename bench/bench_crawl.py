@@ -0,0 +1,106 @@
+# Crawl throughput of web.py against the local test site (bench/fake_site.py).
+#
+# Runs crawl_website and acrawl_website on the same site and reports the pages stored per second and the requests /
+# bytes the site served for them. Example:
+#     python bench/bench_crawl.py --pages 500 --site-pages 2000 --latency 0.02 --concurrency 32 --parse-workers 8
+# --recrawl crawls the site a second time with the HTTP cache (see enable_http_cache) after --changed of its pages changed:
+#     python bench/bench_crawl.py --pages 500 --recrawl --changed 0.1
+
+
+import argparse
+import asyncio
+import tempfile
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_site import start_fake_site, SiteConfig
+from henryobj import web
+
+
+SCENARIOS = ["crawl_website", "acrawl_website"]
+
+
+def run_scenario(scenario: str, server, pages: int, concurrency: int, per_host: int, parse_workers: int, label: str = "") -> dict:
+    """
+    Crawls the test site with a crawler and returns its report. label is added to the name of the scenario.
+    """
+    url = f"http://127.0.0.1:{server.server_port}/"
+    config: SiteConfig = server.config
+    with config.lock:
+        config.counters = dict.fromkeys(config.counters, 0)
+    stats = {}
+    start = time.perf_counter()
+    if scenario == "crawl_website":
+        store = web.crawl_website(url, how_many_pages=pages)
+    else:
+        store = asyncio.run(web.acrawl_website(url, how_many_pages=pages, max_concurrency=concurrency, max_per_host=per_host, parse_workers=parse_workers, stats=stats))
+    duration = time.perf_counter() - start
+    report = {
+        "scenario": scenario + label,
+        "pages": len(store),
+        "seconds": round(duration, 3),
+        "pages_per_sec": round(len(store) / duration, 1),
+        "requests": config.counters["GET"] + config.counters["HEAD"],
+        "requests_per_page": round((config.counters["GET"] + config.counters["HEAD"]) / max(1, len(store)), 2),
+        "kb_per_page": round(config.counters["bytes"] / 1024 / max(1, len(store)), 1),
+        "not_modified": config.counters["not_modified"],
+    }
+    if stats:
+        report["retries"] = stats["retries"]
+        report["failed"] = stats["failed"]
+    cache = web.get_http_cache()
+    if cache is not None:
+        report["cache"] = cache.stats()
+    return report
+
+def run_recrawl(scenario: str, server, cache_path: str, *args) -> list[dict]:
+    """
+    Crawls the test site twice with an empty HTTP cache: once to fill it, then after a new edition of the site.
+    """
+    cache = web.enable_http_cache(cache_path)
+    cache.clear()
+    first = run_scenario(scenario, server, *args, label=" (first)")
+    server.config.new_edition()
+    cache.hits = cache.misses = cache.bytes_saved = cache.bytes_downloaded = 0 # Only count the re-crawl
+    second = run_scenario(scenario, server, *args, label=" (re-crawl)")
+    web.disable_http_cache()
+    return [first, second]
+
+def print_report(reports: list[dict]) -> None:
+    print(f"{'scenario':<28}{'pages':>7}{'seconds':>9}{'pages/s':>9}{'requests':>10}{'req/page':>10}{'KB/page':>9}{'304':>7}{'MB saved':>10}")
+    for r in reports:
+        saved = f"{r['cache']['bytes_saved'] / 1e6:.1f}" if "cache" in r else "-"
+        print(f"{r['scenario']:<28}{r['pages']:>7}{r['seconds']:>9.2f}{r['pages_per_sec']:>9.1f}{r['requests']:>10}{r['requests_per_page']:>10.2f}{r['kb_per_page']:>9.1f}"
+              f"{r['not_modified']:>7}{saved:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the crawlers of web.py against a local test site")
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--pages", type=int, default=300, help="Pages to crawl")
+    parser.add_argument("--site-pages", type=int, default=2000, help="Pages of the test site")
+    parser.add_argument("--latency", type=float, default=0.01, help="Seconds the site takes to answer")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--per-host", type=int, default=32, help="acrawl_website max_per_host - the test site is a single host")
+    parser.add_argument("--parse-workers", type=int, default=0, help="acrawl_website parse_workers - processes parsing the pages, 0 for threads")
+    parser.add_argument("--recrawl", action="store_true", help="Crawl twice with the HTTP cache - the second time after --changed of the pages changed")
+    parser.add_argument("--changed", type=float, default=0.1, help="Share of the pages changing between the crawls of --recrawl")
+    parser.add_argument("--json", action="store_true", help="Print the reports as JSON")
+    args = parser.parse_args()
+
+    server = start_fake_site(SiteConfig(args.site_pages, latency=args.latency, changed=args.changed))
+    crawl_args = (args.pages, args.concurrency, args.per_host, args.parse_workers)
+    if args.recrawl:
+        with tempfile.TemporaryDirectory() as folder:
+            reports = [report for scenario in args.scenarios for report in run_recrawl(scenario, server, os.path.join(folder, "http.sqlite"), *crawl_args)]
+    else:
+        reports = [run_scenario(scenario, server, *crawl_args) for scenario in args.scenarios]
+    server.shutdown()
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        print_report(reports)
@@ -0,0 +1,92 @@
+# Import time of the package - each statement runs in a fresh interpreter so nothing is already in sys.modules.
+#
+# Reports the median time of each statement and the heavy dependencies it ended up importing. Example:
+#     python bench/bench_import_time.py --runs 15 --ref HEAD~1
+# --ref also measures the package as it is in a git commit (extracted with git archive) to compare before / after.
+# Use python -X importtime -c "import henryobj" to see where the time goes module by module.
+
+
+import subprocess
+import statistics
+import argparse
+import tempfile
+import shutil
+import json
+import sys
+import os
+
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["openai", "tiktoken", "requests", "bs4", "pathspec", "numpy"]
+
+STATEMENTS = [
+    "import henryobj",
+    "from henryobj import clean_text",
+    "from henryobj import calculate_token_aproximatively",
+    "from henryobj import *",
+    "from henryobj import oai; oai.client", # The first API call pays for openai + the client
+]
+
+# Runs in the child interpreter - prints the seconds taken by the statement and the heavy modules really imported
+CHILD_CODE = """
+import time, types, sys, json
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+loaded = [name for name in {heavy!r} if type(sys.modules.get(name)) is types.ModuleType]
+print(json.dumps([elapsed, loaded]))
+"""
+
+
+def time_statement(statement: str, package_path: str, runs: int) -> dict:
+    """
+    Runs the statement runs times in fresh interpreters importing the package from package_path.
+    """
+    env = dict(os.environ, PYTHONPATH=package_path, PYTHONDONTWRITEBYTECODE="1")
+    env.setdefault("OAI_API_KEY", "fake") # The client is built with it - older versions build it at import time
+    code = CHILD_CODE.format(statement=statement, heavy=HEAVY_MODULES)
+    timings, loaded = [], []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", code], env=env, cwd=tempfile.gettempdir(), capture_output=True, text=True, check=True).stdout
+        elapsed, loaded = json.loads(output.strip().splitlines()[-1])
+        timings.append(elapsed)
+    return {"statement": statement, "median_ms": round(statistics.median(timings) * 1000, 1), "min_ms": round(min(timings) * 1000, 1), "imports": loaded}
+
+def extract_ref(ref: str) -> str:
+    """
+    Extracts the package as it is in a git commit into a temporary folder and returns the folder.
+    """
+    folder = tempfile.mkdtemp(prefix="henryobj-ref-")
+    archive = subprocess.run(["git", "-C", REPO_PATH, "archive", ref, "henryobj"], capture_output=True, check=True).stdout
+    subprocess.run(["tar", "-x", "-C", folder], input=archive, check=True)
+    return folder
+
+def print_report(reports: dict) -> None:
+    labels = list(reports)
+    print(f"{'statement':<55}" + "".join(f"{label:>14}" for label in labels) + "   imports")
+    for i, statement in enumerate(STATEMENTS):
+        row = [reports[label][i] for label in labels]
+        print(f"{statement:<55}" + "".join(f"{report['median_ms']:>11.1f} ms" for report in row) + "   " + (", ".join(row[0]["imports"]) or "-"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the import time of henryobj in fresh interpreters")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--ref", default=None, help="Also measure the package of this git commit (e.g. HEAD~1)")
+    parser.add_argument("--json", action="store_true", help="Print the reports as JSON")
+    args = parser.parse_args()
+
+    # Bytecode is compiled once here so the runs don't measure it
+    subprocess.run([sys.executable, "-m", "compileall", "-q", os.path.join(REPO_PATH, "henryobj")], check=True)
+    reports = {"current": [time_statement(statement, REPO_PATH, args.runs) for statement in STATEMENTS]}
+    if args.ref:
+        folder = extract_ref(args.ref)
+        try:
+            subprocess.run([sys.executable, "-m", "compileall", "-q", folder], check=True)
+            reports[args.ref] = [time_statement(statement, folder, args.runs) for statement in STATEMENTS]
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        print_report(reports)
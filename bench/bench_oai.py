@@ -0,0 +1,120 @@
+# Load generator for oai.py against the local fake OpenAI server (bench/fake_openai.py).
+#
+# Measures throughput and p50 / p95 / p99 latency of ask_question_gpt, request_chatgpt and embed_text
+# so concurrency and retry changes can be compared offline. Example:
+#     python bench/bench_oai.py --requests 500 --concurrency 32 --latency lognormal --latency-mean 0.2 --p429 0.05
+# Use --base-url to target a server that is already running instead of starting one.
+#
+# Note: ask_question_gpt counts tokens with tiktoken, which needs its encodings to be cached locally.
+
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import argparse
+import json
+import math
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_openai import start_fake_server, add_config_arguments, config_from_arguments
+
+
+SCENARIOS = ["ask_question_gpt", "request_chatgpt", "request_chatgpt_stream", "embed_text"]
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values: return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+def make_call(scenario: str, oai) -> Callable[[int], bool]:
+    """
+    Returns the function doing request #i of a scenario. It returns True if the call succeeded.
+    """
+    if scenario == "ask_question_gpt":
+        return lambda i: oai.ask_question_gpt(f"Question number {i}?", "You are a benchmark.", verbose=False, max_tokens=50) not in ("", oai.OPEN_AI_ISSUE)
+    if scenario == "request_chatgpt":
+        chat = [{"role": "system", "content": "You are a benchmark."}]
+        return lambda i: oai.request_chatgpt(chat + [{"role": "user", "content": f"Question number {i}?"}], max_tokens=50) != oai.OPEN_AI_ISSUE
+    if scenario == "request_chatgpt_stream":
+        chat = [{"role": "system", "content": "You are a benchmark."}]
+        return lambda i: "".join(oai.request_chatgpt_stream(chat + [{"role": "user", "content": f"Question number {i}?"}], max_tokens=50)) != oai.OPEN_AI_ISSUE
+    if scenario == "embed_text":
+        return lambda i: oai.embed_text(f"Paragraph number {i} to embed.") is not None
+    raise ValueError(f"Unknown scenario {scenario}")
+
+def run_scenario(scenario: str, oai, nb_requests: int, concurrency: int) -> dict:
+    """
+    Sends nb_requests calls of the scenario with concurrency threads. Returns the throughput and latency report.
+    """
+    call = make_call(scenario, oai)
+    def timed(i: int) -> tuple[float, bool]:
+        start = time.perf_counter()
+        try:
+            ok = call(i)
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed, range(nb_requests)))
+    duration = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "scenario": scenario,
+        "requests": nb_requests,
+        "concurrency": concurrency,
+        "errors": sum(1 for _, ok in results if not ok),
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(nb_requests / duration, 2) if duration else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+    }
+
+def print_report(reports: list[dict]) -> None:
+    """
+    Prints the reports as an aligned table.
+    """
+    columns = ["scenario", "requests", "concurrency", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "max_ms"]
+    widths = [max(len(column), *(len(str(report[column])) for report in reports)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for report in reports:
+        print("  ".join(str(report[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark oai.py against a fake OpenAI server")
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--base-url", default=None, help="Use a running server instead of starting one")
+    parser.add_argument("--json", action="store_true", help="Print the reports as JSON")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = None
+    if args.base_url is None:
+        server = start_fake_server(config_from_arguments(args))
+        args.base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    # The clients of oai.py are configured from the environment when the module is imported
+    os.environ["OAI_BASE_URL"] = args.base_url
+    os.environ.setdefault("OAI_API_KEY", "fake")
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from henryobj import oai
+
+    reports = [run_scenario(scenario, oai, args.requests, args.concurrency) for scenario in args.scenarios]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        print_report(reports)
+    if server is not None:
+        print(f"Server counters: {server.config.counters}")
+        server.shutdown()
@@ -0,0 +1,107 @@
+# Throughput and output similarity of the HTML backends of web.py (html.parser, lxml, selectolax).
+#
+# Each backend parses every page of the corpus with parse_page (cleaned text + links). The reference is html.parser.
+# We report the pages per second, the speedup, the similarity of the text (word level) and of the links. Example:
+#     python bench/bench_parsers.py --corpus ~/saved_pages --repeat 3
+# The corpus is a folder of .html files (e.g. saved with curl or "Save page as"). Without --corpus, the pages of
+# bench/fake_site.py are used - fine for the speed, use real pages for the similarity.
+
+
+from difflib import SequenceMatcher
+
+import argparse
+import glob
+import json
+import time
+import sys
+import os
+import re
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_site import SiteConfig
+from henryobj import web
+
+
+def load_corpus(folder: str) -> list[tuple[str, str]]:
+    """
+    Returns (url, html) for each .html file of the folder. The url is made up from the file name - it only matters for the per-site rules.
+    """
+    pages = []
+    for path in sorted(glob.glob(os.path.join(os.path.expanduser(folder), "**", "*.htm*"), recursive=True)):
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            pages.append((f"https://{os.path.basename(path).replace('_', '/')}", f.read()))
+    return pages
+
+def text_similarity(reference: str, text: str) -> float:
+    """
+    Similarity of two texts between 0 and 1, on the words.
+    """
+    if reference == text: return 1.0
+    return SequenceMatcher(None, reference.split(), text.split(), autojunk=False).ratio()
+
+def run_backend(parser: str, pages: list[tuple[str, str]], repeat: int) -> tuple[dict, list]:
+    """
+    Parses the corpus repeat times with a backend. Returns its report and the outputs of the last run.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        outputs = [web.parse_page(html, url, web.urlparse(url).netloc, parser) for url, html in pages]
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    report = {"parser": parser, "pages": len(pages), "seconds": round(best, 3), "pages_per_sec": round(len(pages) / best, 1),
+              "mb_per_sec": round(sum(len(html) for _, html in pages) / best / 1e6, 2)}
+    return report, outputs
+
+def compare(reference: list, outputs: list) -> dict:
+    """
+    Mean and min similarity of the texts, mean Jaccard of the links, pages with exactly the same text - and with the same text
+    once the whitespace is removed: the backends keep different whitespace between tags and remove_non_printable glues the words around a newline.
+    """
+    text_scores = [text_similarity(ref_text, text) for (ref_text, _), (text, _) in zip(reference, outputs)]
+    same_chars = sum(re.sub(r"\s", "", ref_text) == re.sub(r"\s", "", text) for (ref_text, _), (text, _) in zip(reference, outputs))
+    link_scores = [len(ref_links & links) / len(ref_links | links) if ref_links | links else 1.0 for (_, ref_links), (_, links) in zip(reference, outputs)]
+    return {
+        "text_similarity": round(sum(text_scores) / len(text_scores), 4),
+        "text_similarity_min": round(min(text_scores), 4),
+        "identical_texts": sum(score == 1.0 for score in text_scores),
+        "identical_without_spaces": same_chars,
+        "links_jaccard": round(sum(link_scores) / len(link_scores), 4),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the HTML backends of web.py")
+    parser.add_argument("--corpus", default=None, help="Folder of saved .html pages")
+    parser.add_argument("--parsers", nargs="+", default=list(web.HTML_PARSERS), choices=web.HTML_PARSERS)
+    parser.add_argument("--pages", type=int, default=200, help="Pages of the test site used without --corpus")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per backend - the fastest is kept")
+    parser.add_argument("--json", action="store_true", help="Print the reports as JSON")
+    args = parser.parse_args()
+
+    if args.corpus:
+        pages = load_corpus(args.corpus)
+    else:
+        site = SiteConfig(args.pages)
+        pages = [(f"http://127.0.0.1/pages/{i}", site.render_page(i)) for i in range(args.pages)]
+    if not pages:
+        sys.exit(f"No .html file in {args.corpus}")
+
+    reports, reference = [], None
+    for name in ["html.parser"] + [name for name in args.parsers if name != "html.parser"]:
+        if web.get_html_parser(name) != name: continue # Not installed - get_html_parser warned
+        report, outputs = run_backend(name, pages, args.repeat)
+        if reference is None:
+            reference, baseline = outputs, report["pages_per_sec"]
+        report["speedup"] = round(report["pages_per_sec"] / baseline, 2)
+        report.update(compare(reference, outputs))
+        reports.append(report)
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        print(f"{'parser':<13}{'pages/s':>9}{'MB/s':>7}{'speedup':>9}{'text sim':>10}{'min sim':>9}{'identical':>11}{'no spaces':>11}{'links':>7}")
+        for r in reports:
+            print(f"{r['parser']:<13}{r['pages_per_sec']:>9.1f}{r['mb_per_sec']:>7.2f}{r['speedup']:>9.2f}{r['text_similarity']:>10.4f}"
+                  f"{r['text_similarity_min']:>9.4f}{r['identical_texts']:>7}/{r['pages']:<3}{r['identical_without_spaces']:>7}/{r['pages']:<3}{r['links_jaccard']:>7.3f}")
@@ -0,0 +1,108 @@
+# Accuracy vs size of the reduced dimensions (embed_text(dimensions=...)) and of the quantized EmbeddingStore (float16 / int8).
+#
+# The reference is the exact search over the full size float32 vectors. For each (dimensions, dtype) we report the bytes
+# per vector, the recall@k of the top k and the mean error on the scores of the reference top k. Example:
+#     python bench/bench_quantization.py --store ~/my_store --dimensions 3072 1024 256 --queries 200
+#
+# Reduced dimensions are simulated by keeping the first n coordinates and normalizing again - what the text-embedding-3
+# models do with the dimensions parameter. Use a store of real embeddings for those numbers: on the synthetic vectors
+# (used without --store) the coordinates are all equally important, so the dtypes are meaningful but the dimensions are not.
+
+
+import argparse
+import tempfile
+import shutil
+import json
+import time
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OAI_API_KEY", "fake")  # Importing the package builds the OpenAI client - no call is made
+from henryobj.vectors import EmbeddingStore, STORE_DTYPES, normalize_rows
+from bench_ann import synthetic_vectors, print_report
+
+
+def build_store(folder: str, vectors: np.ndarray, dtype: str, batch: int = 10000) -> EmbeddingStore:
+    """
+    Creates a store of the given dtype in folder and fills it with the vectors.
+    """
+    store = EmbeddingStore(folder, vectors.shape[1], dtype)
+    for start in range(0, len(vectors), batch):
+        block = vectors[start:start + batch]
+        store.add([str(start + i) for i in range(len(block))], block)
+    return store
+
+def store_size(folder: str) -> int:
+    """
+    Bytes of the vectors of a store on disk (vectors and scales, not the records).
+    """
+    return sum(os.path.getsize(os.path.join(folder, name)) for name in ("vectors.bin", "scales.bin") if os.path.exists(os.path.join(folder, name)))
+
+def run(vectors: np.ndarray, queries: np.ndarray, dimensions: list[int], dtypes: list[str], k: int) -> list[dict]:
+    """
+    Builds one store per (dimensions, dtype) and compares its searches with the full size float32 exact search.
+    """
+    reference_scores = queries @ vectors.T
+    reference = [np.argsort(-scores)[:k] for scores in reference_scores]
+    reports = []
+    for nb_dimensions in dimensions:
+        reduced = normalize_rows(vectors[:, :nb_dimensions])
+        reduced_queries = normalize_rows(queries[:, :nb_dimensions])
+        for dtype in dtypes:
+            folder = tempfile.mkdtemp(prefix="bench_quantization_")
+            try:
+                store = build_store(folder, reduced, dtype)
+                start = time.perf_counter()
+                found = [store.search_rows(query, k)[0] for query in reduced_queries]
+                ms = (time.perf_counter() - start) / len(queries) * 1000
+                recall = np.mean([len(np.intersect1d(a, b)) / k for a, b in zip(found, reference)])
+                errors = [np.abs(store.score_rows(rows, query) - scores[rows]).mean()
+                          for rows, query, scores in zip(reference, reduced_queries, reference_scores)]
+                size = store_size(folder)
+                reports.append({
+                    "dimensions": nb_dimensions,
+                    "dtype": dtype,
+                    "bytes_per_vector": round(size / len(store), 1),
+                    "size_vs_full_float32": f"{size / (vectors.shape[0] * vectors.shape[1] * 4):.1%}",
+                    "recall_at_k": round(float(recall), 4),
+                    "mean_score_error": round(float(np.mean(errors)), 5),
+                    "ms_per_query": round(ms, 3),
+                })
+            finally:
+                shutil.rmtree(folder, ignore_errors=True)
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Accuracy vs size of reduced dimensions and quantized stores")
+    parser.add_argument("--store", default=None, help="EmbeddingStore of full size embeddings. Synthetic vectors otherwise")
+    parser.add_argument("--rows", type=int, default=50000, help="Rows used (synthetic, or the first rows of the store)")
+    parser.add_argument("--full-dimensions", type=int, default=1536, help="Size of the synthetic vectors")
+    parser.add_argument("--dimensions", type=int, nargs="+", default=None, help="Defaults to full, 1/2, 1/4 and 1/8 of the full size")
+    parser.add_argument("--dtypes", nargs="+", default=list(STORE_DTYPES), choices=STORE_DTYPES)
+    parser.add_argument("--topics", type=int, default=500, help="Clusters of the synthetic data")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the reports as JSON")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.store:
+        source = EmbeddingStore(args.store)
+        vectors = source.get_vectors(slice(0, min(args.rows, len(source))))
+    else:
+        vectors = synthetic_vectors(args.rows, args.full_dimensions, args.topics, rng)
+    picked = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+    queries = normalize_rows(picked + rng.normal(scale=0.5 / np.sqrt(vectors.shape[1]), size=picked.shape))
+    full = vectors.shape[1]
+    dimensions = args.dimensions or [full, full // 2, full // 4, full // 8]
+    reports = run(vectors, queries, [min(n, full) for n in dimensions], args.dtypes, args.k)
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        print(f"{len(vectors)} vectors of {full} dimensions, recall@{args.k} against the full size float32 search")
+        print_report(reports)
@@ -0,0 +1,137 @@
+# Calibration of calculate_token_aproximatively against the real tokenizer (calculate_token).
+#
+# Reports how far the estimate is from the tiktoken count (ratio estimate / real), how often it underestimates,
+# and the speed of the estimator vs tiktoken on the same texts. Example:
+#     python bench/calibrate_token_estimator.py ./crawled_pages/ --model gpt-4o-mini
+# Each file is one text (use --split-lines for one text per line). Without paths, a small built-in sample is used.
+#
+# Note: calculate_token needs the tiktoken encodings to be cached locally.
+
+
+from typing import Callable
+
+import argparse
+import json
+import math
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OAI_API_KEY", "fake")  # No call is made - the client just needs a key to be built
+from henryobj import oai
+
+
+SAMPLE_TEXTS = [
+    "The quick brown fox jumps over the lazy dog. " * 20,
+    "Le renard brun rapide saute par-dessus le chien paresseux, n'est-ce pas ? " * 10,
+    "Der schnelle braune Fuchs springt über den faulen Hund. Größe, Straße, Übermaß. " * 10,
+    "敏捷的棕色狐狸跳过了懒狗。今天天气很好，我们去公园散步吧。" * 10,
+    "def add(a: int, b: int) -> int:\n    return a + b  # {'key': [1, 2, 3]}\n" * 15,
+    "<div class=\"nav\"><a href=\"/home?id=42&amp;ref=top\">Home</a></div>\n" * 15,
+    "Price: $1,299.99 - SKU #A-1029/XL (2024-05-17) | Tel: +33 6 12 34 56 78 " * 10,
+    "Быстрая коричневая лиса прыгает через ленивую собаку. " * 10,
+]
+
+
+def old_estimate(text: str) -> int:
+    """
+    The per char loop calculate_token_aproximatively used before - kept as the speed baseline.
+    """
+    nb_words = len(text.split())
+    normal, special, asci = 0,0,0
+    for char in text:
+        if str(char).isalnum():
+            normal +=1
+        elif str(char).isascii():
+            asci +=1
+        else:
+            special +=1
+    res = int(normal/4) + int(asci/2) + 2 * special + 2
+    if normal < special + asci:
+        return int(1.362 * (res + int(asci/2) +1))
+    return int(1.362 * int((res+nb_words)/2))
+
+def load_texts(paths: list[str], split_lines: bool) -> list[str]:
+    """
+    Reads the files (folders are walked). Returns the non empty texts.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += [os.path.join(root, name) for root, _, names in os.walk(path) for name in sorted(names)]
+        else:
+            files.append(path)
+    texts = []
+    for file in files:
+        try:
+            with open(file, "r", encoding="utf-8", errors="ignore") as f:
+                content = f.read()
+        except OSError as e:
+            print(f"Skipping {file}: {e}")
+            continue
+        texts += content.splitlines() if split_lines else [content]
+    return [text for text in texts if text.strip()]
+
+def timed(function: Callable, *args) -> tuple[float, object]:
+    """
+    Returns (seconds, result) of a call.
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values: return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+def calibrate(texts: list[str], model: str) -> dict:
+    """
+    Compares the estimates with the real token counts. Returns the report.
+    """
+    real_time, real = timed(oai.calculate_tokens_batch, texts, model, 1)
+    estimate_time, estimates = timed(oai.calculate_tokens_aproximatively_batch, texts)
+    old_time, _ = timed(lambda: [old_estimate(text) for text in texts])
+    pairs = [(estimate, count) for estimate, count in zip(estimates, real) if count > 0]
+    ratios = sorted(estimate / count for estimate, count in pairs)
+    nb_chars = sum(len(text) for text in texts)
+    return {
+        "model": model,
+        "texts": len(texts),
+        "chars": nb_chars,
+        "real_tokens": sum(count for _, count in pairs),
+        "estimated_tokens": sum(estimate for estimate, _ in pairs),
+        "ratio_mean": round(sum(ratios) / len(ratios), 3) if ratios else 0.0,
+        "ratio_p5": round(percentile(ratios, 5), 3),
+        "ratio_p50": round(percentile(ratios, 50), 3),
+        "ratio_p95": round(percentile(ratios, 95), 3),
+        "underestimated_pct": round(100 * sum(1 for ratio in ratios if ratio < 1) / len(ratios), 2) if ratios else 0.0,
+        "mean_abs_error_pct": round(100 * sum(abs(ratio - 1) for ratio in ratios) / len(ratios), 2) if ratios else 0.0,
+        "tiktoken_mchars_per_s": round(nb_chars / real_time / 1e6, 2) if real_time else 0.0,
+        "estimator_mchars_per_s": round(nb_chars / estimate_time / 1e6, 2) if estimate_time else 0.0,
+        "old_loop_mchars_per_s": round(nb_chars / old_time / 1e6, 2) if old_time else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the approximate token estimator against tiktoken")
+    parser.add_argument("paths", nargs="*", help="Files or folders of texts. Uses a built-in sample if empty")
+    parser.add_argument("--model", default=oai.MODEL_CHAT)
+    parser.add_argument("--split-lines", action="store_true", help="One text per line instead of one per file")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    texts = load_texts(args.paths, args.split_lines) if args.paths else SAMPLE_TEXTS
+    if not texts:
+        sys.exit("No text to calibrate on")
+    report = calibrate(texts, args.model)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        width = max(len(key) for key in report)
+        for key, value in report.items():
+            print(f"{key.ljust(width)}  {value}")
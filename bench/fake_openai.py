@@ -0,0 +1,267 @@
+# Local stand-in for the OpenAI API - to benchmark oai.py without spending money or hitting real quotas.
+#
+# Implements /v1/chat/completions (with streaming), /v1/embeddings and /v1/models with configurable latency
+# and error injection. Run it standalone then point oai.py at it:
+#     python bench/fake_openai.py --port 8765 --latency lognormal --latency-mean 0.3 --p429 0.05
+#     OAI_BASE_URL=http://127.0.0.1:8765/v1 OAI_API_KEY=fake python my_script.py
+
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional
+
+import threading
+import argparse
+import hashlib
+import random
+import struct
+import base64
+import json
+import math
+import time
+
+
+EMBEDDING_DIMENSIONS = {"text-embedding-3-large": 3072, "text-embedding-3-small": 1536, "text-embedding-ada-002": 1536}
+WORDS = "the quick brown fox jumps over the lazy dog while the model keeps on writing its answer".split()
+
+
+# ****************************************** CONFIG ***********************************************
+
+class FakeConfig:
+    """
+    Behaviour of the fake server. Can be changed while the server runs.
+
+    Args:
+        latency (str): Distribution of the time before the answer (or the first token) - 'fixed', 'uniform', 'exponential' or 'lognormal'.
+        latency_mean (float): Mean of the distribution in seconds.
+        latency_spread (float): Width for 'uniform' (mean +/- spread) or sigma for 'lognormal'. Ignored otherwise.
+        token_delay (float): Seconds between two streamed tokens.
+        p429 (float): Probability to answer with a rate limit error.
+        p5xx (float): Probability to answer with a 500 / 503 error.
+        completion_tokens (int): Max number of words of an answer (also capped by max_tokens).
+    """
+    def __init__(self, latency: str = "fixed", latency_mean: float = 0.05, latency_spread: float = 0.5, token_delay: float = 0.0,
+                 p429: float = 0.0, p5xx: float = 0.0, completion_tokens: int = 20, seed: Optional[int] = None):
+        self.latency = latency
+        self.latency_mean = latency_mean
+        self.latency_spread = latency_spread
+        self.token_delay = token_delay
+        self.p429 = p429
+        self.p5xx = p5xx
+        self.completion_tokens = completion_tokens
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = {"chat": 0, "embeddings": 0, "429": 0, "5xx": 0}
+
+    def sample_latency(self) -> float:
+        """
+        Returns a latency in seconds drawn from the configured distribution.
+        """
+        with self.lock:
+            if self.latency == "uniform":
+                return max(0.0, self.random.uniform(self.latency_mean - self.latency_spread, self.latency_mean + self.latency_spread))
+            if self.latency == "exponential":
+                return self.random.expovariate(1 / self.latency_mean) if self.latency_mean > 0 else 0.0
+            if self.latency == "lognormal":
+                # mu chosen so the mean of the distribution is latency_mean
+                sigma = self.latency_spread
+                mu = math.log(self.latency_mean) - sigma ** 2 / 2 if self.latency_mean > 0 else 0.0
+                return self.random.lognormvariate(mu, sigma) if self.latency_mean > 0 else 0.0
+            return self.latency_mean
+
+    def sample_error(self) -> Optional[int]:
+        """
+        Returns the HTTP status of the error to inject, or None.
+        """
+        with self.lock:
+            draw = self.random.random()
+            if draw < self.p429:
+                self.counters["429"] += 1
+                return 429
+            if draw < self.p429 + self.p5xx:
+                self.counters["5xx"] += 1
+                return self.random.choice([500, 503])
+            return None
+
+    def count(self, name: str) -> None:
+        """
+        Increments one of the request counters.
+        """
+        with self.lock:
+            self.counters[name] += 1
+
+# ****************************************** HANDLER **********************************************
+
+def fake_embedding(text: str, dimensions: int) -> list[float]:
+    """
+    Deterministic unit vector derived from the text - the same text always gets the same embedding.
+    """
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    vector = [rng.gauss(0, 1) for _ in range(dimensions)]
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the fake server. The FakeConfig is attached to the server.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # Silent - the benchmark prints what matters
+
+    def send_json(self, status: int, payload: dict, headers: Optional[dict] = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status: int) -> None:
+        if status == 429:
+            message = "Rate limit reached for requests on the fake server. Please try again in 20ms."
+            self.send_json(429, {"error": {"message": message, "type": "requests", "param": None, "code": "rate_limit_exceeded"}}, {"retry-after-ms": "20"})
+        else:
+            self.send_json(status, {"error": {"message": "The fake server had an error while processing your request.", "type": "server_error", "param": None, "code": None}})
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            models = ["gpt-4o-mini", "gpt-4o", "gpt-3.5-turbo", "gpt-4", "gpt-4-1106-preview"] + list(EMBEDDING_DIMENSIONS)
+            self.send_json(200, {"object": "list", "data": [{"id": model, "object": "model", "created": 0, "owned_by": "fake"} for model in models]})
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        config: FakeConfig = self.server.config
+        try:
+            payload = self.read_json()
+        except Exception:
+            self.send_json(400, {"error": {"message": "Invalid JSON body", "type": "invalid_request_error"}})
+            return
+        if self.path.endswith("/chat/completions"):
+            config.count("chat")
+            handler = self.handle_chat
+        elif self.path.endswith("/embeddings"):
+            config.count("embeddings")
+            handler = self.handle_embeddings
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+        time.sleep(config.sample_latency())
+        error = config.sample_error()
+        if error:
+            self.send_error_json(error)
+            return
+        handler(payload, config)
+
+    def handle_chat(self, payload: dict, config: FakeConfig) -> None:
+        model = payload.get("model", "gpt-4o-mini")
+        messages = payload.get("messages", [])
+        prompt_tokens = sum(len(str(message.get("content", "")).split()) + 4 for message in messages)
+        nb_words = max(1, min(config.completion_tokens, int(payload.get("max_tokens") or config.completion_tokens)))
+        words = [WORDS[i % len(WORDS)] for i in range(nb_words)]
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": nb_words, "total_tokens": prompt_tokens + nb_words}
+        created = int(time.time())
+        completion_id = f"chatcmpl-fake{random.getrandbits(48):x}"
+        if not payload.get("stream"):
+            self.send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop", "logprobs": None}],
+                "usage": usage,
+            })
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        def send_chunk(delta: dict, finish_reason: Optional[str] = None, chunk_usage: Optional[dict] = None, choices: bool = True) -> None:
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}] if choices else [],
+                     "usage": chunk_usage}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        send_chunk({"role": "assistant", "content": ""})
+        for i, word in enumerate(words):
+            if i and config.token_delay:
+                time.sleep(config.token_delay)
+            send_chunk({"content": word if i == 0 else " " + word})
+        send_chunk({}, finish_reason="stop")
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            send_chunk({}, chunk_usage=usage, choices=False)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def handle_embeddings(self, payload: dict, config: FakeConfig) -> None:
+        model = payload.get("model", "text-embedding-3-small")
+        inputs = payload.get("input", "")
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        if not inputs or any(not isinstance(text, str) or text == "" for text in inputs):
+            self.send_json(400, {"error": {"message": "'input' must be a non empty string or list of non empty strings", "type": "invalid_request_error"}})
+            return
+        dimensions = payload.get("dimensions") or EMBEDDING_DIMENSIONS.get(model, 1536)
+        data = []
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(text, dimensions)
+            if payload.get("encoding_format") == "base64":
+                embedding = base64.b64encode(struct.pack(f"<{len(vector)}f", *vector)).decode("ascii")
+            else:
+                embedding = vector
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(len(text.split()) for text in inputs)
+        self.send_json(200, {"object": "list", "data": data, "model": model, "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+# ****************************************** SERVER ***********************************************
+
+def start_fake_server(config: Optional[FakeConfig] = None, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """
+    Starts the fake server in a background thread and returns it. port=0 picks a free port.
+    The base URL to give to the OpenAI client is f"http://{host}:{server.server_port}/v1". Stop it with server.shutdown().
+    """
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.config = config or FakeConfig()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def add_config_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Adds the FakeConfig options to a command line parser. Shared with bench_oai.py.
+    """
+    parser.add_argument("--latency", default="fixed", choices=["fixed", "uniform", "exponential", "lognormal"])
+    parser.add_argument("--latency-mean", type=float, default=0.05, help="Seconds")
+    parser.add_argument("--latency-spread", type=float, default=0.5, help="Half width for uniform, sigma for lognormal")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between two streamed tokens")
+    parser.add_argument("--p429", type=float, default=0.0, help="Probability of a rate limit error")
+    parser.add_argument("--p5xx", type=float, default=0.0, help="Probability of a 500 / 503 error")
+    parser.add_argument("--completion-tokens", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=None)
+
+def config_from_arguments(args: argparse.Namespace) -> FakeConfig:
+    """
+    Builds the FakeConfig from the options added by add_config_arguments.
+    """
+    return FakeConfig(args.latency, args.latency_mean, args.latency_spread, args.token_delay, args.p429, args.p5xx, args.completion_tokens, args.seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    server = start_fake_server(config_from_arguments(args), args.host, args.port)
+    print(f"Fake OpenAI server on http://{args.host}:{server.server_port}/v1 - Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,182 @@
+# Local test website - to benchmark the crawlers of web.py without hitting real sites.
+#
+# Serves pages/N (N < --pages) made of a header, a nav, paragraphs with links to other pages in the text and a footer,
+# plus a few PDF links to check the non text pages are skipped. The pages are the same for a given N and edition - they are sent
+# with an ETag / Last-Modified and a conditional request for an unchanged page gets a 304. Example:
+#     python bench/fake_site.py --port 8766 --pages 2000 --latency 0.02
+#     python -c "import asyncio, henryobj; print(len(asyncio.run(henryobj.acrawl_website('http://127.0.0.1:8766/', 500))))"
+
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from email.utils import formatdate
+from typing import Optional
+
+import threading
+import argparse
+import random
+import time
+
+
+WORDS = "the crawler reads every page of the site and keeps the text that matters while the navigation is thrown away".split()
+
+
+# ****************************************** CONFIG ***********************************************
+
+class SiteConfig:
+    """
+    Behaviour of the test site. Can be changed while the server runs.
+
+    Args:
+        pages (int): Number of pages - pages/0 to pages/{pages - 1}. / is pages/0.
+        links (int): Links to other pages in the text of a page. The nav adds 10 more.
+        paragraphs (int): Paragraphs of a page.
+        latency (float): Seconds before answering a request.
+        changed (float): Share of the pages that change with each edition (see new_edition) - to test the re-crawls.
+    """
+    def __init__(self, pages: int = 1000, links: int = 8, paragraphs: int = 12, latency: float = 0.0, changed: float = 0.0):
+        self.pages = pages
+        self.links = links
+        self.paragraphs = paragraphs
+        self.latency = latency
+        self.changed = changed
+        self.edition = 0
+        self.lock = threading.Lock()
+        self.counters = {"GET": 0, "HEAD": 0, "bytes": 0, "not_modified": 0}
+
+    def count(self, method: str, size: int, not_modified: bool = False) -> None:
+        with self.lock:
+            self.counters[method] += 1
+            self.counters["bytes"] += size
+            self.counters["not_modified"] += not_modified
+
+    def new_edition(self) -> None:
+        """
+        Changes the text of the changed share of the pages - as a site the next day.
+        """
+        with self.lock:
+            self.edition += 1
+
+    def page_edition(self, index: int) -> int:
+        """
+        The edition pages/index was last changed in.
+        """
+        return self.edition if index % 100 < self.changed * 100 else 0
+
+    def validators(self, index: int) -> tuple[str, str]:
+        """
+        Returns the (ETag, Last-Modified) of pages/index - they change with its text.
+        """
+        edition = self.page_edition(index)
+        return f'"{index}-{edition}"', formatdate(1700000000 + edition * 86400, usegmt=True)
+
+    def render_page(self, index: int) -> str:
+        """
+        Returns the HTML of pages/index - the same every time.
+        """
+        rng = random.Random(index)
+        nav = "".join(f'<a href="/pages/{i}">Section {i}</a>' for i in range(10))
+        paragraphs = []
+        for p in range(self.paragraphs):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(40, 90))]
+            if p < self.links:
+                # A link surrounded by text - kept by clean_soup
+                words.insert(rng.randint(0, len(words)), f'<a href="/pages/{rng.randrange(self.pages)}">more about {rng.choice(WORDS)}</a>')
+            if p % 5 == 4:
+                words.append(f'see <a href="/files/{index}-{p}.pdf">the document</a>')
+            paragraphs.append(f"<p>{' '.join(words).capitalize()}.</p>")
+        edition = self.page_edition(index)
+        if edition:
+            paragraphs.insert(0, f"<p>Updated in edition {edition} of the site.</p>")
+        return (
+            f"<!DOCTYPE html><html lang='en'><head><title>Page {index}</title><style>p {{margin: 0}}</style>"
+            f"<script>var page = {index};</script></head><body>"
+            f"<header><h1>Test site</h1></header><nav>{nav}</nav>"
+            f"<main><h2>Page {index}</h2>{''.join(paragraphs)}</main>"
+            f"<footer><a href='/pages/0'>Home</a> <button>Subscribe</button></footer></body></html>"
+        )
+
+
+# ****************************************** HANDLER **********************************************
+
+class SiteHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the test site. The SiteConfig is attached to the server.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # Silent - the benchmark prints what matters
+
+    def answer(self, send_body: bool) -> None:
+        config: SiteConfig = self.server.config
+        if config.latency:
+            time.sleep(config.latency)
+        path = self.path.split("?")[0].rstrip("/")
+        status, content_type, body, validators = 404, "text/plain", b"Not found", None
+        if path == "":
+            path = "/pages/0"
+        if path.startswith("/pages/") and path[7:].isdigit() and int(path[7:]) < config.pages:
+            index = int(path[7:])
+            validators = config.validators(index)
+            if self.headers.get("If-None-Match") == validators[0] or (self.headers.get("If-None-Match") is None and self.headers.get("If-Modified-Since") == validators[1]):
+                status, body = 304, b""
+            else:
+                status, content_type, body = 200, "text/html; charset=utf-8", config.render_page(index).encode("utf-8")
+        elif path.startswith("/files/"):
+            status, content_type, body = 200, "application/pdf", b"%PDF-1.4 " + b"0" * 20000
+        self.send_response(status)
+        if validators:
+            self.send_header("ETag", validators[0])
+            self.send_header("Last-Modified", validators[1])
+        if status != 304:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+        config.count(self.command, len(body) if send_body else 0, status == 304)
+
+    def do_GET(self):
+        self.answer(True)
+
+    def do_HEAD(self):
+        self.answer(False)
+
+
+# ****************************************** SERVER ***********************************************
+
+class SiteServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256 # The default (5) refuses connections when the crawler opens many at once
+
+def start_fake_site(config: Optional[SiteConfig] = None, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """
+    Starts the test site in a background thread and returns it. port=0 picks a free port.
+    The home page is f"http://{host}:{server.server_port}/". Stop it with server.shutdown().
+    """
+    server = SiteServer((host, port), SiteHandler)
+    server.config = config or SiteConfig()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local test website")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--links", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds")
+    parser.add_argument("--changed", type=float, default=0.0, help="Share of the pages changing with each edition")
+    parser.add_argument("--edition", type=int, default=0, help="Edition of the site - the pages of --changed differ from one to the next")
+    args = parser.parse_args()
+    config = SiteConfig(args.pages, args.links, latency=args.latency, changed=args.changed)
+    config.edition = args.edition
+    server = start_fake_site(config, args.host, args.port)
+    print(f"Test site on http://{args.host}:{server.server_port}/ - Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,7 +1,94 @@
 # To be able to do "from henryobj import function_name"
 
-from .base import *
-from .web import *
-from .gpt import * 
-from .oai import *
-from .config import MODEL_EMB_SMALL, HTTP_STRICT_URL_PATTERN, MAX_TOKEN_OUTPUT, MODEL_OLD
\ No newline at end of file
+# The submodules are imported on first use (PEP 562) - "from henryobj import clean_text" doesn't pay for openai, tiktoken, requests or bs4.
+# A new public name of a submodule must be added to _LAZY_NAMES - tests/test_init.py checks the table against the submodules.
+
+from .config import MODEL_EMB_SMALL, HTTP_STRICT_URL_PATTERN, MAX_TOKEN_OUTPUT, MODEL_OLD
+from .metrics import metrics # Only the standard library - and henryobj.metrics has always been the registry, not the submodule
+
+
+import importlib
+
+
+# The submodules that are attributes of the package. Not metrics: henryobj.metrics is the registry - "from henryobj.metrics import ..." for the module
+_SUBMODULES = ("base", "web", "gpt", "oai", "vectors", "batch", "cache", "config", "ratelimit")
+
+# Same order as the star imports this replaces: if two submodules define a name, the last one wins
+_LAZY_NAMES = {
+    "base": (
+        "check_co", "check__if_password_safe", "clean_punctuation", "clean_text", "convert_dict_to_text", "correct_spaces_in_text",
+        "count_occurrence_in_text", "custom_round", "extract_dict_from_str", "find_sentence_boundary", "is_json", "generate_unique_integer",
+        "get_content_of_file", "get_path_repo_of_module", "get_path_of_module", "get_module_name", "get_name_of_variable", "lazy_import",
+        "log_issue", "log_warning", "log_papertrail", "log_issue_papertrail", "log_warning_papertrail", "log_work_papertrail",
+        "print_style", "lprint", "fprint", "perf", "print_dir_structure", "read_gitignore", "remove_break_lines", "remove_jump_double_punc",
+        "remove_excess", "remove_non_printable", "remove_non_printable_light", "remove_punctuation", "safe_json_load", "sanitize_json_response",
+        "sanitize_text", "split_into_sentences", "try_json_loads", "write_locally", "ensure_valid_date", "format_datetime", "format_timestamp",
+        "get_days_from_date", "get_now",
+    ),
+    "web": (
+        "create_session", "get_session", "session", "clean_soup", "clean_url_to_filename", "clean_url_into_title", "content_type_is_text",
+        "crawl_handle_fetch_result", "crawl_website", "fetch_hyperlinks", "fetch_content_url", "is_useful_link", "fetch_domain_links",
+        "get_primary_lang_code", "remove_citations", "remove_long_sentences", "remove_reviews", "wrap_handle_fetch_result", "check_valid_url",
+        "clean_url", "get_local_domain", "get_domain_links", "get_hyperlinks_from_soup", "parse_page", "fetch_html", "fetch_page", "acrawl_website", "afetch_page",
+        "HTML_PARSERS", "TAGS_TO_DECOMPOSE", "REVIEW_CLASS_PATTERN", "clean_html", "clean_lexbor_tree", "filter_hyperlinks", "get_html_parser",
+        "get_hyperlinks_from_lexbor", "is_useful_lexbor_link", "parse_lexbor", "CITATION_ID_PATTERN", "JS_NEEDED_MESSAGE", "TEXT_STRING_TYPES",
+        "CleaningRules", "DEFAULT_CLEANING_RULES", "SITE_CLEANING_RULES", "count_text_chars", "get_cleaning_rules", "prune_soup",
+        "disable_http_cache", "enable_http_cache", "get_http_cache", "fetch_html_conditional", "afetch_page_conditional",
+    ),
+    "gpt": (
+        "contains_code", "joining_and_summarizing_modules", "process_directory", "progress_indicator", "gpt_bugbounty_generator",
+        "gpt_generate_bb_report", "gpt_readme_generator", "gpt_generate_readme", "ROLE_README_GENERATOR", "generate_role_readme_reviewer",
+        "ROLE_BUG_BOUNTY", "generate_role_bug_bounty_reviewer",
+    ),
+    "oai": (
+        "OAI_KEY", "OAI_BASE_URL", "get_client", "get_aclient", "client", "aclient", "rate_limiter", "SENTENCE_BOUNDARY_PATTERN",
+        "WORD_BOUNDARY_PATTERN", "ASCII_ALNUM_BYTES", "ASCII_RUN_PATTERN", "ALNUM_RUN_PATTERN", "get_encoder", "disable_completion_cache",
+        "disable_embedding_cache", "enable_completion_cache", "enable_embedding_cache", "get_completion_cache", "get_embedding_cache",
+        "lookup_completion_cache", "store_completion_cache", "GPT_MESSAGE_MARKER_PATTERN", "Conversation", "get_chat_messages",
+        "add_content_to_chatTable", "calculate_token", "calculate_token_aproximatively", "calculate_tokens_batch",
+        "calculate_tokens_aproximatively_batch", "change_role_chatTable", "check_for_ai_warning", "check_if_gptconv_format", "chunk_text_spans",
+        "count_char_classes", "check_token_window", "check_valid_gpt_conversation", "new_chunk_text", "estimate_chat_tokens",
+        "estimate_token_from_char_classes", "fits_token_window", "get_hedge_delay", "get_max_token_window", "get_rate_limit_delay",
+        "get_gptconv_readable_format", "handle_failed_chat_attempt", "initialize_role_in_chatTable", "is_rate_limit_error", "iter_chunk_text",
+        "iter_gpt_conversation", "make_string_json_safe", "print_gpt_models", "print_gptconv_nicely", "print_len_token_price", "record_call",
+        "repair_gpt_conversation", "retry_if_too_short", "set_rate_limit", "sanitize_bad_gpt_output", "self_affirmation_role",
+        "strip_gpt_message_delimiters", "ask_question_gpt", "ask_question_gpt4", "ask_question_gpto", "ask_question_gpt_map_reduce", "embed_batch", "embed_text", "embed_texts",
+        "open_hedged_stream", "pack_embedding_batches", "pack_reduce_groups", "request_chatgpt", "request_chatgpt_stream", "aask_question_gpt", "aembed_text",
+        "ahedged_chat_completion", "arequest_chatgpt",
+    ),
+    "vectors": (
+        "NO_RESULTS", "STORE_DTYPES", "EmbeddingStore", "IVFIndex", "normalize_rows", "assign_clusters", "spherical_kmeans", "top_k", "top_k_blocks",
+    ),
+    "batch": (
+        "BATCH_TERMINAL_STATUSES", "BatchTransport", "OpenAIBatchTransport", "LocalBatchTransport", "BatchJob",
+    ),
+    "metrics": (
+        "SKIPPED_FILES", "STDLIB_PATH", "THIRD_PARTY_FOLDERS", "get_call_cost", "get_call_site", "MetricsRegistry", "percentile",
+    ),
+}
+_NOT_CACHED = ("client", "aclient", "session") # Built on first use and can be replaced (e.g. oai.client = fake) - always read from the submodule
+_NAME_TO_SUBMODULE = {name: submodule for submodule, names in _LAZY_NAMES.items() for name in names}
+
+__all__ = ["MODEL_EMB_SMALL", "HTTP_STRICT_URL_PATTERN", "MAX_TOKEN_OUTPUT", "MODEL_OLD", "metrics", *(name for name in _NAME_TO_SUBMODULE if name not in _NOT_CACHED)]
+
+
+def __getattr__(name: str):
+    """
+    Imports the submodule defining name on first access and caches the value, so the next accesses are plain lookups.
+    """
+    if name.startswith("__"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    # Not listed: the config constants, which the star imports used to export too - config is already imported
+    submodule = _NAME_TO_SUBMODULE.get(name, "config")
+    module = importlib.import_module(f".{submodule}", __name__)
+    if not hasattr(module, name):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(module, name)
+    if name not in _NOT_CACHED:
+        globals()[name] = value
+    return value
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
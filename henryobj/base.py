@@ -6,13 +6,13 @@ from .config import WARNING_UNKNOWN, CODE_ERR_PT, CODE_WARN_PT, CODE_DAILY_PT
 
 from typing import Callable, Any, Union, Optional
 from collections import Counter
-import pathspec
+import importlib.util
 import datetime
-import requests
 import inspect
 import random
 import json
 import time
+import sys
 import ast
 import os
 import re
@@ -24,6 +24,7 @@ def check_co() -> bool:
     """
     Returns true if we have an internet connection. False otherwise.
     """
+    import requests # Local - requests is slow to import and only needed here
     try:
         requests.head("http://google.com")
         return True
@@ -173,6 +174,25 @@ def get_name_of_variable(value) -> Optional[Any]:
             return var_name
     return None
 
+def lazy_import(name: str):
+    """
+    Returns the module without executing it - it is imported on the first access to one of its attributes.
+    Used for the heavy dependencies (openai, tiktoken...) so "import henryobj" stays fast. An already imported module is returned as is.
+
+    Note:
+        Don't access an attribute of the module at import time (a class in an annotation, a default value...) or it gets imported right away.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
 def log_issue(exception: Exception, func: Callable[..., Any], additional_info: str = "") -> None:
     """
     Logs an issue. Can be called anywhere and will display an error message showing the module, the function, the exception and if specified, the additional info.
@@ -388,6 +408,7 @@ def read_gitignore(repository_path: str):
     """
     Read the .gitignore file in the given directory and return a PathSpec object.
     """
+    import pathspec # Local - only needed here
     gitignore_path = os.path.join(repository_path, '.gitignore')
     if os.path.isfile(gitignore_path):
         with open(gitignore_path, 'r') as file:
@@ -0,0 +1,527 @@
+# Offline batch jobs - tens of thousands of chat completions sent as batch files instead of one request_chatgpt call each.
+
+
+from .config import (
+    MODEL_CHAT, MAX_TOKEN_OUTPUT_DEFAULT, OPEN_AI_ISSUE,
+    BATCH_ENDPOINT, BATCH_COMPLETION_WINDOW, BATCH_MAX_REQUESTS, BATCH_MAX_BYTES, BATCH_POLL_INTERVAL
+)
+from .base import log_issue, log_warning
+from . import oai
+
+
+from typing import Optional, Iterator, Callable
+
+import concurrent.futures
+import threading
+import abc
+import tempfile
+import shutil
+import json
+import time
+import uuid
+import os
+
+
+BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+# ****************************************** TRANSPORTS *******************************************
+
+class BatchTransport(abc.ABC):
+    """
+    How a BatchJob talks to the provider: upload a file of requests, start a batch on it, check its status and read the files of results.
+    The batch ids and file ids are strings chosen by the transport. Subclass it to target another provider - every method must be
+    implemented, a subclass missing one can't be instantiated.
+    """
+    @abc.abstractmethod
+    def upload(self, path: str) -> str:
+        """
+        Uploads a JSONL file of requests. Returns its file id.
+        """
+
+    @abc.abstractmethod
+    def submit(self, file_id: str, endpoint: str = BATCH_ENDPOINT, completion_window: str = BATCH_COMPLETION_WINDOW) -> str:
+        """
+        Starts a batch on an uploaded file. Returns the batch id.
+        """
+
+    @abc.abstractmethod
+    def retrieve(self, batch_id: str) -> dict:
+        """
+        Returns {"status", "output_file_id", "error_file_id"} of a batch. The file ids are None until the batch is over.
+        """
+
+    @abc.abstractmethod
+    def iter_lines(self, file_id: str) -> Iterator[str]:
+        """
+        Yields the lines of a file of results without loading it at once.
+        """
+
+    @abc.abstractmethod
+    def cancel(self, batch_id: str) -> None:
+        """
+        Cancels a running batch. The results already computed are still in its files.
+        """
+
+class OpenAIBatchTransport(BatchTransport):
+    """
+    Batch API of OpenAI (files + batches endpoints).
+
+    Args:
+        client (openai.OpenAI, optional): Defaults to the client of oai.py - also used with OAI_BASE_URL.
+    """
+    def __init__(self, client=None):
+        self.client = client
+
+    def _client(self):
+        return self.client or oai.get_client()
+
+    def upload(self, path: str) -> str:
+        with open(path, "rb") as f:
+            return self._client().files.create(file=f, purpose="batch").id
+
+    def submit(self, file_id: str, endpoint: str = BATCH_ENDPOINT, completion_window: str = BATCH_COMPLETION_WINDOW) -> str:
+        return self._client().batches.create(input_file_id=file_id, endpoint=endpoint, completion_window=completion_window).id
+
+    def retrieve(self, batch_id: str) -> dict:
+        batch = self._client().batches.retrieve(batch_id)
+        return {"status": batch.status, "output_file_id": batch.output_file_id, "error_file_id": batch.error_file_id}
+
+    def iter_lines(self, file_id: str) -> Iterator[str]:
+        with self._client().files.with_streaming_response.content(file_id) as response:
+            yield from response.iter_lines()
+
+    def cancel(self, batch_id: str) -> None:
+        self._client().batches.cancel(batch_id)
+
+class LocalBatchTransport(BatchTransport):
+    """
+    Runs the batches in the process, in a background thread, and writes the same output and error files as the Batch API.
+    To test a pipeline without waiting hours for a batch - or to run one against bench/fake_openai.py.
+
+    Args:
+        folder (str, optional): Where the files are kept. A temporary folder by default. Reuse the same folder to resume a job.
+        handler (callable, optional): Takes the body of a request and returns the body of the response (a dict), or raises.
+            Defaults to sending the body to the chat completions endpoint of the oai.py client.
+        max_concurrency (int, optional): Requests of a batch run at the same time. Defaults to 4.
+    """
+    def __init__(self, folder: Optional[str] = None, handler: Optional[Callable[[dict], dict]] = None, max_concurrency: int = 4):
+        self.folder = os.path.expanduser(folder) if folder else tempfile.mkdtemp(prefix="henryobj_batch_")
+        os.makedirs(self.folder, exist_ok=True)
+        self.handler = handler or (lambda body: oai.get_client().chat.completions.create(**body).model_dump())
+        self.max_concurrency = max_concurrency
+        self._lock = threading.Lock()
+        self._threads: dict[str, threading.Thread] = {}
+        self._cancelling: set[str] = set()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.folder, name)
+
+    def _read_batch(self, batch_id: str) -> dict:
+        with open(self._file(batch_id + ".json"), "r") as f:
+            return json.load(f)
+
+    def _write_batch(self, batch: dict) -> None:
+        path = self._file(batch["id"] + ".json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(batch, f)
+        os.replace(path + ".tmp", path)
+
+    def _answer(self, line: str) -> tuple[bool, dict]:
+        request = json.loads(line)
+        try:
+            body = self.handler(request["body"])
+            return True, {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"], "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": body}, "error": None}
+        except Exception as e:
+            return False, {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"], "response": None, "error": {"code": type(e).__name__, "message": str(e)}}
+
+    def _run(self, batch: dict) -> None:
+        try:
+            with open(self._file(batch["input_file_id"] + ".jsonl"), "r", encoding="utf-8") as f:
+                lines = [line for line in f if line.strip()]
+            output_id, error_id = f"file-{uuid.uuid4().hex}", f"file-{uuid.uuid4().hex}"
+            with open(self._file(output_id + ".jsonl"), "w", encoding="utf-8") as output, open(self._file(error_id + ".jsonl"), "w", encoding="utf-8") as errors:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                    for ok, result in executor.map(self._answer, lines):
+                        (output if ok else errors).write(json.dumps(result, ensure_ascii=False) + "\n")
+                        if batch["id"] in self._cancelling:
+                            executor.shutdown(cancel_futures=True)
+                            break
+            with self._lock:
+                batch.update(status="cancelled" if batch["id"] in self._cancelling else "completed", output_file_id=output_id, error_file_id=error_id)
+                self._write_batch(batch)
+                self._threads.pop(batch["id"], None)
+                self._cancelling.discard(batch["id"])
+        except Exception as e:
+            # Otherwise the batch would stay in_progress and wait() would spin - BatchJob.retry_failed sends its requests again
+            log_issue(e, self._run, f"Batch {batch['id']} of {self.folder}")
+            with self._lock:
+                batch.update(status="failed")
+                self._threads.pop(batch["id"], None)
+                self._cancelling.discard(batch["id"])
+                self._write_batch(batch)
+
+    def _start(self, batch: dict) -> None:
+        # Called under the lock
+        thread = threading.Thread(target=self._run, args=(batch,), daemon=True)
+        self._threads[batch["id"]] = thread
+        thread.start()
+
+    def upload(self, path: str) -> str:
+        file_id = f"file-{uuid.uuid4().hex}"
+        shutil.copyfile(path, self._file(file_id + ".jsonl"))
+        return file_id
+
+    def submit(self, file_id: str, endpoint: str = BATCH_ENDPOINT, completion_window: str = BATCH_COMPLETION_WINDOW) -> str:
+        if not os.path.exists(self._file(file_id + ".jsonl")):
+            raise ValueError(f"No uploaded file {file_id} in {self.folder}")
+        batch = {"id": f"batch_{uuid.uuid4().hex}", "input_file_id": file_id, "endpoint": endpoint, "status": "in_progress", "output_file_id": None, "error_file_id": None}
+        with self._lock:
+            self._write_batch(batch)
+            self._start(batch)
+        return batch["id"]
+
+    def retrieve(self, batch_id: str) -> dict:
+        with self._lock:
+            batch = self._read_batch(batch_id)
+            # A batch of a previous process that stopped before the end is run again
+            if batch["status"] == "in_progress" and batch_id not in self._threads:
+                self._start(batch)
+        return {"status": batch["status"], "output_file_id": batch["output_file_id"], "error_file_id": batch["error_file_id"]}
+
+    def iter_lines(self, file_id: str) -> Iterator[str]:
+        with open(self._file(file_id + ".jsonl"), "r", encoding="utf-8") as f:
+            for line in f:
+                yield line.rstrip("\n")
+
+    def cancel(self, batch_id: str) -> None:
+        with self._lock:
+            if batch_id in self._threads:
+                self._cancelling.add(batch_id)
+
+
+# ****************************************** JOBS *************************************************
+
+class BatchJob:
+    """
+    A batch of chat completions kept in a folder: the requests are written as JSONL in the batch format of the provider,
+    sent as one or more batches (BATCH_MAX_REQUESTS / BATCH_MAX_BYTES per file) and their results streamed into a file keyed by custom_id.
+    The requests which failed in the batch (or whose batch failed or expired) are sent again one by one with request_chatgpt.
+
+    Every step is saved in the folder, so run() can be called again after an interruption: the batches already submitted are
+    not submitted again, the results already downloaded are not downloaded again and the retries already done are kept.
+
+    Files of the folder:
+        - requests.jsonl: one request per line - {"custom_id", "method", "url", "body"}.
+        - state.json: the parts of requests.jsonl sent as batches, with their file id, batch id and status.
+        - part-00000.jsonl, ...: the files uploaded for each part.
+        - results.jsonl: {"custom_id", "answer", "error", "usage", "source"} per line - source is "batch" or "retry".
+            A retry is appended after the failed line, so the last line of a custom_id is its result.
+
+    Args:
+        path (str): The folder of the job. Created if it doesn't exist.
+        transport (BatchTransport, optional): Defaults to OpenAIBatchTransport().
+        model (str, optional): Default model of the requests. Defaults to MODEL_CHAT.
+        max_tokens (int, optional): Default max_tokens of the answers.
+        temperature (float, optional): Defaults to 0.
+        top_p (float, optional): Defaults to 1.
+
+    Example:
+        job = BatchJob("~/jobs/summaries")
+        for page in pages:
+            job.add(page["url"], page["text"], role="Summarize the page in 3 sentences")
+        answers = job.run() # {custom_id: answer}
+    """
+    def __init__(self, path: str, transport: Optional[BatchTransport] = None, model: str = MODEL_CHAT, max_tokens: int = MAX_TOKEN_OUTPUT_DEFAULT, temperature=0, top_p=1):
+        self.path = os.path.expanduser(path)
+        os.makedirs(self.path, exist_ok=True)
+        self.transport = transport or OpenAIBatchTransport()
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self._lock = threading.Lock()
+        self._truncate_partial_line("requests.jsonl")
+        self._truncate_partial_line("results.jsonl")
+        self._request_ids: list[str] = [json.loads(line)["custom_id"] for line in self._iter_file("requests.jsonl")]
+        self._known_ids = set(self._request_ids)
+        self._answered: set[str] = set()
+        self._resulted: set[str] = set()
+        for result in self.results():
+            self._resulted.add(result["custom_id"])
+            if result["answer"] is not None:
+                self._answered.add(result["custom_id"])
+        self.state = {"parts": []}
+        if os.path.exists(self._file("state.json")):
+            with open(self._file("state.json"), "r") as f:
+                self.state = json.load(f)
+
+    def __len__(self) -> int:
+        return len(self._request_ids)
+
+    # Internal helpers
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _iter_file(self, name: str) -> Iterator[str]:
+        if not os.path.exists(self._file(name)): return
+        with open(self._file(name), "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield line
+
+    def _truncate_partial_line(self, name: str) -> None:
+        # A crash in the middle of a write leaves a line without its "\n" at the end of the file
+        path = self._file(name)
+        if not os.path.exists(path) or os.path.getsize(path) == 0: return
+        with open(path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b"\n": return
+            f.seek(0)
+            end = f.read().rfind(b"\n") + 1
+            log_warning(f"Dropping the partial write at the end of {path}", BatchJob)
+            f.truncate(end)
+
+    def _save_state(self) -> None:
+        path = self._file("state.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(path + ".tmp", path)
+
+    def _append_results(self, results: list[dict]) -> None:
+        # Called under the lock
+        with open(self._file("results.jsonl"), "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(result, ensure_ascii=False) + "\n" for result in results))
+        for result in results:
+            self._resulted.add(result["custom_id"])
+            if result["answer"] is not None:
+                self._answered.add(result["custom_id"])
+
+    def _write_parts(self) -> None:
+        # Cuts the requests not sent yet into part files - the part is saved in the state before its upload
+        start = self.state["parts"][-1]["end"] if self.state["parts"] else 0
+        if start >= len(self._request_ids): return
+        lines = self._iter_file("requests.jsonl")
+        for _ in range(start):
+            next(lines)
+        part, size, line_index = [], 0, start
+        def close_part() -> None:
+            name = f"part-{len(self.state['parts']):05d}.jsonl"
+            with open(self._file(name), "w", encoding="utf-8") as f:
+                f.write("".join(part))
+            self.state["parts"].append({"file": name, "start": line_index - len(part), "end": line_index, "file_id": None, "batch_id": None, "status": None, "downloaded": False})
+            self._save_state()
+        for line in lines:
+            line_size = len(line.encode("utf-8"))
+            if part and (len(part) >= BATCH_MAX_REQUESTS or size + line_size > BATCH_MAX_BYTES):
+                close_part()
+                part, size = [], 0
+            part.append(line)
+            size += line_size
+            line_index += 1
+        if part:
+            close_part()
+
+    def _parse_result(self, line: str) -> Optional[dict]:
+        # A line of the output or error file of a batch -> a line of results.jsonl
+        try:
+            item = json.loads(line)
+            response = item.get("response") or {}
+            body = response.get("body") or {}
+            if response.get("status_code") == 200 and body.get("choices"):
+                return {"custom_id": item["custom_id"], "answer": (body["choices"][0]["message"]["content"] or "").strip(), "error": None, "usage": body.get("usage"), "source": "batch"}
+            error = item.get("error") or body.get("error") or {"message": f"Status code {response.get('status_code')}"}
+            return {"custom_id": item["custom_id"], "answer": None, "error": error.get("message") if isinstance(error, dict) else str(error), "usage": None, "source": "batch"}
+        except Exception as e:
+            log_issue(e, self._parse_result, f"Line of a batch file: {line[:500]}")
+            return
+
+    def _download(self, part: dict, info: dict) -> None:
+        # Streams the output and error files of a finished batch into results.jsonl
+        for file_id in (info.get("output_file_id"), info.get("error_file_id")):
+            if not file_id: continue
+            results = []
+            for line in self.transport.iter_lines(file_id):
+                if not line.strip(): continue
+                result = self._parse_result(line)
+                if result is None or result["custom_id"] in self._resulted: continue  # Already downloaded before an interruption
+                results.append(result)
+                if len(results) >= 1000:
+                    with self._lock:
+                        self._append_results(results)
+                    results = []
+            with self._lock:
+                self._append_results(results)
+        part["downloaded"] = True
+        self._save_state()
+
+    # Public API
+
+    def add(self, custom_id: str, question: str, role: str = "", model: Optional[str] = None, max_tokens: Optional[int] = None) -> bool:
+        """
+        Adds the equivalent of an ask_question_gpt call. Returns False (and logs why) if it was not added.
+        """
+        model = model or self.model
+        max_tokens = max_tokens or self.max_tokens
+        conversation = oai.Conversation(role, model)
+        conversation.add(question, "user")
+        messages = conversation.fit(max_tokens)
+        if messages is None:
+            log_warning(f"The request {custom_id} doesn't fit the window of {model} - not added", self.add)
+            return False
+        return self.add_messages(custom_id, messages, model, max_tokens)
+
+    def add_messages(self, custom_id: str, messages: list[dict[str, str]], model: Optional[str] = None, max_tokens: Optional[int] = None) -> bool:
+        """
+        Adds the equivalent of a request_chatgpt call on a chatTable. Returns False (and logs why) if it was not added.
+        The custom_id must be unique in the job - it is the key of the results.
+        """
+        custom_id = str(custom_id)
+        if custom_id in self._known_ids:
+            log_warning(f"The custom_id {custom_id} is already in the job - not added", self.add_messages)
+            return False
+        body = {
+            "model": model or self.model,
+            "messages": messages,
+            "temperature": self.temperature,
+            "max_tokens": int(max_tokens or self.max_tokens),
+            "top_p": self.top_p,
+            "frequency_penalty": 0,
+            "presence_penalty": 0,
+        }
+        line = json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self._file("requests.jsonl"), "a", encoding="utf-8") as f:
+                f.write(line)
+            self._request_ids.append(custom_id)
+            self._known_ids.add(custom_id)
+        return True
+
+    def submit(self) -> list[str]:
+        """
+        Sends the requests not sent yet as batches. Returns the ids of all the batches of the job.
+        A part uploaded but not submitted before an interruption is submitted now.
+        """
+        self._write_parts()
+        for part in self.state["parts"]:
+            if part["batch_id"] is not None: continue
+            try:
+                if part["file_id"] is None:
+                    part["file_id"] = self.transport.upload(self._file(part["file"]))
+                    self._save_state()
+                part["batch_id"] = self.transport.submit(part["file_id"])
+                part["status"] = "submitted"
+                self._save_state()
+            except Exception as e:
+                log_issue(e, self.submit, f"Part {part['file']} of the job at {self.path}")
+        return [part["batch_id"] for part in self.state["parts"] if part["batch_id"]]
+
+    def poll(self) -> bool:
+        """
+        Checks the batches not downloaded yet and downloads the results of those which are over.
+        Returns True when every batch is over and downloaded.
+        """
+        for part in self.state["parts"]:
+            if part["downloaded"] or not part["batch_id"]: continue
+            try:
+                info = self.transport.retrieve(part["batch_id"])
+                if info["status"] != part["status"]:
+                    part["status"] = info["status"]
+                    self._save_state()
+                if info["status"] in BATCH_TERMINAL_STATUSES:
+                    self._download(part, info)
+            except Exception as e:
+                log_issue(e, self.poll, f"Batch {part['batch_id']} of the job at {self.path}")
+        return all(part["downloaded"] for part in self.state["parts"])
+
+    def wait(self, poll_interval: float = BATCH_POLL_INTERVAL, timeout: Optional[float] = None) -> bool:
+        """
+        Polls until every batch is over and downloaded. Returns False if the timeout (seconds) is reached first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.poll():
+            if deadline is not None and time.monotonic() + poll_interval > deadline:
+                return False
+            time.sleep(poll_interval)
+        return True
+
+    def cancel(self) -> None:
+        """
+        Cancels the batches still running. Their finished requests are downloaded by the next poll().
+        """
+        for part in self.state["parts"]:
+            if part["batch_id"] and not part["downloaded"]:
+                try:
+                    self.transport.cancel(part["batch_id"])
+                except Exception as e:
+                    log_issue(e, self.cancel, f"Batch {part['batch_id']} of the job at {self.path}")
+
+    def retry_failed(self, max_concurrency: int = 4, max_attempts: int = 3) -> int:
+        """
+        Sends the requests without an answer through request_chatgpt - only those whose batch is over and downloaded.
+        Returns the number of requests answered by the retries.
+        """
+        done_ranges = [(part["start"], part["end"]) for part in self.state["parts"] if part["downloaded"]]
+        todo = []
+        for index, line in enumerate(self._iter_file("requests.jsonl")):
+            if not any(start <= index < end for start, end in done_ranges): continue
+            request = json.loads(line)
+            if request["custom_id"] not in self._answered:
+                todo.append(request)
+        if not todo: return 0
+        print(f"Retrying {len(todo)} failed requests of the batch with request_chatgpt")
+        def retry(request: dict) -> dict:
+            body = request["body"]
+            answer = oai.request_chatgpt(body["messages"], max_tokens=body["max_tokens"], max_attempts=max_attempts, model=body["model"], temperature=body["temperature"], top_p=body["top_p"])
+            failed = answer == OPEN_AI_ISSUE
+            return {"custom_id": request["custom_id"], "answer": None if failed else answer, "error": "request_chatgpt failed" if failed else None, "usage": None, "source": "retry"}
+        answered = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            for result in executor.map(retry, todo):
+                with self._lock:
+                    self._append_results([result])
+                answered += result["answer"] is not None
+        return answered
+
+    def run(self, poll_interval: float = BATCH_POLL_INTERVAL, timeout: Optional[float] = None, retry: bool = True) -> dict[str, Optional[str]]:
+        """
+        Submits, waits for the batches, retries the failed requests and returns {custom_id: answer} (None if it failed).
+        Safe to call again after an interruption - it resumes where the job stopped. If the timeout is reached, returns the answers so far.
+        """
+        self.submit()
+        if self.wait(poll_interval, timeout) and retry:
+            self.retry_failed()
+        return self.get_answers()
+
+    def results(self) -> Iterator[dict]:
+        """
+        Yields the lines of results.jsonl - several lines for a custom_id that was retried, the last one is its result.
+        """
+        for line in self._iter_file("results.jsonl"):
+            yield json.loads(line)
+
+    def get_answers(self) -> dict[str, Optional[str]]:
+        """
+        Returns {custom_id: answer} for every request of the job - None if it has no answer (yet).
+        """
+        answers = dict.fromkeys(self._request_ids)
+        for result in self.results():
+            if result["answer"] is not None or answers.get(result["custom_id"]) is None:
+                answers[result["custom_id"]] = result["answer"]
+        return answers
+
+    def progress(self) -> dict:
+        """
+        Returns the number of requests of the job, sent in a batch, with a result and with an answer.
+        """
+        return {
+            "requests": len(self._request_ids),
+            "submitted": sum(part["end"] - part["start"] for part in self.state["parts"] if part["batch_id"]),
+            "results": len(self._resulted),
+            "answered": len(self._answered),
+        }
+
+
+if __name__ == "__main__":
+    pass
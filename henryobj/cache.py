@@ -0,0 +1,436 @@
+# Persistent caches used to avoid paying twice for the same work (latency and $).
+
+
+from .config import (
+    EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES, COMPLETION_CACHE_PATH, COMPLETION_CACHE_TTL, COMPLETION_CACHE_MEMORY_ENTRIES,
+    HTTP_CACHE_PATH
+)
+from .base import log_issue
+
+
+from urllib.parse import urlsplit, urlunsplit
+from collections import OrderedDict
+from typing import Optional
+from array import array
+
+import threading
+import hashlib
+import json
+import sqlite3
+import time
+import os
+
+
+# ****************************************** EMBEDDINGS *******************************************
+
+class EmbeddingCache:
+    """
+    On-disk cache of embeddings backed by SQLite, keyed by (model, dimensions, hash of the normalized text).
+    Once max_entries is reached, the least recently used embeddings are evicted.
+    Thread safe - a single instance can be shared by all the threads of the process.
+
+    Note:
+        Embeddings are stored as float64 so a cached embedding is identical to the one returned by the API.
+    """
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = os.path.expanduser(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, embedding BLOB NOT NULL, last_used REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(text: str, model: str, dimensions: Optional[int] = None) -> str:
+        """
+        Returns the cache key of a text. The text is normalized (whitespace collapsed) before being hashed.
+        """
+        normalized = " ".join(text.split())
+        digest = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        return f"{model}|{dimensions or ''}|{digest}"
+
+    def get_many(self, texts: list[str], model: str, dimensions: Optional[int] = None) -> list[Optional[list[float]]]:
+        """
+        Returns the cached embedding of each text, or None for the texts not in the cache.
+        """
+        keys = [self.make_key(text, model, dimensions) for text in texts]
+        found = {}
+        try:
+            with self._lock:
+                # SQLite limits the number of variables per query so we go by slices
+                for start in range(0, len(keys), 500):
+                    sliced = keys[start:start + 500]
+                    rows = self._conn.execute(f"SELECT key, embedding FROM embeddings WHERE key IN ({','.join('?' * len(sliced))})", sliced).fetchall()
+                    found.update(rows)
+                if found:
+                    now = time.time()
+                    self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                    self._conn.commit()
+                self.hits += sum(1 for key in keys if key in found)
+                self.misses += sum(1 for key in keys if key not in found)
+        except Exception as e:
+            log_issue(e, self.get_many, f"Cache at {self.path}")
+            return [None] * len(texts)
+        return [array('d', found[key]).tolist() if key in found else None for key in keys]
+
+    def get(self, text: str, model: str, dimensions: Optional[int] = None) -> Optional[list[float]]:
+        """
+        Returns the cached embedding of a text or None if it is not in the cache.
+        """
+        return self.get_many([text], model, dimensions)[0]
+
+    def put_many(self, texts: list[str], embeddings: list[Optional[list[float]]], model: str, dimensions: Optional[int] = None) -> None:
+        """
+        Stores the embeddings of the texts. None embeddings are skipped. Evicts the least recently used entries if needed.
+        """
+        now = time.time()
+        rows = [(self.make_key(text, model, dimensions), array('d', embedding).tobytes(), now) for text, embedding in zip(texts, embeddings) if embedding is not None]
+        if not rows: return
+        try:
+            with self._lock:
+                before = self._conn.total_changes
+                self._conn.executemany("INSERT OR IGNORE INTO embeddings (key, embedding, last_used) VALUES (?, ?, ?)", rows)
+                self._count += self._conn.total_changes - before
+                if self._count > self.max_entries:
+                    excess = self._count - self.max_entries
+                    self._conn.execute("DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,))
+                    self._count -= excess
+                self._conn.commit()
+        except Exception as e:
+            log_issue(e, self.put_many, f"Cache at {self.path}")
+
+    def put(self, text: str, embedding: list[float], model: str, dimensions: Optional[int] = None) -> None:
+        """
+        Stores the embedding of a text.
+        """
+        self.put_many([text], [embedding], model, dimensions)
+
+    def stats(self) -> dict:
+        """
+        Returns the hit / miss counters and the number of entries of the cache.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": self._count,
+            "max_entries": self.max_entries,
+        }
+
+    def clear(self) -> None:
+        """
+        Removes all the entries and resets the counters.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._count = 0
+            self.hits = self.misses = 0
+
+    def close(self) -> None:
+        """
+        Closes the connection to the SQLite file.
+        """
+        with self._lock:
+            self._conn.close()
+
+# ****************************************** COMPLETIONS ******************************************
+
+class CompletionCache:
+    """
+    Cache of chat completions with two tiers: an in-memory LRU in front of an SQLite file. Entries expire after ttl seconds.
+    Only deterministic requests are worth caching - callers check is_cacheable() first and the others are counted as bypassed.
+
+    Args:
+        path (str, optional): The SQLite file. None for a memory only cache.
+        ttl (float, optional): Seconds before an answer expires. None to never expire.
+        memory_entries (int, optional): Size of the in-memory tier.
+    """
+    def __init__(self, path: Optional[str] = COMPLETION_CACHE_PATH, ttl: Optional[float] = COMPLETION_CACHE_TTL, memory_entries: int = COMPLETION_CACHE_MEMORY_ENTRIES):
+        self.path = os.path.expanduser(path) if path else None
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._memory: OrderedDict[str, tuple[str, Optional[float]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if self.path:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, answer TEXT NOT NULL, expires_at REAL)")
+            self._conn.commit()
+
+    @staticmethod
+    def is_cacheable(temperature: float) -> bool:
+        """
+        Returns True if the request is deterministic enough to be cached - i.e. temperature is 0.
+        """
+        return temperature == 0
+
+    @staticmethod
+    def make_key(model: str, messages: list, max_tokens: int, temperature: float, top_p: float, stop) -> str:
+        """
+        Returns the cache key of a request: a hash of everything that changes the answer.
+        """
+        payload = json.dumps([model, messages, int(max_tokens), temperature, top_p, stop or None], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the cached answer or None if missing or expired. Answers found on disk are promoted to the memory tier.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] is None or entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[0]
+                del self._memory[key]
+            if self._conn is not None:
+                try:
+                    row = self._conn.execute("SELECT answer, expires_at FROM completions WHERE key = ?", (key,)).fetchone()
+                except Exception as e:
+                    log_issue(e, self.get, f"Cache at {self.path}")
+                    row = None
+                if row is not None and (row[1] is None or row[1] > now):
+                    self._remember(key, row[0], row[1])
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, answer: str) -> None:
+        """
+        Stores an answer in both tiers.
+        """
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._remember(key, answer, expires_at)
+            if self._conn is not None:
+                try:
+                    self._conn.execute("INSERT OR REPLACE INTO completions (key, answer, expires_at) VALUES (?, ?, ?)", (key, answer, expires_at))
+                    self._conn.commit()
+                except Exception as e:
+                    log_issue(e, self.put, f"Cache at {self.path}")
+
+    def _remember(self, key: str, answer: str, expires_at: Optional[float]) -> None:
+        # Memory tier - must be called under the lock
+        self._memory[key] = (answer, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def record_bypass(self) -> None:
+        """
+        Counts a request that was not cacheable (temperature > 0).
+        """
+        with self._lock:
+            self.bypassed += 1
+
+    def purge_expired(self) -> int:
+        """
+        Removes the expired answers from the disk tier. Returns how many were removed.
+        """
+        if self._conn is None: return 0
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM completions WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+            self._conn.commit()
+            return cursor.rowcount
+
+    def stats(self) -> dict:
+        """
+        Returns the hit counters per tier, the misses, the bypassed requests and the hit rate of the cacheable requests.
+        """
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+    def clear(self) -> None:
+        """
+        Removes all the entries of both tiers and resets the counters.
+        """
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM completions")
+                self._conn.commit()
+            self.memory_hits = self.disk_hits = self.misses = self.bypassed = 0
+
+    def close(self) -> None:
+        """
+        Closes the connection to the SQLite file.
+        """
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+# ****************************************** HTTP *************************************************
+
+class HTTPCache:
+    """
+    On-disk cache of crawled pages backed by SQLite, keyed by the normalized url (see make_key). A page is stored with its
+    validators (ETag / Last-Modified), its cleaned text and its links, so a re-crawl sends a conditional request and, on a 304,
+    reuses the text and follows the links without downloading or parsing the page again.
+    Thread safe - a single instance can be shared by all the threads of the process.
+
+    Note:
+        The text depends on the HTML backend, so an entry is only reused with the parser that produced it.
+        Pages sent without ETag nor Last-Modified can't be revalidated - they are not stored.
+    """
+    DEFAULT_PORTS = {"http": 80, "https": 443}
+
+    def __init__(self, path: str = HTTP_CACHE_PATH):
+        self.path = os.path.expanduser(path)
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_downloaded = 0
+        self._lock = threading.Lock()
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, parser TEXT NOT NULL, text TEXT NOT NULL, "
+            "links TEXT NOT NULL, size INTEGER NOT NULL, fetched_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(url: str) -> str:
+        """
+        Returns the normalized url: lowercase scheme and host, no default port, no fragment, "/" for an empty path.
+        """
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        netloc = (parts.hostname or "").lower()
+        if parts.port is not None and parts.port != HTTPCache.DEFAULT_PORTS.get(scheme):
+            netloc = f"{netloc}:{parts.port}"
+        return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+    @staticmethod
+    def conditional_headers(entry: Optional[dict]) -> dict:
+        """
+        Returns the If-None-Match / If-Modified-Since headers to revalidate a cached page. Empty if entry is None.
+        """
+        headers = {}
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def get(self, url: str, parser: Optional[str] = None) -> Optional[dict]:
+        """
+        Returns the cached page - a dict with etag, last_modified, parser, text, links (list) and size - or None if it is not in
+        the cache or was parsed with another parser. Hits and misses are counted once the server answered (record_hit / record_miss).
+        """
+        try:
+            with self._lock:
+                row = self._conn.execute("SELECT etag, last_modified, parser, text, links, size FROM pages WHERE url = ?", (self.make_key(url),)).fetchone()
+        except Exception as e:
+            log_issue(e, self.get, f"Cache at {self.path}")
+            return None
+        if row is None or (parser is not None and row[2] != parser):
+            return None
+        return {"etag": row[0], "last_modified": row[1], "parser": row[2], "text": row[3], "links": json.loads(row[4]), "size": row[5]}
+
+    def put(self, url: str, text: str, links, size: int, parser: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        """
+        Stores a downloaded page: its validators, its cleaned text, its links and the size of its body in bytes.
+        Without validators, the page is removed from the cache instead.
+        """
+        key = self.make_key(url)
+        try:
+            with self._lock:
+                if not etag and not last_modified:
+                    self._conn.execute("DELETE FROM pages WHERE url = ?", (key,))
+                else:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO pages (url, etag, last_modified, parser, text, links, size, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (key, etag, last_modified, parser, text, json.dumps(sorted(links)), size, time.time())
+                    )
+                self._conn.commit()
+        except Exception as e:
+            log_issue(e, self.put, f"Cache at {self.path}")
+
+    def record_hit(self, entry: dict) -> None:
+        """
+        Counts a page the server didn't send again (304) - its body is counted as saved.
+        """
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += entry["size"]
+
+    def record_miss(self, size: int) -> None:
+        """
+        Counts a page downloaded in full - size is its body in bytes.
+        """
+        with self._lock:
+            self.misses += 1
+            self.bytes_downloaded += size
+
+    def stats(self) -> dict:
+        """
+        Returns the hit / miss counters, the bytes saved by the 304s and downloaded by the misses, and the number of entries.
+        """
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "bytes_downloaded": self.bytes_downloaded,
+            "entries": entries,
+        }
+
+    def clear(self) -> None:
+        """
+        Removes all the entries and resets the counters.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM pages")
+            self._conn.commit()
+            self.hits = self.misses = self.bytes_saved = self.bytes_downloaded = 0
+
+    def close(self) -> None:
+        """
+        Closes the connection to the SQLite file.
+        """
+        with self._lock:
+            self._conn.close()
+
+# *************************************************************************************************
+# *************************************************************************************************
+
+if __name__ == "__main__":
+    pass
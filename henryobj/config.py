@@ -20,6 +20,16 @@ HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3",
 }
 
+HTML_PARSER = r"html.parser" # "html.parser", "lxml" (pip install lxml) or "selectolax" (pip install selectolax) - same cleaned text, lxml and selectolax parse faster
+
+CRAWL_MAX_CONCURRENCY = 32 # Pages fetched at once by acrawl_website, all hosts together
+CRAWL_MAX_PER_HOST = 8 # Pages fetched at once from the same host - to stay polite
+CRAWL_TIMEOUT = 10 # Seconds
+CRAWL_MAX_ATTEMPTS = 3
+CRAWL_RETRY_STATUSES = (429, 500, 502, 504) # Same as create_session() + the rate limit
+CRAWL_BACKOFF = 0.3 # Seconds - base of the exponential backoff between two attempts
+CRAWL_PARSE_WORKERS = 0 # Processes parsing the pages of acrawl_website. 0 parses in threads - parsing is CPU bound so use ~ the number of cores on big crawls
+
 # ****** TOKEN LIMITATIONS
 MAX_TOKEN_OUTPUT = 4096
 MAX_TOKEN_OUTPUT_DEFAULT = 300
@@ -30,6 +40,12 @@ MAX_TOKEN_WINDOW_GPT4_TURBO = 128000
 MAX_TOKEN_WINDOW_GPT35_TURBO = 16385
 MAX_TOKEN_WINDOW_GPT4 = 8192
 WINDOW_BUFFER = 150
+CHAT_MESSAGE_OVERHEAD = 4 # Tokens added by the chat format around each message
+CHAT_REPLY_OVERHEAD = 3 # Tokens priming the reply of the assistant
+
+MAX_TOKEN_EMBEDDING_INPUT = 8191 # Per text sent to the embedding endpoint
+MAX_TOKEN_EMBEDDING_BATCH = 300000 # Per request to the embedding endpoint (all texts together)
+MAX_EMBEDDING_BATCH = 2048 # Max number of texts per request to the embedding endpoint
 
 # ****** MODELS
 MODEL_GPT4O = r"gpt-4o"
@@ -44,6 +60,64 @@ MODEL_OLD = r"text-embedding-ada-002"
 MODEL_EMB_LARGE = r"text-embedding-3-large"
 MODEL_EMB_SMALL = r"text-embedding-3-small"
 
+ENCODING_FALLBACK = r"cl100k_base" # Used by the tokenizer when tiktoken doesn't know the model
+
+
+# ******* RATE LIMITS
+# {model: (requests_per_minute, tokens_per_minute)} - check your tier on the OpenAI dashboard. Models not listed are not metered.
+# Example: {MODEL_CHAT: (5000, 2000000), MODEL_EMB_LARGE: (5000, 5000000)}
+RATE_LIMITS = {}
+RATE_LIMIT_BACKOFF = 0.5 # Seconds - base of the exponential backoff when OpenAI doesn't tell us how long to wait
+
+# ******* CACHES
+EMBEDDING_CACHE_PATH = r"~/.cache/henryobj/embeddings.sqlite"
+EMBEDDING_CACHE_MAX_ENTRIES = 1000000 # ~25GB with MODEL_EMB_LARGE, ~6GB with MODEL_EMB_SMALL
+COMPLETION_CACHE_PATH = r"~/.cache/henryobj/completions.sqlite"
+COMPLETION_CACHE_TTL = 7 * 24 * 3600 # Seconds - models get updated so we don't keep answers forever
+COMPLETION_CACHE_MEMORY_ENTRIES = 10000
+HTTP_CACHE_PATH = r"~/.cache/henryobj/http.sqlite"
+
+# ******* VECTORS
+VECTOR_SEARCH_BLOCK_ROWS = 16384 # Rows scored at once by a search - ~200MB with MODEL_EMB_LARGE in float32
+VECTOR_SEARCH_BLOCK_ROWS_QUANTIZED = 2048 # Smaller for float16 / int8 stores so the float32 copy of a block stays in the CPU cache
+IVF_NPROBE = 16 # Clusters scanned by an IVFIndex search - the higher, the better the recall and the slower the search
+IVF_TRAIN_ITERATIONS = 20
+IVF_TRAIN_SAMPLE = 50000 # Max vectors used to train the k-means of an IVFIndex - ~600MB with MODEL_EMB_LARGE in float32
+
+# ******* BATCHES
+BATCH_ENDPOINT = r"/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = r"24h" # The only window OpenAI offers - the batch price is half the regular one
+BATCH_MAX_REQUESTS = 50000 # Per batch file - a job with more requests is sent as several batches
+BATCH_MAX_BYTES = 200 * 1024 * 1024 # Per batch file
+BATCH_POLL_INTERVAL = 60 # Seconds between two status checks of a running batch
+
+# ******* METRICS
+# {model: (dollars per 1M input tokens, dollars per 1M output tokens)} - check https://openai.com/api/pricing as they change
+MODEL_PRICES = {
+    MODEL_GPT4O: (5.00, 15.00),
+    MODEL_CHAT: (0.15, 0.60),
+    MODEL_GPT4_TURBO: (10.00, 30.00),
+    MODEL_GPT4_STABLE: (30.00, 60.00),
+    MODEL_CHAT_BACKUP: (0.50, 1.50),
+    MODEL_EMB_LARGE: (0.13, 0.0),
+    MODEL_EMB_SMALL: (0.02, 0.0),
+    MODEL_OLD: (0.10, 0.0),
+}
+METRICS_LATENCY_SAMPLES = 2048 # Latencies kept per (function, model, call site) for the percentiles - the most recent ones
+
+# ******* HEDGING
+# A hedged request sends a second request if the first one is slower than the HEDGE_PERCENTILE of the recent latencies
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20 # Below, HEDGE_DEFAULT_DELAY is used
+HEDGE_DEFAULT_DELAY = 8.0 # Seconds
+HEDGE_MIN_DELAY = 0.5 # Seconds - so a burst of fast answers doesn't make every request hedged
+
+# ******* MAP REDUCE
+MAP_REDUCE_MAX_CONCURRENCY = 8 # Requests in flight at once - the chunks of a level are sent together
+MAP_REDUCE_CHUNK_MARGIN = 0.8 # Share of the free window used per request - the chunks can be 5% larger than asked and make_string_json_safe adds tokens
+ROLE_MAP_REDUCE_COMBINE = """{role}
+You are given the answers to this task for consecutive parts of a longer input, in order (### PART n ###).
+Combine them into the single answer you would have given for the whole input. Don't mention the parts."""
 
 # ******* GPT
 BUFFER_README_INPUT = 30000
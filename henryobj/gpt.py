@@ -1,7 +1,7 @@
 # Giving access to preconfigured GPT4 roles and functions.
 
 
-from .config import MAX_TOKEN_WINDOW_GPT4_TURBO, LARGE_INPUT_THRESHOLD, BUFFER_README_INPUT
+from .config import MAX_TOKEN_WINDOW_GPT4_TURBO, LARGE_INPUT_THRESHOLD, BUFFER_README_INPUT, MODEL_GPT4_TURBO
 from .base import read_gitignore, remove_excess, get_now
 from .oai import calculate_token, ask_question_gpt4
 
@@ -51,7 +51,7 @@ def process_directory(root_path: str, current_path: str, result: str, total_toke
             print(f"Processing the file {full_path}")
             with open(full_path, "r") as doc:
                 content = doc.read()
-            file_token_count = calculate_token(content)  # Assume calculate_token is defined
+            file_token_count = calculate_token(content, MODEL_GPT4_TURBO)
             if total_token + file_token_count < MAX_TOKEN_WINDOW_GPT4_TURBO - BUFFER_README_INPUT:
                 result += f"\n### START OF {full_path} ###\n" + content + f"\n### END OF {full_path} ###\n\n"
                 total_token += file_token_count
@@ -85,7 +85,7 @@ def gpt_bugbounty_generator(repository_path: str) -> str:
     # Guard clause
     if not get_code_content: return
     query_message = "Querying GPT 4"
-    if calculate_token(get_code_content) > LARGE_INPUT_THRESHOLD:
+    if calculate_token(get_code_content, MODEL_GPT4_TURBO) > LARGE_INPUT_THRESHOLD:
         query_message = "Querying GPT4. The repo is a large input so this might take some time, please wait"
 
     # Start a separate thread for the progress indicator
@@ -125,7 +125,7 @@ def gpt_readme_generator(repository_path: str) -> str:
     # Guard clause
     if not get_code_content: return
     query_message = "Querying GPT 4"
-    if calculate_token(get_code_content) > LARGE_INPUT_THRESHOLD:
+    if calculate_token(get_code_content, MODEL_GPT4_TURBO) > LARGE_INPUT_THRESHOLD:
         query_message = "Querying GPT4. The repo is a large input so this might take some time, please wait"
 
     # Start a separate thread for the progress indicator
@@ -0,0 +1,218 @@
+# In-process telemetry of the OpenAI calls - usage, latency, attempts, fallbacks, cache hits and cost per call site.
+
+
+from .config import MODEL_PRICES, METRICS_LATENCY_SAMPLES
+
+
+from collections import deque
+from typing import Optional
+
+import sysconfig
+import threading
+import json
+import math
+import time
+import sys
+import os
+
+
+# Frames skipped to find the call site: the API calls themselves and the standard library (threads, asyncio)
+SKIPPED_FILES = tuple(os.path.join(os.path.dirname(os.path.abspath(__file__)), name) for name in ("oai.py", "metrics.py"))
+STDLIB_PATH = sysconfig.get_paths()["stdlib"]
+THIRD_PARTY_FOLDERS = ("site-packages", "dist-packages") # Can be inside STDLIB_PATH but are not skipped
+
+
+# ****************************************** COSTS ************************************************
+
+def get_call_cost(model: str, prompt_tokens: int, completion_tokens: int = 0) -> Optional[float]:
+    """
+    Returns the cost in dollars of a call according to MODEL_PRICES. None if the model has no price.
+    A dated model (e.g. gpt-4o-2024-05-13) gets the price of its base model.
+    """
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        base = max((name for name in MODEL_PRICES if model.startswith(name + "-")), key=len, default=None)
+        if base is None: return
+        prices = MODEL_PRICES[base]
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1e6
+
+def get_call_site() -> str:
+    """
+    Returns "file:line function" of the code which called the API - the first frame outside oai.py and the standard library.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not filename.startswith(SKIPPED_FILES) and (not filename.startswith(STDLIB_PATH) or any(folder in filename for folder in THIRD_PARTY_FOLDERS)):
+            return f"{os.path.basename(filename)}:{frame.f_lineno} {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "unknown"
+
+
+# ****************************************** REGISTRY *********************************************
+
+class MetricsRegistry:
+    """
+    Aggregates the OpenAI calls by (function, model, call site): number of calls, errors, cache hits, attempts, fallbacks
+    to the backup model, tokens from response.usage, cost and latency percentiles. Thread safe - shared by the whole process.
+
+    The latencies kept are the last latency_samples of each key, so the memory doesn't grow with the number of calls.
+    Only the calls which sent a request are sampled - an answer from the cache would drag the percentiles down.
+
+    Args:
+        latency_samples (int, optional): Latencies kept per key for the percentiles. Defaults to METRICS_LATENCY_SAMPLES.
+
+    Example:
+        metrics.snapshot() # One dict per (function, model, call site), the most expensive first
+        metrics.export("metrics.json")
+    """
+    def __init__(self, latency_samples: int = METRICS_LATENCY_SAMPLES):
+        self.latency_samples = latency_samples
+        self.enabled = True
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._stats: dict[tuple[str, str, str], dict] = {}
+
+    def _new_stats(self) -> dict:
+        return {
+            "calls": 0, "errors": 0, "cache_hits": 0, "attempts": 0, "fallbacks": 0, "hedges": 0,
+            "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "unpriced_calls": 0,
+            "latency_total": 0.0, "latency_max": 0.0,
+            "latencies": deque(maxlen=self.latency_samples), "ttfts": deque(maxlen=self.latency_samples),
+        }
+
+    def record(self, function: str, model: str, latency: float, attempts: int = 1, prompt_tokens: int = 0, completion_tokens: int = 0,
+               cache_hits: int = 0, fallback: Optional[str] = None, error: bool = False, ttft: Optional[float] = None, hedged: bool = False, call_site: Optional[str] = None) -> None:
+        """
+        Records one call.
+
+        Args:
+            function (str): The API function - e.g. "request_chatgpt".
+            model (str): The model asked for.
+            latency (float): Seconds from the call to the answer, retries included.
+            attempts (int, optional): Requests sent. 0 for an answer from the cache.
+            prompt_tokens / completion_tokens (int, optional): From response.usage.
+            cache_hits (int, optional): Answers (or texts for embed_texts) served by the cache.
+            fallback (str, optional): The model that answered if it is not the one asked for.
+            error (bool, optional): True if the call returned no answer.
+            ttft (float, optional): Seconds to the first token of a stream.
+            hedged (bool, optional): True if a second request was sent because the first one was too slow.
+            call_site (str, optional): Defaults to get_call_site().
+        """
+        if not self.enabled: return
+        key = (function, model, call_site or get_call_site())
+        cost = get_call_cost(fallback or model, prompt_tokens, completion_tokens) if prompt_tokens or completion_tokens else 0.0
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = self._new_stats()
+            stats["calls"] += 1
+            stats["errors"] += bool(error)
+            stats["cache_hits"] += cache_hits
+            stats["attempts"] += attempts
+            stats["fallbacks"] += fallback is not None
+            stats["hedges"] += hedged
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            if cost is None:
+                stats["unpriced_calls"] += 1
+            else:
+                stats["cost"] += cost
+            stats["latency_total"] += latency
+            stats["latency_max"] = max(stats["latency_max"], latency)
+            if attempts:
+                stats["latencies"].append(latency)
+                if ttft is not None:
+                    stats["ttfts"].append(ttft)
+
+    def snapshot(self) -> list[dict]:
+        """
+        Returns one dict per (function, model, call site) - the most expensive first, then the slowest.
+        Latencies are in seconds and the cost in dollars.
+        """
+        with self._lock:
+            items = [(key, dict(stats, latencies=sorted(stats["latencies"]), ttfts=sorted(stats["ttfts"]))) for key, stats in self._stats.items()]
+        rows = []
+        for (function, model, call_site), stats in items:
+            latencies, ttfts = stats["latencies"], stats["ttfts"]
+            rows.append({
+                "function": function,
+                "model": model,
+                "call_site": call_site,
+                "calls": stats["calls"],
+                "errors": stats["errors"],
+                "cache_hits": stats["cache_hits"],
+                "attempts": stats["attempts"],
+                "fallbacks": stats["fallbacks"],
+                "hedges": stats["hedges"],
+                "prompt_tokens": stats["prompt_tokens"],
+                "completion_tokens": stats["completion_tokens"],
+                "cost_usd": round(stats["cost"], 6),
+                "unpriced_calls": stats["unpriced_calls"],
+                "latency_mean": round(stats["latency_total"] / stats["calls"], 4),
+                "latency_p50": round(percentile(latencies, 50), 4),
+                "latency_p95": round(percentile(latencies, 95), 4),
+                "latency_max": round(stats["latency_max"], 4),
+                "ttft_p50": round(percentile(ttfts, 50), 4) if ttfts else None,
+            })
+        rows.sort(key=lambda row: (-row["cost_usd"], -row["latency_p95"]))
+        return rows
+
+    def totals(self) -> dict:
+        """
+        Returns the sums over all the calls recorded: calls, errors, cache_hits, attempts, fallbacks, tokens and cost.
+        """
+        totals = dict.fromkeys(("calls", "errors", "cache_hits", "attempts", "fallbacks", "hedges", "prompt_tokens", "completion_tokens", "unpriced_calls"), 0)
+        totals["cost_usd"] = 0.0
+        with self._lock:
+            for stats in self._stats.values():
+                for name in totals:
+                    totals[name] += stats["cost"] if name == "cost_usd" else stats[name]
+        totals["cost_usd"] = round(totals["cost_usd"], 6)
+        return totals
+
+    def percentile(self, function: str, model: str, pct: float, ttft: bool = False, min_samples: int = 1) -> Optional[float]:
+        """
+        Returns the pct percentile of the latencies (or times to first token) of a function and model, all call sites together.
+        None if there are less than min_samples.
+        """
+        with self._lock:
+            samples = [value for (name, asked, _), stats in self._stats.items() if name == function and asked == model for value in stats["ttfts" if ttft else "latencies"]]
+        if len(samples) < max(1, min_samples): return
+        return percentile(sorted(samples), pct)
+
+    def export(self, path: Optional[str] = None) -> str:
+        """
+        Returns the metrics as JSON ({"started", "exported", "totals", "calls"}) and writes them to path if given.
+        """
+        content = json.dumps({"started": self.started, "exported": time.time(), "totals": self.totals(), "calls": self.snapshot()}, indent=2)
+        if path:
+            path = os.path.expanduser(path)
+            with open(path + ".tmp", "w") as f:
+                f.write(content)
+            os.replace(path + ".tmp", path)
+        return content
+
+    def reset(self) -> None:
+        """
+        Forgets everything recorded so far.
+        """
+        with self._lock:
+            self._stats.clear()
+            self.started = time.time()
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list. 0 if empty.
+    """
+    if not sorted_values: return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+# Shared by the whole process - the API calls of oai.py record into it
+metrics = MetricsRegistry()
+
+
+if __name__ == "__main__":
+    pass
@@ -3,30 +3,352 @@
 from .config import (
     ERROR_MESSAGE, OPEN_AI_ISSUE, MAX_TOKEN_OUTPUT_DEFAULT, MAX_TOKEN_OUTPUT_DEFAULT_HUGE, MAX_TOKEN_WINDOW_GPT4, 
     MAX_TOKEN_WINDOW_GPT4_TURBO, MAX_TOKEN_WINDOW_OLD, MAX_TOKEN_WINDOW_GPT35_TURBO, MODEL_GPT4_TURBO, MODEL_GPT4O,
-    MODEL_GPT4_STABLE, MODEL_CHAT, MODEL_EMB_LARGE, MODEL_CHAT_BACKUP, WINDOW_BUFFER
+    MODEL_GPT4_STABLE, MODEL_CHAT, MODEL_EMB_LARGE, MODEL_CHAT_BACKUP, WINDOW_BUFFER, ENCODING_FALLBACK,
+    MAX_TOKEN_EMBEDDING_INPUT, MAX_TOKEN_EMBEDDING_BATCH, MAX_EMBEDDING_BATCH, EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES,
+    RATE_LIMITS, RATE_LIMIT_BACKOFF, COMPLETION_CACHE_PATH, COMPLETION_CACHE_TTL, COMPLETION_CACHE_MEMORY_ENTRIES,
+    CHAT_MESSAGE_OVERHEAD, CHAT_REPLY_OVERHEAD, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES, HEDGE_DEFAULT_DELAY, HEDGE_MIN_DELAY,
+    MAP_REDUCE_MAX_CONCURRENCY, MAP_REDUCE_CHUNK_MARGIN, ROLE_MAP_REDUCE_COMBINE
 )
-from .base import log_warning, log_issue, split_into_sentences, custom_round, check_co
+from .base import log_warning, log_issue, check_co, lazy_import
+from .cache import EmbeddingCache, CompletionCache
+from .ratelimit import RateLimiter, get_retry_after
+from .metrics import metrics, get_call_cost, get_call_site
 
 
-from typing import Optional
+from typing import Optional, Iterator, Iterable, Union
 
-import tiktoken
-import openai
+import concurrent.futures
+import threading
+import itertools
+import asyncio
+import bisect
+import random
+import queue
 import time
 import json
 import os
 import re
 
+# Imported on first use - openai alone is most of the import time of the package
+openai = lazy_import("openai")
+tiktoken = lazy_import("tiktoken")
+
 
 # ****************************************** INIT CLIENT *****************************************
 
 
 
 OAI_KEY = os.getenv("OAI_API_KEY")
-client = openai.OpenAI(
-    api_key=OAI_KEY,
-)
+OAI_BASE_URL = os.getenv("OAI_BASE_URL") # To point at an OpenAI-compatible server (e.g. bench/fake_openai.py). None for OpenAI.
+_CLIENT_LOCK = threading.Lock()
+
+def get_client() -> "openai.OpenAI":
+    """
+    Returns the OpenAI client, built on the first call. Assign oai.client to use another one (e.g. a fake in tests).
+    """
+    global client
+    try:
+        return client
+    except NameError: # Not built yet - there is no client = ... at the module level
+        pass
+    with _CLIENT_LOCK:
+        if "client" not in globals():
+            client = openai.OpenAI(api_key=OAI_KEY, base_url=OAI_BASE_URL)
+    return client
+
+def get_aclient() -> "openai.AsyncOpenAI":
+    """
+    Returns the async OpenAI client, built on the first call. Assign oai.aclient to use another one.
+    """
+    global aclient
+    try:
+        return aclient
+    except NameError: # Not built yet - there is no aclient = ... at the module level
+        pass
+    with _CLIENT_LOCK:
+        if "aclient" not in globals():
+            aclient = openai.AsyncOpenAI(api_key=OAI_KEY, base_url=OAI_BASE_URL)
+    return aclient
+
+def __getattr__(name: str):
+    # oai.client and oai.aclient keep working - they are built on first access (PEP 562)
+    if name == "client":
+        return get_client()
+    if name == "aclient":
+        return get_aclient()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Shared by every thread - request_chatgpt and embed_text wait on it before sending. See set_rate_limit()
+rate_limiter = RateLimiter(RATE_LIMITS)
+
+
+# ****************************************** TOKENIZERS *******************************************
+
+# Same boundaries as split_into_sentences() in base.py - the chunker cuts where these matches start.
+SENTENCE_BOUNDARY_PATTERN = re.compile(r'(?<=[.!?;])\s+|\n')
+WORD_BOUNDARY_PATTERN = re.compile(r'\s+')
+
+# Used by calculate_token_aproximatively to classify the chars without a Python loop.
+ASCII_ALNUM_BYTES = b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+ASCII_RUN_PATTERN = re.compile(r'[\x00-\x7f]+')
+ALNUM_RUN_PATTERN = re.compile(r'[^\W_]+') # \w is str.isalnum() + the underscore
+
+# Encoders are resolved once per model and then reused - encoding_for_model is too slow for hot loops.
+# None is cached for a model without any encoder, so a failed lookup is not retried on every call - and only the first one is logged.
+_ENCODERS: dict[str, Optional["tiktoken.Encoding"]] = {}
+_ENCODERS_LOCK = threading.Lock()
+_encoder_failure_logged = False
+
+def get_encoder(model: str = MODEL_CHAT) -> Optional["tiktoken.Encoding"]:
+    """
+    Returns the tiktoken encoder of a given model (o200k for GPT-4O / GPT-4O mini, cl100k for GPT-4 / GPT-3.5...).
+    The encoder is cached so only the first call for a model pays the resolution cost.
+
+    Note:
+        Falls back to ENCODING_FALLBACK if tiktoken doesn't know the model or can't load its encoding.
+        Returns None if the fallback can't be loaded either (e.g. no cached encodings and no network) - the token counts are then estimated.
+        A failure to load an encoding is logged once per process.
+    """
+    global _encoder_failure_logged
+    if model in _ENCODERS:
+        return _ENCODERS[model]
+    with _ENCODERS_LOCK:
+        if model not in _ENCODERS:
+            encoder, error = None, None
+            try:
+                encoder = tiktoken.encoding_for_model(model)
+            except KeyError:
+                pass # Unknown model
+            except Exception as e:
+                error = e
+            if encoder is None:
+                # Cached under its own name too, so a fallback that can't be loaded isn't tried again for every model
+                if ENCODING_FALLBACK not in _ENCODERS:
+                    try:
+                        _ENCODERS[ENCODING_FALLBACK] = tiktoken.get_encoding(ENCODING_FALLBACK)
+                    except Exception as e:
+                        _ENCODERS[ENCODING_FALLBACK] = None
+                        error = e
+                encoder = _ENCODERS[ENCODING_FALLBACK]
+            if error is not None and not _encoder_failure_logged:
+                _encoder_failure_logged = True
+                consequence = f"using {ENCODING_FALLBACK}" if encoder is not None else "the token counts are estimated (calculate_token_aproximatively)"
+                log_warning(f"Failed to load the encoding of {model} - {consequence}. Not logged again", get_encoder, str(error))
+            _ENCODERS[model] = encoder
+    return _ENCODERS[model]
+
+# ****************************************** CACHES ***********************************************
+
+# Opt-in - see enable_embedding_cache() and enable_completion_cache()
+_embedding_cache: Optional[EmbeddingCache] = None
+_completion_cache: Optional[CompletionCache] = None
+
+def disable_completion_cache() -> None:
+    """
+    Stops using the completion cache. The cached answers stay on disk.
+    """
+    global _completion_cache
+    if _completion_cache is not None:
+        _completion_cache.close()
+    _completion_cache = None
+
+def disable_embedding_cache() -> None:
+    """
+    Stops using the embedding cache. The cached embeddings stay on disk.
+    """
+    global _embedding_cache
+    if _embedding_cache is not None:
+        _embedding_cache.close()
+    _embedding_cache = None
+
+def enable_completion_cache(path: Optional[str] = COMPLETION_CACHE_PATH, ttl: Optional[float] = COMPLETION_CACHE_TTL, memory_entries: int = COMPLETION_CACHE_MEMORY_ENTRIES) -> CompletionCache:
+    """
+    Puts a cache in front of request_chatgpt (and everything built on it) for the requests with temperature 0.
+    Requests with temperature > 0 always go to OpenAI. Use path=None for a memory only cache.
+    Returns the cache so you can check its stats().
+    """
+    global _completion_cache
+    disable_completion_cache()
+    _completion_cache = CompletionCache(path, ttl, memory_entries)
+    return _completion_cache
+
+def enable_embedding_cache(path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES) -> EmbeddingCache:
+    """
+    Puts an on-disk cache in front of embed_text and embed_texts so the same text is never embedded twice with the same model.
+    Returns the cache so you can check its stats().
+    """
+    global _embedding_cache
+    disable_embedding_cache()
+    _embedding_cache = EmbeddingCache(path, max_entries)
+    return _embedding_cache
+
+def get_completion_cache() -> Optional[CompletionCache]:
+    """
+    Returns the completion cache in use or None if the cache is not enabled.
+    """
+    return _completion_cache
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    Returns the embedding cache in use or None if the cache is not enabled.
+    """
+    return _embedding_cache
+
+def lookup_completion_cache(current_chat: list, max_tokens: int, model: str, temperature: float, top_p: float, stop) -> tuple[Optional[str], Optional[str]]:
+    """
+    Returns (key, cached answer) for a chat completion request.
+    The key is None if the completion cache is not enabled or the request is not cacheable. The answer is None on a miss.
+    """
+    cache = _completion_cache
+    if cache is None: return None, None
+    if not cache.is_cacheable(temperature):
+        cache.record_bypass()
+        return None, None
+    key = cache.make_key(model, current_chat, max_tokens, temperature, top_p, stop)
+    return key, cache.get(key)
+
+def store_completion_cache(key: Optional[str], answer: str) -> None:
+    """
+    Stores the answer of a request whose key was given by lookup_completion_cache.
+    """
+    cache = _completion_cache
+    if key is not None and cache is not None:
+        cache.put(key, answer)
+
+# ****************************************** CONVERSATIONS ****************************************
+
+# "role": "user", "content": - with the double quotes of json.dumps or the single quotes of str(list)
+GPT_MESSAGE_MARKER_PATTERN = re.compile(r"""(["'])role\1: \1(system|user|assistant)\1, \1content\1:""")
+
+class Conversation:
+    """
+    A chatTable that knows its size. Each message is counted once when added (content + CHAT_MESSAGE_OVERHEAD)
+    so the total is kept up to date in O(1) per message - nothing is recounted before a request.
 
+    Before a request, fit() drops the oldest messages which are not pinned until the conversation fits the window of the model
+    minus the max_tokens of the answer. The system role and the last message are never dropped.
+    Can be given to request_chatgpt, request_chatgpt_stream and arequest_chatgpt instead of a list of messages.
+
+    Args:
+        role (str, optional): The system prompt - pinned.
+        model (str, optional): The model whose tokenizer counts the tokens. Also the default model of fit().
+
+    Note:
+        The contents are made json_safe, like add_content_to_chatTable does.
+    """
+    def __init__(self, role: Optional[str] = None, model: str = MODEL_CHAT):
+        self.model = model
+        self.messages: list[dict[str, str]] = []
+        self.tokens: list[int] = []
+        self.pinned: list[bool] = []
+        self.total_tokens = CHAT_REPLY_OVERHEAD
+        if role is not None:
+            self.set_role(role)
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def add(self, content: str, role: str = "user", pinned: bool = False) -> Optional[int]:
+        """
+        Appends a message ('user' or 'assistant'). Returns its tokens, None if the role is wrong.
+        A pinned message is never dropped by fit() and trim().
+        """
+        normalized_role = role.lower()
+        if normalized_role not in ["user", "assistant"]:
+            log_issue("Wrong role for the Conversation", self.add, f"Role use is {role}")
+            return
+        content = make_string_json_safe(content)
+        tokens = calculate_token(content, self.model) + CHAT_MESSAGE_OVERHEAD
+        self.messages.append({"role": normalized_role, "content": content})
+        self.tokens.append(tokens)
+        self.pinned.append(pinned)
+        self.total_tokens += tokens
+        return tokens
+
+    def set_role(self, role: str) -> None:
+        """
+        Sets (or replaces) the system prompt at the start of the conversation.
+        """
+        content = make_string_json_safe(role)
+        tokens = calculate_token(content, self.model) + CHAT_MESSAGE_OVERHEAD
+        if self.messages and self.messages[0]["role"] == "system":
+            self.total_tokens += tokens - self.tokens[0]
+            self.messages[0] = {"role": "system", "content": content}
+            self.tokens[0] = tokens
+            return
+        self.messages.insert(0, {"role": "system", "content": content})
+        self.tokens.insert(0, tokens)
+        self.pinned.insert(0, True)
+        self.total_tokens += tokens
+
+    def pin(self, index: int, pinned: bool = True) -> None:
+        """
+        Pins (or unpins) the message at index - e.g. the instructions given in the first user message.
+        """
+        self.pinned[index] = pinned
+
+    def select(self, max_tokens: int, model: Optional[str] = None) -> Optional[tuple[list[int], int]]:
+        """
+        Returns (indexes of the messages to keep, tokens of the prompt) to fit the window of the model minus max_tokens,
+        dropping the oldest messages which are not pinned. None (and logs why) if the pinned messages alone don't fit.
+        """
+        budget = get_max_token_window(model or self.model) - int(max_tokens)
+        last = len(self.messages) - 1
+        if self.total_tokens <= budget:
+            return list(range(len(self.messages))), self.total_tokens
+        total = self.total_tokens
+        dropped = set()
+        for index in range(last):
+            if total <= budget: break
+            if not self.pinned[index]:
+                dropped.add(index)
+                total -= self.tokens[index]
+        if total > budget:
+            log_warning(f"The pinned messages and the last one need {total} tokens - the budget is {budget} with max_tokens {max_tokens}", self.select)
+            return
+        return [index for index in range(len(self.messages)) if index not in dropped], total
+
+    def fit(self, max_tokens: int, model: Optional[str] = None) -> Optional[list[dict[str, str]]]:
+        """
+        Returns the messages to send so the request fits the window of the model (self.model by default) with max_tokens for the answer.
+        The conversation itself is not changed. None if it can't fit.
+        """
+        selection = self.select(max_tokens, model)
+        if selection is None: return
+        return [self.messages[index] for index in selection[0]]
+
+    def trim(self, max_tokens: int, model: Optional[str] = None) -> int:
+        """
+        Same as fit() but removes the dropped messages from the conversation. Returns the number of messages removed.
+        """
+        selection = self.select(max_tokens, model)
+        if selection is None: return 0
+        kept, total = selection
+        removed = len(self.messages) - len(kept)
+        self.messages = [self.messages[index] for index in kept]
+        self.tokens = [self.tokens[index] for index in kept]
+        self.pinned = [self.pinned[index] for index in kept]
+        self.total_tokens = total
+        return removed
+
+    def to_chatTable(self) -> list[dict[str, str]]:
+        """
+        Returns a copy of the messages as a regular chatTable.
+        """
+        return [dict(message) for message in self.messages]
+
+def get_chat_messages(current_chat: Union[list, Conversation], max_tokens: int, model: str) -> tuple[Optional[list], Optional[int]]:
+    """
+    Returns (messages to send, tokens of the prompt) for a request. A list is sent as is and its tokens are not counted (None).
+    A Conversation is fitted to the window of the model - the messages are None if it can't fit.
+    """
+    if not isinstance(current_chat, Conversation):
+        return current_chat, None
+    selection = current_chat.select(max_tokens, model)
+    if selection is None:
+        return None, None
+    indexes, prompt_tokens = selection
+    return [current_chat.messages[index] for index in indexes], prompt_tokens
 
 # ****************************************** SUPPORT TO LLM ***************************************
 
@@ -50,18 +372,21 @@ def add_content_to_chatTable(content: str, role: str, chatTable: list[dict[str,
         new_chatTable.append({"role": "assistant", "content": content})
     return new_chatTable
 
-def calculate_token(text: str) -> Optional[int]:
+def calculate_token(text: str, model: str = MODEL_CHAT, estimate_unknown: bool = True) -> Optional[int]:
     """
-    Calculates the number of tokens for a given text using a specific tokenizer.
+    Calculates the number of tokens for a given text using the tokenizer of the model.
 
     Args:
         text (str): The text to calculate tokens for.
+        model (str, optional): The model whose tokenizer is used. Defaults to MODEL_CHAT.
+        estimate_unknown (bool, optional): If there's an error or no tokenizer, returns the estimate of calculate_token_aproximatively
+            (so the totals and budgets built on the counts stay valid). -1 (unknown) instead if False. Defaults to True.
 
     Returns:
-        int: The number of tokens in the text or -1 if there's an error.
+        int: The number of tokens in the text - estimated, or -1 with estimate_unknown=False, if it couldn't be tokenized.
     
     Note:
-        Uses the tokenizer API and takes approximately 0.13 seconds per query.
+        Special tokens such as '<|endoftext|>' are counted as regular text.
     """
     if not isinstance(text, str): 
         log_warning(f"Input is {type(text)} - must be str. Try force conversation", calculate_token, text)
@@ -70,18 +395,21 @@ def calculate_token(text: str) -> Optional[int]:
         except Exception as e:
             log_issue(e, calculate_token, f"Failed to convert to string => {text}")
             return
+    encoder = get_encoder(model)
+    if encoder is None: # Already logged by get_encoder
+        return estimate_token_from_char_classes(text) if estimate_unknown else -1
     try:
-        encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
-        return len(encoding.encode(text))
+        return len(encoder.encode_ordinary(text))
     except Exception as e:
         log_issue(e, calculate_token, f"Input type: {type(text)}. Text: {text}")
-        return -1
+        return estimate_token_from_char_classes(text) if estimate_unknown else -1
 
 def calculate_token_aproximatively(text: str) -> Optional[int]:
     """
     Returns the token cost for a given text input without calling tiktoken.
 
-    2 * Faster than tiktoken but less precise. Will go on the safe side (so real tokens is less)
+    Faster than tiktoken but less precise. Will go on the safe side (so real tokens is less)
+    Use calculate_tokens_aproximatively_batch for many texts. bench/calibrate_token_estimator.py measures the error against calculate_token.
 
     Method: A token is about 4 char when it's text but when the char is special, it consumes more token.
     """
@@ -93,23 +421,45 @@ def calculate_token_aproximatively(text: str) -> Optional[int]:
             log_issue(e, calculate_token, f"Failed to convert to string => {text}")
             return
     try:
-        nb_words = len(text.split())
-        normal, special, asci = 0,0,0
-        for char in text:
-            if str(char).isalnum():
-                normal +=1
-            elif str(char).isascii():
-                asci +=1
-            else:
-                special +=1
-        res = int(normal/4) + int(asci/2) + 2 * special + 2
-        if normal < special + asci:
-            return int(1.362 * (res + int(asci/2) +1)) #To be on the safe side
-        return int(1.362 * int((res+nb_words)/2))
+        return estimate_token_from_char_classes(text)
     except Exception as e:
         log_issue(e,calculate_token_aproximatively,f"The text was {type(text)} and {len(text)}")
         return calculate_token(text)
 
+def calculate_tokens_batch(texts: list[str], model: str = MODEL_CHAT, num_threads: int = 8, estimate_unknown: bool = True) -> list[int]:
+    """
+    Calculates the number of tokens of many texts at once, using tiktoken's multi-threaded encode_batch.
+    Much faster than calling calculate_token in a loop when counting thousands of chunks.
+
+    Args:
+        texts (list[str]): The texts to calculate tokens for. Non str elements are converted.
+        model (str, optional): The model whose tokenizer is used. Defaults to MODEL_CHAT.
+        num_threads (int, optional): Number of threads used by tiktoken. Defaults to 8.
+        estimate_unknown (bool, optional): Estimates the texts we couldn't tokenize, -1 (unknown) if False - as calculate_token. Defaults to True.
+
+    Returns:
+        list[int]: The number of tokens of each text, in the same order.
+    """
+    texts = [text if isinstance(text, str) else str(text) for text in texts]
+    encoder = get_encoder(model)
+    if encoder is None: # Already logged by get_encoder
+        return calculate_tokens_aproximatively_batch(texts) if estimate_unknown else [-1] * len(texts)
+    try:
+        return [len(tokens) for tokens in encoder.encode_ordinary_batch(texts, num_threads=num_threads)]
+    except Exception as e:
+        log_issue(e, calculate_tokens_batch, f"Batch of {len(texts)} texts - falling back to calculate_token")
+        return [calculate_token(text, model, estimate_unknown) for text in texts]
+
+def calculate_tokens_aproximatively_batch(texts: list[str]) -> list[int]:
+    """
+    Approximate token count of many texts - same estimate as calculate_token_aproximatively, meant to pre-screen large crawls.
+    Non str elements are converted.
+
+    Returns:
+        list[int]: The estimate of each text, in the same order.
+    """
+    return [estimate_token_from_char_classes(text if isinstance(text, str) else str(text)) for text in texts]
+
 def change_role_chatTable(previous_chat: list[dict[str, str]], new_role: str) -> list[dict[str, str]]:
     """
     Function to change the role defined at the beginning of a chat with a new role.
@@ -162,6 +512,33 @@ def check_if_gptconv_format(conversation: list[dict[str, str]]) -> Optional[bool
         if entry['role'] not in allowed_roles: return
     return True
 
+def chunk_text_spans(text: str, target_token: int = 200, overlap: int = 0, model: str = MODEL_CHAT) -> list[dict]:
+    """
+    Chunks a text in blocks of about target_token tokens, cutting at sentence boundaries when possible.
+    Returns a list of {"text", "start", "end", "tokens"} where text == original_text[start:end]. See iter_chunk_text.
+    """
+    return list(iter_chunk_text(text, target_token, overlap, model))
+
+def count_char_classes(text: str) -> tuple[int, int, int]:
+    """
+    Counts the chars of a text by class: (alphanumeric, other ASCII, other non ASCII) - as str.isalnum() and str.isascii() would.
+    Runs in C (encode, bytes.translate and regex) instead of looping over the chars in Python. Only the non ASCII chars need the unicode regex.
+    """
+    ascii_bytes = text.encode("ascii", "ignore")
+    ascii_other = len(ascii_bytes.translate(None, ASCII_ALNUM_BYTES))
+    non_ascii = "" if len(ascii_bytes) == len(text) else ASCII_RUN_PATTERN.sub("", text)
+    non_ascii_other = len(ALNUM_RUN_PATTERN.sub("", non_ascii)) if non_ascii else 0
+    return len(text) - ascii_other - non_ascii_other, ascii_other, non_ascii_other
+
+def check_token_window(question: str, role: str, model: str, max_tokens: int) -> Optional[int]:
+    """
+    Checks that the role + question + the requested tokens for the answer fit in the window of the model.
+    Returns the number of tokens of the request if it fits, None otherwise (and prints why).
+    """
+    initial_token_usage = calculate_token(role, model) + calculate_token(question, model)
+    if not fits_token_window(initial_token_usage, model, max_tokens): return
+    return initial_token_usage
+
 def check_valid_gpt_conversation(possible_gpt_conv) -> Optional[bool]:
     """
     Returns True / False depending on whether it is a valid GPT conv.
@@ -177,40 +554,106 @@ def check_valid_gpt_conversation(possible_gpt_conv) -> Optional[bool]:
     except:
         return
 
-def new_chunk_text(text: str, target_token: int = 200) -> list[str]:
+def new_chunk_text(text: str, target_token: int = 200, model: str = MODEL_CHAT) -> list[str]:
     """
     Much simpler function to chunk the text in blocks by spliting by sentence. The last chunk might be small.
+    Built on iter_chunk_text - use it directly for the spans, the overlap or to stream very large documents.
+    Without a tokenizer for the model, the chunks are sized with calculate_token_aproximatively.
     """
-    tok_text = calculate_token(text)
-    if tok_text < 1.1 * target_token:
+    if calculate_token(text, model) < 1.1 * target_token:
         return [text]
-    print(f"We need to chunk the text.\nCurrent tokens ~ {tok_text}. Target ~ {target_token}.\nLogically we should get about {custom_round(tok_text/target_token)} chunks")
-    sentences = split_into_sentences(text) 
-    aprx = False
-    # Spacial case if there is no sentences or less sentences than the desired chunk. If so, we chunk by word.
-    if len(sentences) < int(tok_text/target_token) + 1:
-        sentences = text.split()
-        aprx = True
-    token_calculator = calculate_token_aproximatively if aprx else calculate_token
-    final_chunks = []
-    current_chunk = ""
-    current_token_count = 0
-    for sentence in sentences:
-        sentence_tok = token_calculator(sentence)  # This is a function variable here
-        new_token_count =  current_token_count + sentence_tok
-        # If adding this "sentence" doesn't exceed the limit, add it to the current chunk.
-        if new_token_count <= target_token * 1.05:
-            current_chunk += sentence + " "
-            current_token_count = new_token_count
-        # If it does exceed the limit, finalize the current chunk and start a new one keeping the sentence.
+    if get_encoder(model) is None:
+        log_warning(f"No tokenizer for {model} - the chunks are sized with the approximate token count", new_chunk_text)
+        chunks = _chunk_text_aproximatively(text, target_token)
+    else:
+        chunks = [chunk["text"] for chunk in iter_chunk_text(text, target_token, model=model)]
+    print(f"We got and returned {len(chunks)} chunks")
+    return chunks
+
+def _chunk_text_aproximatively(text: str, target_token: int) -> list[str]:
+    # Packs the sentences up to 5% above target_token, as iter_chunk_text. A sentence longer than a chunk is cut between its words,
+    # each word counting for its share of the estimate of the sentence.
+    pieces = []
+    for sentence in SENTENCE_BOUNDARY_PATTERN.split(text):
+        sentence = sentence.strip()
+        if not sentence: continue
+        tokens = estimate_token_from_char_classes(sentence)
+        if tokens > target_token:
+            pieces.extend((word, tokens * (len(word) + 1) / (len(sentence) + 1)) for word in sentence.split())
         else:
-            final_chunks.append(current_chunk.strip())
-            current_chunk = sentence + " "
-            current_token_count = sentence_tok
-    if current_chunk.strip():
-        final_chunks.append(current_chunk.strip())
-    print(f"We got and returned {len(final_chunks)} chunks")
-    return final_chunks
+            pieces.append((sentence, tokens))
+    chunks, current, current_tokens = [], [], 0
+    for piece, tokens in pieces:
+        if current and current_tokens + tokens > target_token * 1.05:
+            chunks.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+def estimate_chat_tokens(current_chat: list, max_tokens: int, model: str = MODEL_CHAT, prompt_tokens: Optional[int] = None) -> int:
+    """
+    Estimates the tokens a chat completion will consume: the prompt (with the per message overhead) and the max_tokens of the answer.
+    That's what OpenAI counts against the tokens per minute quota. The prompt is only counted if prompt_tokens is not given.
+    """
+    if prompt_tokens is None:
+        contents = [message.get("content") or "" for message in current_chat]
+        prompt_tokens = sum(calculate_tokens_batch(contents, model, num_threads=1)) + CHAT_MESSAGE_OVERHEAD * len(current_chat) + CHAT_REPLY_OVERHEAD
+    return prompt_tokens + int(max_tokens)
+
+def estimate_token_from_char_classes(text: str) -> int:
+    """
+    The formula of calculate_token_aproximatively: about 4 alphanumeric chars per token, 2 per other ASCII char, 2 tokens per non ASCII char.
+    """
+    nb_words = len(text.split())
+    normal, asci, special = count_char_classes(text)
+    res = int(normal/4) + int(asci/2) + 2 * special + 2
+    if normal < special + asci:
+        return int(1.362 * (res + int(asci/2) +1)) #To be on the safe side
+    return int(1.362 * int((res+nb_words)/2))
+
+def fits_token_window(prompt_tokens: int, model: str, max_tokens: int) -> bool:
+    """
+    Returns True if a prompt of prompt_tokens + the requested tokens for the answer fit in the window of the model. Prints why otherwise.
+    """
+    max_token_window = get_max_token_window(model)
+    if prompt_tokens > max_token_window:
+        print("Your input is too large for the query regardless of the max_tokens for the reply.")
+        return False
+    elif prompt_tokens + max_tokens > max_token_window:
+        max_tokens_adjusted = max_token_window - prompt_tokens
+        print(f"Your input + the requested tokens for the answer exceed the maximum amount of {max_token_window}.\n Please adjust the max_tokens to a MAXIMUM of {max_tokens_adjusted}")
+        return False
+    return True
+
+def get_hedge_delay(function: str, model: str, ttft: bool = False) -> float:
+    """
+    Returns how long a hedged call waits for the answer (or the first token with ttft) before sending a second request:
+    the HEDGE_PERCENTILE of the recent latencies of the function and model in the metrics, HEDGE_DEFAULT_DELAY without enough of them.
+    """
+    delay = metrics.percentile(function, model, HEDGE_PERCENTILE, ttft, HEDGE_MIN_SAMPLES)
+    return HEDGE_DEFAULT_DELAY if delay is None else max(HEDGE_MIN_DELAY, delay)
+
+def get_max_token_window(model: str) -> int:
+    """
+    Returns the number of tokens (input + output) we allow for a model - its context window minus the WINDOW_BUFFER.
+    """
+    return {
+        MODEL_GPT4_TURBO: MAX_TOKEN_WINDOW_GPT4_TURBO - WINDOW_BUFFER,
+        MODEL_GPT4O: MAX_TOKEN_WINDOW_GPT4_TURBO - WINDOW_BUFFER,
+        MODEL_GPT4_STABLE: MAX_TOKEN_WINDOW_GPT4 - WINDOW_BUFFER,
+        MODEL_CHAT: MAX_TOKEN_WINDOW_GPT35_TURBO - WINDOW_BUFFER,
+    }.get(model, MAX_TOKEN_WINDOW_OLD - WINDOW_BUFFER)
+
+def get_rate_limit_delay(error: Exception, attempts: int) -> float:
+    """
+    Returns how long to hold a model after the n-th failed attempt due to a rate limit: the delay suggested by OpenAI if any,
+    otherwise an exponential backoff. Jitter is added so the threads don't all retry at the same time.
+    """
+    delay = get_retry_after(str(error), RATE_LIMIT_BACKOFF * 2 ** (attempts - 1))
+    return delay + random.uniform(0, RATE_LIMIT_BACKOFF)
 
 def get_gptconv_readable_format(gpt_conversation: str, system_message: bool = True) -> str:
     """
@@ -222,69 +665,35 @@ def get_gptconv_readable_format(gpt_conversation: str, system_message: bool = Tr
     """
     # guard clause
     if not gpt_conversation or not isinstance(gpt_conversation, str): return "Failed to convert to a GPT conversation (not a valid string input)\n"
-    def detect_quote_type(s: str) -> str:
-        if "\"role\": \"system\", \"content\":" in s:
-            return "\""
-        elif "'role': 'system', 'content':" in s:
-            return "'"
-        else:
-            return None
     try:
-        quote_type = detect_quote_type(gpt_conversation)
-        role_user = f"{quote_type}role{quote_type}: {quote_type}user{quote_type}, {quote_type}content{quote_type}:"
-        role_assistant = f"{quote_type}role{quote_type}: {quote_type}assistant{quote_type}, {quote_type}content{quote_type}:"
-        role_system = f"{quote_type}role{quote_type}: {quote_type}system{quote_type}, {quote_type}content{quote_type}:"
-        gpt_conv_as_list = []
-        # first, we add the system message
+        messages = [(role, content) for role, content in iter_gpt_conversation(gpt_conversation) if system_message or role != "system"]
         if system_message:
-            anchor_1 = gpt_conversation.find(role_system) # len 28 so 30 with the space
-            if anchor_1 == -1:
+            if not any(role == "system" for role, _ in messages):
                 log_issue("Failed to convert to a GPT conversation", get_gptconv_readable_format, f"No system prompt - wrong format for the input {gpt_conversation}")
                 return ERROR_MESSAGE
-            anchor_2 = gpt_conversation.find(role_user) # len 26 so 28 with the space
-            anchor_2_alt = gpt_conversation.find(role_assistant) # len 31 so 33 with the space
-            # only the system message
-            if anchor_2 == -1: 
+            if len(messages) == 1:
                 print("Warning: Your GPT conversation only contains the system prompt")
-                return f"system: {gpt_conversation[anchor_1+30:-3].strip()}"
-            elif 0 < anchor_2 < anchor_2_alt or (0 < anchor_2 and anchor_2_alt == -1):
-                gpt_conv_as_list.append(['system', gpt_conversation[anchor_1+30:anchor_2-5].strip()]) # -5 comes from "}, {" of the next element
-            # Self-affirmation role
-            elif 0 < anchor_2_alt < anchor_2:
-                gpt_conv_as_list.append(['system', gpt_conversation[anchor_1+30:anchor_2_alt-5].strip()])
-            else:
-                log_issue("Failed to convert to a GPT conversation", get_gptconv_readable_format, f"Weird structure for the input {gpt_conversation}")
-                return ERROR_MESSAGE
-        while True:
-            anchor_1 = gpt_conversation.find(role_user) # len 26 so 28 with the space
-            anchor_2 = gpt_conversation.find(role_assistant) # len 31 so 33 with the space
-            if anchor_1 == -1:
-                if anchor_2 == -1:
-                    break
-                gpt_conv_as_list.append(['assistant', gpt_conversation[anchor_2+33:-3].strip()])
-                break
-            elif anchor_2 == -1:
-                gpt_conv_as_list.append(['user', gpt_conversation[anchor_1+28:-3].strip()])
-                break
-            else:
-                if anchor_1 < anchor_2:
-                    # safety because sometimes we have several users in a row
-                    anchor_1_safety = gpt_conversation[anchor_1+29:].find(role_user)
-                    anchor_2 = anchor_2 if anchor_2-anchor_1 < anchor_1_safety or anchor_1_safety == -1 else anchor_1_safety +34 # 29 + 5. 29 comes from searching the string after anchor_1 + 29. The 5 comes from the difference between anchor_2 (33) and anchor_1 (28)
-                    gpt_conv_as_list.append(['user', gpt_conversation[anchor_1+28:anchor_2-5].strip()]) # -5 comes from "}, {"
-                    gpt_conversation = gpt_conversation[anchor_2-5:]
-                else:
-                    # safety because we could have several assistants in a row
-                    anchor_2_safety = gpt_conversation[anchor_2+34:].find(role_assistant)
-                    anchor_1 = anchor_1 if anchor_1-anchor_2 < anchor_2_safety or anchor_2_safety == -1 else anchor_2_safety + 29 # 34 comes from searching the string after anchor_2 + 34 minus the difference between anchor_1 and anchor 2.
-                    gpt_conv_as_list.append(['assistant', gpt_conversation[anchor_2+33:anchor_1-5].strip()])
-                    gpt_conversation = gpt_conversation[anchor_1-5:]
-        result_string = '\n'.join(': '.join(pair) for pair in gpt_conv_as_list)
-        return result_string
+        return '\n'.join(f"{role}: {content}" for role, content in messages)
     except Exception as e:
         log_issue(e, get_gptconv_readable_format, f"This was the input {gpt_conversation}")
         return ERROR_MESSAGE
 
+def handle_failed_chat_attempt(error: Exception, attempts: int, max_attempts: int, model: str) -> str:
+    """
+    Shared retry policy of the chat completion calls after a failed attempt: holds the model on rate limits
+    and switches to MODEL_CHAT_BACKUP after the second failure. Returns the model to use for the next attempt.
+    """
+    if is_rate_limit_error(error):
+        delay = get_rate_limit_delay(error, attempts)
+        print(f"Rate limit reached. We will slow down for {delay:.2f}s. This was attempt number {attempts}/{max_attempts}")
+        rate_limiter.penalize(model, delay)
+    else:
+        print(f"Error. This is attempt number {attempts}/{max_attempts}. The exception is {error}. Trying again")
+    if attempts == 2:
+        print(f"Trying with the previous model: {MODEL_CHAT_BACKUP}")
+        return MODEL_CHAT_BACKUP
+    return model
+
 def initialize_role_in_chatTable(role_definition: str) -> list[dict[str, str]]:
     """
     We need to define how we want our model to perform.
@@ -296,6 +705,122 @@ def initialize_role_in_chatTable(role_definition: str) -> list[dict[str, str]]:
     safe_role = make_string_json_safe(role_definition)
     return [{"role":"system", "content":safe_role}]
 
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    Returns True if the exception raised by the OpenAI client is a rate limit (429) error.
+    """
+    return isinstance(error, openai.RateLimitError) or 'Rate limit reached' in str(error)
+
+def iter_chunk_text(text: Union[str, Iterable[str]], target_token: int = 200, overlap: int = 0, model: str = MODEL_CHAT, window_chars: int = 200000) -> Iterator[dict]:
+    """
+    Chunks a text in blocks of about target_token tokens (up to 5% more) and yields them as {"text", "start", "end", "tokens"}.
+    start / end are the char offsets of the chunk in the full text. The last chunk might be small.
+
+    The text is encoded once per window and the chunks are built on the token offsets: a chunk ends at the last sentence
+    boundary that fits, or at the last word boundary if the sentence is too long, or exactly at target_token otherwise.
+
+    Args:
+        text (str or iterable of str): The text, or its successive pieces (e.g. an open file) to stream a very large document.
+        target_token (int, optional): Size of the chunks in tokens. Defaults to 200.
+        overlap (int, optional): Number of tokens of the end of a chunk repeated at the start of the next one. Defaults to 0.
+        model (str, optional): The model whose tokenizer is used. Defaults to MODEL_CHAT.
+        window_chars (int, optional): Chars encoded at once. Bounds the memory whatever the size of the text.
+    """
+    if target_token <= 0:
+        raise ValueError("target_token must be positive")
+    overlap = max(0, min(overlap, target_token // 2))
+    encoder = get_encoder(model)
+    if encoder is None:
+        raise RuntimeError(f"No tokenizer for {model} - the chunks are built on the token offsets")
+    pieces = (text[i:i + window_chars] for i in range(0, len(text), window_chars)) if isinstance(text, str) else iter(text)
+    buffer, base, final = "", 0, False
+    fill_to = window_chars
+    while not final:
+        # Fills the window - the buffer keeps the tail of the previous window that was not chunked yet
+        while len(buffer) < fill_to:
+            piece = next(pieces, None)
+            if piece is None:
+                final = True
+                break
+            buffer += piece
+        if not buffer.strip():
+            return
+        tokens = encoder.encode_ordinary(buffer)
+        _, offsets = encoder.decode_with_offsets(tokens)
+        nb_tokens = len(tokens)
+        # A cut is the index of the first token of the next sentence (or word)
+        sentence_cuts = [bisect.bisect_left(offsets, match.start()) for match in SENTENCE_BOUNDARY_PATTERN.finditer(buffer)]
+        word_cuts = None  # Only computed if a sentence is longer than a chunk or for the overlap
+        # Except for the last window, we keep a margin so the tail is re-encoded with what comes next
+        stop_at = nb_tokens if final else nb_tokens - 2 * target_token
+        start = 0
+        while start < stop_at:
+            limit = start + int(target_token * 1.05)
+            if limit >= nb_tokens:
+                if not final: break
+                end = nb_tokens
+            else:
+                index = bisect.bisect_right(sentence_cuts, limit) - 1
+                end = sentence_cuts[index] if index >= 0 else 0
+                if end <= start:
+                    if word_cuts is None:
+                        word_cuts = [bisect.bisect_left(offsets, match.start()) for match in WORD_BOUNDARY_PATTERN.finditer(buffer)]
+                    index = bisect.bisect_right(word_cuts, limit) - 1
+                    end = word_cuts[index] if index >= 0 else 0
+                    if end <= start:
+                        end = start + target_token
+            char_start = offsets[start]
+            char_end = offsets[end] if end < nb_tokens else len(buffer)
+            chunk = buffer[char_start:char_end]
+            stripped = chunk.strip()
+            if stripped:
+                char_start += len(chunk) - len(chunk.lstrip())
+                yield {"text": stripped, "start": base + char_start, "end": base + char_start + len(stripped), "tokens": end - start}
+            if end >= nb_tokens:
+                start = nb_tokens
+                break
+            next_start = end - overlap
+            if overlap:
+                # Starts the overlap on a word rather than in the middle of one
+                if word_cuts is None:
+                    word_cuts = [bisect.bisect_left(offsets, match.start()) for match in WORD_BOUNDARY_PATTERN.finditer(buffer)]
+                index = bisect.bisect_left(word_cuts, next_start)
+                if index < len(word_cuts) and word_cuts[index] < end:
+                    next_start = word_cuts[index]
+            start = max(next_start, start + 1)
+        if start >= nb_tokens:
+            return
+        # If the window was too small to make a chunk, the next one is larger
+        fill_to = window_chars if start > 0 else len(buffer) + window_chars
+        consumed = offsets[start]
+        buffer = buffer[consumed:]
+        base += consumed
+
+def iter_gpt_conversation(gpt_conversation: str, raw: bool = False) -> Iterator[tuple[str, str]]:
+    """
+    Parses a string format GPT conversation (json.dumps or str of the list) in a single pass and yields its (role, content) lazily.
+    Doesn't need the string to be valid JSON: a message is whatever is between its "role": ..., "content": marker and the next one.
+    The quote style is the one of the first marker - markers with the other style are part of the content.
+
+    Args:
+        gpt_conversation (str): The conversation as stored.
+        raw (bool, optional): If True, the content is the text between the markers as is (with the quotes and the "}, {" of
+            the separator). Otherwise they are removed. Defaults to False.
+    """
+    quote, role, start = None, None, 0
+    for match in GPT_MESSAGE_MARKER_PATTERN.finditer(gpt_conversation):
+        if quote is None:
+            quote = match.group(1)
+        elif match.group(1) != quote:
+            continue
+        if role is not None:
+            content = gpt_conversation[start:match.start()]
+            yield role, content if raw else strip_gpt_message_delimiters(content)
+        role, start = match.group(2), match.end()
+    if role is not None:
+        content = gpt_conversation[start:]
+        yield role, content if raw else strip_gpt_message_delimiters(content)
+
 def make_string_json_safe(s : str) -> str:
     """
     Replace newlines, tabs, and other control characters
@@ -313,7 +838,7 @@ def print_gpt_models(all:bool=True) -> None:
         all: If True, will print all the models. Else, only the 'GPT' ones.
         verbose: If False, will only print the name. Else, everything.
     """
-    response = client.models.list() # fetches all the models
+    response = get_client().models.list() # fetches all the models
     for elem in response.data:
         if not all:  
             if "gpt" in elem.id:
@@ -332,9 +857,9 @@ def print_gptconv_nicely(gpt_conversation: str, system_message: bool = True) ->
 def print_len_token_price(file_path_or_text, Embed = False):
     """
     Basic function to print out the length, the number of token, of a given file or text.
-    Chat gpt-3.5-turbo is at $0.002 per 1K token while Embedding is at $0.0004 per 1K tokens. If not specified, we assume it's Chat gpt-3.5-turbo.
+    The price is the input price of MODEL_CHAT (or MODEL_EMB_LARGE with Embed) in MODEL_PRICES.
     """
-    price = 0.002 if not Embed else 0.0004
+    model = MODEL_EMB_LARGE if Embed else MODEL_CHAT
     if os.path.isfile(file_path_or_text):
         name = os.path.basename(file_path_or_text)
         with open(file_path_or_text, "r") as file:
@@ -344,10 +869,25 @@ def print_len_token_price(file_path_or_text, Embed = False):
         name = "Input text"
     else:
         return # to avoid error in case of wrong input
-    tok = calculate_token(content)
-    out = f"{name}: {len(content)} chars  **  ~ {tok} tokens ** ~ ${round(tok/1000 * price,2)}"
+    tok = calculate_token(content, model, estimate_unknown=False)
+    if tok < 0: # No tokenizer - unknown
+        print(f"{name}: {len(content)} chars  **  unknown tokens")
+        return
+    out = f"{name}: {len(content)} chars  **  ~ {tok} tokens ** ~ ${round(get_call_cost(model, tok), 4)}"
     print(out)
 
+def record_call(function: str, model: str, used_model: str, start: float, attempts: int, usage=None, error: bool = False, cache_hits: int = 0, ttft: Optional[float] = None, hedged: bool = False, call_site: Optional[str] = None) -> None:
+    """
+    Records a call of the API in the metrics registry: latency since start, the tokens of response.usage (if any) and the fallback model.
+    """
+    metrics.record(
+        function, model, time.perf_counter() - start, attempts,
+        prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+        completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+        fallback=used_model if used_model != model else None,
+        cache_hits=cache_hits, error=error, ttft=ttft, hedged=hedged, call_site=call_site,
+    )
+
 def repair_gpt_conversation(conversation_as_string: str) -> Optional[str]:
     """
     Repair a GPT conversation to ensure we can then json.loads() it.
@@ -356,61 +896,10 @@ def repair_gpt_conversation(conversation_as_string: str) -> Optional[str]:
     result = None
     try:
         new_list = []
-        user_ = r'{"role": "user", "content":'
-        assistant_ = r'{"role": "assistant", "content":'
-        len_a = len(assistant_)
-        len_u = len(user_)
-        while True:
-            bal_user = conversation_as_string.find(user_)
-            bal_assistant = conversation_as_string.find(assistant_)
-            # Cases: over-over / user-over / assistant-over THEN:: user-user / assistant-assistant / user-assistant / assistant-user
-            
-            # over-over
-            if bal_user == -1 and bal_assistant == -1: 
-                break
-            
-            next_bala = conversation_as_string.find(assistant_, bal_assistant + len_a)
-            next_balu = conversation_as_string.find(user_, bal_user + len_u)
-            
-            # assistant-over
-            if bal_user == -1 and next_bala == -1:
-                content = make_string_json_safe(conversation_as_string[bal_assistant + len_a: conversation_as_string.rfind("}")])
-                new_list.append({"role": "assistant", "content":content})
-                break
-            # user-over
-            if bal_assistant == -1 and next_balu == -1:
-                content = make_string_json_safe(conversation_as_string[bal_user + len_u: conversation_as_string.rfind("}")])
-                new_list.append({"role": "user", "content":content})
-                break
-            
-            # user-user
-            if (0 < bal_user < next_balu < bal_assistant or 
-                bal_assistant == -1 and 0 < bal_user < next_balu):
-                role = "user"
-                content = make_string_json_safe(conversation_as_string[bal_user + len_u: conversation_as_string.rfind("}", None, next_balu)])
-                conversation_as_string = conversation_as_string[conversation_as_string.rfind("}", None, next_balu):]
-            # assistant-assistant
-            elif (0 < bal_assistant < next_bala < bal_user or 
-                bal_user == -1 and 0 < bal_assistant < next_bala):
-                role = "assistant"
-                content = make_string_json_safe(conversation_as_string[bal_assistant + len_a: conversation_as_string.rfind("}", None, next_bala)])
-                conversation_as_string = conversation_as_string[conversation_as_string.rfind("}", None, next_bala):]
-            # user-assistant
-            elif 0 < bal_user < bal_assistant:
-                role = "user"
-                content = make_string_json_safe(conversation_as_string[bal_user + len_u: conversation_as_string.rfind("}", None, bal_assistant)])
-                conversation_as_string = conversation_as_string[conversation_as_string.rfind("}", None, bal_assistant):]
-            # assistant-user
-            elif 0 < bal_assistant < bal_user:
-                role = "assistant"
-                content = make_string_json_safe(conversation_as_string[bal_assistant + len_a: conversation_as_string.rfind("}", None, bal_user)])
-                conversation_as_string = conversation_as_string[conversation_as_string.rfind("}", None, bal_user):]
-            else:
-                print("issue - weird use case")
-                print(bal_assistant, bal_user, next_bala, next_balu)
-                print(conversation_as_string)
-                return
-            new_list.append({"role": role, "content":content})
+        # The content runs up to the "}" closing its element - the quotes of the value are kept (as ') by make_string_json_safe
+        for role, content in iter_gpt_conversation(conversation_as_string, raw=True):
+            if role == "system": continue
+            new_list.append({"role": role, "content": make_string_json_safe(content[:content.rfind("}")])})
         try:
             result = json.dumps(new_list)
             json.loads(result)
@@ -447,6 +936,14 @@ def retry_if_too_short(func, *args, **kwargs):
             return result
     return None
 
+def set_rate_limit(model: str, rpm: Optional[int] = None, tpm: Optional[int] = None) -> None:
+    """
+    Sets the requests per minute and tokens per minute allowed for a model (check your tier on the OpenAI dashboard).
+    request_chatgpt and the embedding functions then wait before sending instead of hitting 'Rate limit reached'.
+    Both None removes the limit.
+    """
+    rate_limiter.set_limit(model, rpm, tpm)
+
 def sanitize_bad_gpt_output(gpt_output: str, case = None) -> str:
     """
     Sanitize bad outputs made by GPT according to bad output we already saw.
@@ -486,11 +983,27 @@ def self_affirmation_role(role_chatbot_in_text: str) -> str:
     clean_text = clean_text.replace("Your ", "My ").replace(" your ", " my ").replace(" Your ", " My ")
     return clean_text
 
+def strip_gpt_message_delimiters(raw_content: str) -> str:
+    """
+    Removes what surrounds the content of a message in a string format GPT conversation: the quotes of the value
+    and the end of the element ("}, {" before the next message, "}]" after the last one).
+    """
+    content = raw_content.strip()
+    if content.endswith("{"):
+        content = content[:-1].rstrip()
+    if content.endswith(",") or content.endswith("]"):
+        content = content[:-1].rstrip()
+    if content.endswith("}"):
+        content = content[:-1].rstrip()
+    if len(content) >= 2 and content[0] in "\"'" and content[-1] == content[0]:
+        content = content[1:-1]
+    return content.strip()
+
 # *************************************************************************************************
 # ****************************************** REGULAR API CALLS ************************************
 # *************************************************************************************************
 
-def ask_question_gpt(question:str, role:str = "", model:str = MODEL_CHAT, max_tokens:int = MAX_TOKEN_OUTPUT_DEFAULT, verbose:bool = True, temperature=0, top_p=1, json_on: bool = False) -> str:
+def ask_question_gpt(question:str, role:str = "", model:str = MODEL_CHAT, max_tokens:int = MAX_TOKEN_OUTPUT_DEFAULT, verbose:bool = True, temperature=0, top_p=1, json_on: bool = False, stream: bool = False, stats: Optional[dict] = None) -> Union[str, Iterator[str]]:
     """
     Queries an OpenAI GPT model (GPT-3.5 Turbo / GPT-4 / GPT-4O) with a specific question.
 
@@ -501,29 +1014,22 @@ def ask_question_gpt(question:str, role:str = "", model:str = MODEL_CHAT, max_to
         max_tokens (int, optional): Maximum number of tokens for the answer.
         verbose (bool, optional): Will print information in the console.
         json_on (bool, optional): Whether to force the output in JSON format // UNUSED FOR NOW
+        stream (bool, optional): If True, returns an iterator over the text deltas of the reply (see request_chatgpt_stream).
+        stats (dict, optional): Only with stream. Filled with the time to first token, latency and tokens/sec of the call.
 
     Returns:
-        str: The model's reply to the question.
+        str: The model's reply to the question. With stream, an iterator over the reply.
     """
-    max_token_window = {
-        MODEL_GPT4_TURBO: MAX_TOKEN_WINDOW_GPT4_TURBO - WINDOW_BUFFER,
-        MODEL_GPT4O: MAX_TOKEN_WINDOW_GPT4_TURBO - WINDOW_BUFFER,
-        MODEL_GPT4_STABLE: MAX_TOKEN_WINDOW_GPT4 - WINDOW_BUFFER,
-        MODEL_CHAT: MAX_TOKEN_WINDOW_GPT35_TURBO - WINDOW_BUFFER,
-    }.get(model, MAX_TOKEN_WINDOW_OLD - WINDOW_BUFFER)
-    initial_token_usage = calculate_token(role) + calculate_token(question)
-    if initial_token_usage > max_token_window:
-        print("Your input is too large for the query regardless of the max_tokens for the reply.")
-        return ""
-    elif initial_token_usage + max_tokens > max_token_window:
-        max_tokens_adjusted = max_token_window - initial_token_usage
-        print(f"Your input + the requested tokens for the answer exceed the maximum amount of {max_token_window}.\n Please adjust the max_tokens to a MAXIMUM of {max_tokens_adjusted}")
+    # Counted once here - request_chatgpt reuses the counts for the window and the rate limiter
+    conversation = Conversation(role, model)
+    conversation.add(question, "user")
+    if not fits_token_window(conversation.total_tokens, model, max_tokens):
         return ""
-    current_chat = initialize_role_in_chatTable(role)
-    current_chat = add_content_to_chatTable(question, "user", current_chat)
     if verbose:
-        print(f"Completion ~ {max_tokens} tokens. Request ~ {initial_token_usage} tokens.\nContext provided to GPT is:\n{current_chat}")
-    return request_chatgpt(current_chat, max_tokens=max_tokens, model=model, temperature=temperature,top_p=top_p, json_on=json_on)
+        print(f"Completion ~ {max_tokens} tokens. Request ~ {conversation.total_tokens} tokens.\nContext provided to GPT is:\n{conversation.messages}")
+    if stream:
+        return request_chatgpt_stream(conversation, max_tokens=max_tokens, model=model, temperature=temperature, top_p=top_p, json_on=json_on, stats=stats)
+    return request_chatgpt(conversation, max_tokens=max_tokens, model=model, temperature=temperature,top_p=top_p, json_on=json_on)
 
 def ask_question_gpt4(question: str, role: str, model=MODEL_GPT4_TURBO, max_tokens=MAX_TOKEN_OUTPUT_DEFAULT_HUGE, verbose = False, temperature=0, top_p=1, json_on=False) -> str:
     """
@@ -537,12 +1043,130 @@ def ask_question_gpto(question: str, role: str, model=MODEL_GPT4O, max_tokens=MA
     """
     return ask_question_gpt(question = question, role = role, model = model, max_tokens= max_tokens, verbose=verbose, temperature=temperature, top_p=top_p, json_on=json_on)
 
-def embed_text(text:str, max_attempts:int=3, model=MODEL_EMB_LARGE) -> Optional[list[float]]:
+def ask_question_gpt_map_reduce(question: str, role: str = "", model: str = MODEL_CHAT, max_tokens: int = MAX_TOKEN_OUTPUT_DEFAULT, reduce_role: Optional[str] = None,
+                                chunk_tokens: Optional[int] = None, overlap: int = 0, max_concurrency: int = MAP_REDUCE_MAX_CONCURRENCY, max_attempts: int = 3,
+                                verbose: bool = True, temperature=0, top_p=1) -> str:
+    """
+    Same as ask_question_gpt but for a question larger than the window of the model. The question is chunked and the role is asked
+    on each chunk concurrently (map). The answers are then combined by groups that fit the window with reduce_role, level after level,
+    until one answer is left (reduce). The time depends on the depth of the tree, not on the number of chunks.
+
+    Args:
+        question (str): The input - e.g. a whole document.
+        role (str, optional): System prompt of the map requests - what to do with each chunk.
+        model (str, optional): The model of all the requests. Defaults to MODEL_CHAT.
+        max_tokens (int, optional): Maximum number of tokens of each answer, the final one included.
+        reduce_role (str, optional): System prompt combining the answers. Defaults to ROLE_MAP_REDUCE_COMBINE built on role.
+        chunk_tokens (int, optional): Size of the chunks. Defaults to as much as the window allows - smaller means more requests in parallel.
+        overlap (int, optional): Tokens of the end of a chunk repeated at the start of the next one. Defaults to 0.
+        max_concurrency (int, optional): Max number of requests in flight. Defaults to MAP_REDUCE_MAX_CONCURRENCY.
+        max_attempts (int, optional): Maximum number of retries per request. Defaults to 3.
+
+    Returns:
+        str: The final answer. The answer of ask_question_gpt if the question fits in one request. "" if the windows are too small
+        for max_tokens or there is no tokenizer for the model, OPEN_AI_ISSUE if a request failed.
+    """
+    if not question.strip(): return ""
+    start = time.perf_counter()
+    call_site = get_call_site()
+    reduce_role = reduce_role or ROLE_MAP_REDUCE_COMBINE.format(role=role or "Answer the request of the user.")
+    window = get_max_token_window(model) - max_tokens - CHAT_MESSAGE_OVERHEAD
+    map_budget = int((window - Conversation(role, model).total_tokens) * MAP_REDUCE_CHUNK_MARGIN)
+    reduce_budget = int((window - Conversation(reduce_role, model).total_tokens) * MAP_REDUCE_CHUNK_MARGIN)
+    if reduce_budget < 2 * (max_tokens + CHAT_MESSAGE_OVERHEAD) or map_budget <= 0:
+        log_issue(f"The window of {model} is too small to combine answers of {max_tokens} tokens", ask_question_gpt_map_reduce, "Lower max_tokens")
+        return ""
+    if get_encoder(model) is None:
+        log_issue(f"No tokenizer for {model} - can't chunk the question", ask_question_gpt_map_reduce)
+        return ""
+    chunk_tokens = min(chunk_tokens or map_budget, map_budget)
+    chunks = [chunk["text"] for chunk in iter_chunk_text(question, chunk_tokens, overlap, model)]
+    if len(chunks) == 1:
+        return ask_question_gpt(question, role, model, max_tokens, verbose, temperature, top_p)
+
+    def ask(system: str, content: str) -> str:
+        conversation = Conversation(system, model)
+        conversation.add(content, "user")
+        return request_chatgpt(conversation, max_tokens, max_attempts=max_attempts, model=model, temperature=temperature, top_p=top_p)
+
+    def combine(answers: list[str], group: list[int]) -> str:
+        if len(group) == 1: return answers[group[0]] # Left alone at this level - combined at the next one
+        return ask(reduce_role, "\n\n".join(f"### PART {n} ###\n{answers[i]}" for n, i in enumerate(group, 1)))
+
+    if verbose:
+        print(f"Map-reduce of ~{calculate_token_aproximatively(question)} tokens: {len(chunks)} chunks of ~{chunk_tokens} tokens")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        answers = list(executor.map(lambda chunk: ask(role, chunk), chunks))
+        while len(answers) > 1 and OPEN_AI_ISSUE not in answers:
+            # The header of each part is counted with the message overhead
+            groups = pack_reduce_groups([tokens + CHAT_MESSAGE_OVERHEAD for tokens in calculate_tokens_batch(answers, model)], reduce_budget)
+            if len(groups) == len(answers):
+                log_issue("The answers are too long to be combined", ask_question_gpt_map_reduce, f"{len(answers)} answers left - lower max_tokens")
+                answers = [OPEN_AI_ISSUE]
+                break
+            if verbose:
+                print(f"Combining {len(answers)} answers in {len(groups)} groups")
+            previous = answers
+            answers = list(executor.map(lambda group: combine(previous, group), groups))
+    error = OPEN_AI_ISSUE in answers
+    if error:
+        log_warning(f"A request failed - no answer for the {len(chunks)} chunks", ask_question_gpt_map_reduce)
+    # The requests and their usage are recorded by request_chatgpt
+    record_call("ask_question_gpt_map_reduce", model, model, start, 0, error=error, call_site=call_site)
+    return OPEN_AI_ISSUE if error else answers[0]
+
+def embed_batch(batch: list[str], model=MODEL_EMB_LARGE, max_attempts: int = 3, tokens: Optional[int] = None, dimensions: Optional[int] = None, call_site: Optional[str] = None) -> list[Optional[list[float]]]:
+    """
+    Sends one request to the embedding endpoint for a batch of texts. Used by embed_texts.
+    Returns the embeddings in the order of the batch. If the request is rejected, the batch is split in two to isolate the faulty texts.
+    An element is None if its text could not be embedded.
+
+    Note:
+        tokens is the size of the batch for the rate limiter. Computed if not provided.
+        dimensions is passed to the endpoint (text-embedding-3 models only). None for the full size.
+        call_site is recorded in the metrics - embed_texts passes its own as the batches run in other threads.
+    """
+    start = time.perf_counter()
+    attempts = 0
+    while attempts < max_attempts:
+        try:
+            if rate_limiter.has_limit(model):
+                rate_limiter.acquire(model, tokens if tokens is not None else sum(calculate_tokens_batch(batch, model)))
+            response = get_client().embeddings.create(
+                model=model,
+                input=batch,
+                encoding_format="float",
+                dimensions=dimensions or openai.NOT_GIVEN,
+                )
+            record_call("embed_batch", model, model, start, attempts + 1, getattr(response, "usage", None), call_site=call_site)
+            return [elem.embedding for elem in sorted(response.data, key=lambda elem: elem.index)]
+        except openai.BadRequestError as e:
+            if len(batch) == 1:
+                log_warning(f"The text was rejected: {e}", embed_batch, f"This was the text: {batch[0][:100]}")
+                record_call("embed_batch", model, model, start, attempts + 1, error=True, call_site=call_site)
+                return [None]
+            middle = len(batch) // 2
+            return embed_batch(batch[:middle], model, max_attempts, dimensions=dimensions, call_site=call_site) + embed_batch(batch[middle:], model, max_attempts, dimensions=dimensions, call_site=call_site)
+        except Exception as e:
+            if is_rate_limit_error(e):
+                rate_limiter.penalize(model, get_rate_limit_delay(e, attempts + 1))
+            elif not check_co():
+                log_warning("Warning: You don't have internet. Embedding will not work", embed_batch)
+                record_call("embed_batch", model, model, start, attempts + 1, error=True, call_site=call_site)
+                return [None] * len(batch)
+            attempts += 1
+            log_warning(f"We faced {e} * Attempt: #{attempts}/ {max_attempts}", embed_batch, f"Batch of {len(batch)} texts")
+    log_issue(f"No answer despite {max_attempts} attempts", embed_batch, f"Batch of {len(batch)} texts. First text: {batch[0][:100]}")
+    record_call("embed_batch", model, model, start, attempts, error=True, call_site=call_site)
+    return [None] * len(batch)
+
+def embed_text(text:str, max_attempts:int=3, model=MODEL_EMB_LARGE, dimensions: Optional[int] = None) -> Optional[list[float]]:
     """
     Micro function which returns the embedding of one chunk of text or 0 if issue.
     Used for the multi-threading.
 
     Model is the new large new embedding one. Use Small if speed is a concern.
+    dimensions shortens the embedding on OpenAI's side (text-embedding-3 models only) - e.g. 256 or 1024 instead of 3072 for the large one.
     Returns None if issue.
     """
     try:
@@ -550,31 +1174,209 @@ def embed_text(text:str, max_attempts:int=3, model=MODEL_EMB_LARGE) -> Optional[
         if not isinstance(text, str):
             log_warning("You need to input a string", embed_text, f"You inputed {type(text)}")
             return
+        start = time.perf_counter()
+        cache = _embedding_cache
+        if cache is not None:
+            cached = cache.get(text, model, dimensions)
+            if cached is not None:
+                record_call("embed_text", model, model, start, 0, cache_hits=1)
+                return cached
         attempts = 0
         while attempts < max_attempts:
             try:
-                res = client.embeddings.create(
+                if rate_limiter.has_limit(model):
+                    rate_limiter.acquire(model, calculate_token(text, model))
+                response = get_client().embeddings.create(
                     model=model,
                     input=text,
-                    encoding_format="float"
-                    ).data[0].embedding
+                    encoding_format="float",
+                    dimensions=dimensions or openai.NOT_GIVEN,
+                    )
+                res = response.data[0].embedding
+                record_call("embed_text", model, model, start, attempts + 1, getattr(response, "usage", None))
+                if cache is not None:
+                    cache.put(text, res, model, dimensions)
                 return res
             except Exception as e:
-                if not check_co():
-                    log_warning("Warning: You don't have internet. Embedding will not work")
+                if is_rate_limit_error(e):
+                    rate_limiter.penalize(model, get_rate_limit_delay(e, attempts + 1))
+                elif not check_co():
+                    log_warning("Warning: You don't have internet. Embedding will not work", embed_text)
+                    record_call("embed_text", model, model, start, attempts + 1, error=True)
                     return
                 attempts += 1
-                log_warning(f"We faced {e} * Attempt: #{attempts}/ 3", embed_text)
+                log_warning(f"We faced {e} * Attempt: #{attempts}/ {max_attempts}", embed_text)
         log_issue(f"No answer despite {max_attempts} attempts", embed_text, f"This was the text: {text[:100]}")
+        record_call("embed_text", model, model, start, attempts, error=True)
     except Exception as e:
         log_issue(e, embed_text, f"""For text {text[:300] + ('...' if len(text)> 300 else '')}""")
 
-def request_chatgpt(current_chat: list, max_tokens: int, stop_list=False, max_attempts=3, model=MODEL_CHAT, temperature=0, top_p=1, json_on=False) -> str:
+def embed_texts(texts: list[str], model=MODEL_EMB_LARGE, batch_size: int = MAX_EMBEDDING_BATCH, max_concurrency: int = 4, max_attempts: int = 3, dimensions: Optional[int] = None) -> list[Optional[list[float]]]:
+    """
+    Returns the embeddings of many texts. Texts are packed in batches (by count and by token budget) and the batches are sent concurrently.
+
+    Args:
+        texts (list[str]): The texts to embed.
+        model (str, optional): The embedding model. Defaults to MODEL_EMB_LARGE.
+        batch_size (int, optional): Max number of texts per request. Capped at MAX_EMBEDDING_BATCH.
+        max_concurrency (int, optional): Max number of requests in flight. Defaults to 4.
+        max_attempts (int, optional): Maximum number of retries per batch. Defaults to 3.
+        dimensions (int, optional): Size of the embeddings, for the text-embedding-3 models. None for the full size.
+
+    Returns:
+        list: One element per input text, in the same order. The element is None if that text couldn't be embedded
+        (empty, not a str, above MAX_TOKEN_EMBEDDING_INPUT or the request failed) - the other texts are still returned.
+
+    Note:
+        Duplicated texts are only sent once. If enable_embedding_cache() was called, cached texts are not sent at all.
+    """
+    start = time.perf_counter()
+    call_site = get_call_site()
+    embeddings = [None] * len(texts)
+    # Duplicates are collapsed so each distinct text is only looked up and sent once
+    positions: dict[str, list[int]] = {}
+    for i, text in enumerate(texts):
+        if isinstance(text, str) and text != "":
+            positions.setdefault(text, []).append(i)
+    nb_invalid = len(texts) - sum(len(indexes) for indexes in positions.values())
+    if nb_invalid:
+        log_warning(f"{nb_invalid} inputs are empty or not a string - they will be None", embed_texts)
+    if not positions: return embeddings
+    unique_texts = list(positions)
+    unique_embeddings = [None] * len(unique_texts)
+    cache = _embedding_cache
+    if cache is not None:
+        unique_embeddings = cache.get_many(unique_texts, model, dimensions)
+    missing = [i for i, embedding in enumerate(unique_embeddings) if embedding is None]
+    if missing:
+        tokens = calculate_tokens_batch([unique_texts[i] for i in missing], model)
+        batches = pack_embedding_batches(missing, tokens, min(batch_size, MAX_EMBEDDING_BATCH))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            tokens_of = dict(zip(missing, tokens))
+            futures = {executor.submit(embed_batch, [unique_texts[i] for i in batch], model, max_attempts, sum(tokens_of[i] for i in batch), dimensions, call_site): batch for batch in batches}
+            for future in concurrent.futures.as_completed(futures):
+                for i, embedding in zip(futures[future], future.result()):
+                    unique_embeddings[i] = embedding
+        if cache is not None:
+            cache.put_many([unique_texts[i] for i in missing], [unique_embeddings[i] for i in missing], model, dimensions)
+    nb_failed = 0
+    for text, embedding in zip(unique_texts, unique_embeddings):
+        if embedding is None:
+            nb_failed += len(positions[text])
+        for i in positions[text]:
+            embeddings[i] = embedding
+    if nb_failed:
+        log_warning(f"{nb_failed}/{len(texts)} texts could not be embedded - they are None in the output", embed_texts)
+    # The requests and their usage are recorded by embed_batch
+    record_call("embed_texts", model, model, start, 0, error=nb_failed > 0, cache_hits=len(unique_texts) - len(missing), call_site=call_site)
+    return embeddings
+
+def open_hedged_stream(request: dict, model: str, hedge_model: str, delay: float, tokens: int = 0) -> tuple[str, Iterator, bool]:
+    """
+    Sends a streaming chat request to model and, if its first token didn't arrive after delay seconds, the same request to hedge_model.
+    The first stream to produce a token wins and the other one is closed - which stops its generation on OpenAI's side.
+
+    Args:
+        request (dict): The arguments of get_client().chat.completions.create except the model - with stream=True.
+        tokens (int, optional): Size of the request for the rate limiter of hedge_model.
+
+    Returns:
+        tuple: (model of the winner, its chunks from the start of the stream, True if the second request was sent).
+        Raises the error of the last request if both failed.
+    """
+    lock = threading.Lock()
+    results = queue.Queue()
+    streams = {}
+    winner = []
+    def close(stream) -> None:
+        try:
+            stream.close()
+        except Exception:
+            pass  # Closing a stream which is being read by its thread - its next read fails and the thread stops
+    def contender(index: int, contender_model: str) -> None:
+        try:
+            stream = get_client().chat.completions.create(model=contender_model, **request)
+            with lock:
+                if winner and winner[0] != index:
+                    close(stream)
+                    return
+                streams[index] = stream
+            chunks = iter(stream)
+            received = []
+            for chunk in chunks:
+                received.append(chunk)
+                if chunk.choices and (chunk.choices[0].delta.content or "").strip():
+                    break
+            results.put((index, contender_model, received, chunks, None))
+        except Exception as e:
+            results.put((index, contender_model, None, None, e))
+    threading.Thread(target=contender, args=(0, model), daemon=True).start()
+    hedged = False
+    try:
+        result = results.get(timeout=delay)
+    except queue.Empty:
+        if rate_limiter.has_limit(hedge_model):
+            rate_limiter.acquire(hedge_model, tokens)
+        threading.Thread(target=contender, args=(1, hedge_model), daemon=True).start()
+        hedged = True
+        result = results.get()
+    pending = 1 + hedged
+    while result[4] is not None:
+        pending -= 1
+        if not pending:
+            raise result[4]
+        result = results.get()
+    index, winner_model, received, chunks, _ = result
+    with lock:
+        winner.append(index)
+        for other, stream in streams.items():
+            if other != index:
+                close(stream)
+    return winner_model, itertools.chain(received, chunks), hedged
+
+def pack_embedding_batches(indexes: list[int], tokens: list[int], batch_size: int = MAX_EMBEDDING_BATCH) -> list[list[int]]:
+    """
+    Groups the indexes of the texts to embed in batches of at most batch_size texts and MAX_TOKEN_EMBEDDING_BATCH tokens.
+    Texts above MAX_TOKEN_EMBEDDING_INPUT tokens are left out as the endpoint would reject them.
+    """
+    batches = []
+    current_batch, current_tokens = [], 0
+    for index, tok in zip(indexes, tokens):
+        if tok > MAX_TOKEN_EMBEDDING_INPUT:
+            log_warning(f"Text #{index} has {tok} tokens - above the {MAX_TOKEN_EMBEDDING_INPUT} limit of the embedding endpoint", pack_embedding_batches)
+            continue
+        if current_batch and (len(current_batch) >= batch_size or current_tokens + tok > MAX_TOKEN_EMBEDDING_BATCH):
+            batches.append(current_batch)
+            current_batch, current_tokens = [], 0
+        current_batch.append(index)
+        current_tokens += tok
+    if current_batch:
+        batches.append(current_batch)
+    return batches
+
+def pack_reduce_groups(tokens: list[int], budget: int) -> list[list[int]]:
+    """
+    Groups the indexes of consecutive answers so the tokens of each group fit the budget of a reduce request.
+    An answer larger than the budget is alone in its group.
+    """
+    groups = []
+    current_group, current_tokens = [], 0
+    for index, tok in enumerate(tokens):
+        if current_group and current_tokens + tok > budget:
+            groups.append(current_group)
+            current_group, current_tokens = [], 0
+        current_group.append(index)
+        current_tokens += tok
+    if current_group:
+        groups.append(current_group)
+    return groups
+
+def request_chatgpt(current_chat: Union[list, Conversation], max_tokens: int, stop_list=False, max_attempts=3, model=MODEL_CHAT, temperature=0, top_p=1, json_on=False, hedge: bool = False, hedge_model: Optional[str] = None) -> str:
     """
     Calls the ChatGPT OpenAI completion endpoint with specified parameters.
 
     Args:
-        current_chat (list): The prompt used for the request.
+        current_chat (list or Conversation): The prompt used for the request. A Conversation is trimmed to fit the window of the model.
         max_tokens (int, optional): Maximum number of tokens for the answer.
         stop_list (bool, optional): Whether to use specific stop tokens. Defaults to False.
         max_attempts (int, optional): Maximum number of retries. Defaults to 3.
@@ -582,24 +1384,51 @@ def request_chatgpt(current_chat: list, max_tokens: int, stop_list=False, max_at
         temperature (float, optional): Sampling temperature for the response. A value of 0 means deterministic output. Defaults to 0.
         top_p (float, optional): Nucleus sampling parameter, with 1 being 'take the best'. Defaults to 1.
         json (bool, optional): Whether we want to force the output in JSON or not.
+        hedge (bool, optional): If the first token doesn't arrive within the usual latency (see get_hedge_delay), sends a second
+            request and keeps whichever answers first - the other one is cancelled. Defaults to False.
+        hedge_model (str, optional): Model of the second request, e.g. MODEL_CHAT_BACKUP. Defaults to the same model.
 
     Returns:
         str: The response text or 'OPEN_AI_ISSUE' if an error occurs (e.g., if OpenAI service is down).
+
+    Note:
+        A hedged request is streamed (see request_chatgpt_stream) - it is the only way to know it started answering and to stop the loser.
     """
+    if hedge:
+        stats = {}
+        parts = list(request_chatgpt_stream(current_chat, max_tokens, stop_list, max_attempts, model, temperature, top_p, json_on, stats, hedge, hedge_model, function="request_chatgpt"))
+        if "error" in stats: return OPEN_AI_ISSUE
+        return "".join(parts).rstrip()
     #if model in [MODEL_CHAT, MODEL_GPT4_TURBO]:
     #    response_format = "json_object" if json_on else "text"
     #else:
     #    log_issue("You are using a model which doesn't support JSON object - we depreciated the old models", request_chatgpt)
     #    return ""
     stop = stop_list if (stop_list and len(stop_list) < 4) else ""
+    start = time.perf_counter()
+    requested_model = model
+    messages, prompt_tokens = get_chat_messages(current_chat, max_tokens, model)
+    if messages is None:
+        record_call("request_chatgpt", model, model, start, 0, error=True)
+        return OPEN_AI_ISSUE
+    cache_key, cached = lookup_completion_cache(messages, max_tokens, model, temperature, top_p, stop)
+    if cached is not None:
+        record_call("request_chatgpt", model, model, start, 0, cache_hits=1)
+        return cached
     attempts = 0
     valid = False
     rep = OPEN_AI_ISSUE
+    usage = None
     #print("Writing the reply for ", current_chat) # Remove in production - to see what is actually fed as a prompt
     while attempts < max_attempts and not valid:
         try:
-            response = client.chat.completions.create(
-                messages= current_chat,
+            messages, prompt_tokens = get_chat_messages(current_chat, max_tokens, model) # The backup model may have a smaller window
+            if messages is None:
+                raise ValueError(f"The conversation doesn't fit the window of {model}")
+            if rate_limiter.has_limit(model):
+                rate_limiter.acquire(model, estimate_chat_tokens(messages, max_tokens, model, prompt_tokens))
+            response = get_client().chat.completions.create(
+                messages= messages,
                 temperature=temperature,
                 max_tokens= int(max_tokens),
                 top_p=top_p,
@@ -610,23 +1439,295 @@ def request_chatgpt(current_chat: list, max_tokens: int, stop_list=False, max_at
             )
             rep = response.choices[0].message.content
             rep = rep.strip()
+            usage = getattr(response, "usage", None)
             valid = True
+            store_completion_cache(cache_key, rep)
         except Exception as e:
             attempts += 1
-            error_message = str(e)
-            if 'Rate limit reached' in error_message:
-                print(f"Rate limit reached. We will slow down and sleep for 300ms. This was attempt number {attempts}/{max_attempts}")
-                time.sleep(0.3)
-            else:
-                print(f"Error. This is attempt number {attempts}/{max_attempts}. The exception is {e}. Trying again")
-            if {attempts} == 2:
-                print(f"Trying with the previous model: {MODEL_CHAT_BACKUP}")
-                model = MODEL_CHAT_BACKUP
+            model = handle_failed_chat_attempt(e, attempts, max_attempts, model)
     if rep == OPEN_AI_ISSUE and check_co():
         print(f" ** We have an issue with Open AI using the model {model}")
         log_issue(f"No answer despite {max_attempts} attempts", request_chatgpt, "Open AI is down")
+    record_call("request_chatgpt", requested_model, model, start, attempts + valid, usage, error=not valid)
     return rep
     
+def request_chatgpt_stream(current_chat: Union[list, Conversation], max_tokens: int, stop_list=False, max_attempts=3, model=MODEL_CHAT, temperature=0, top_p=1, json_on=False, stats: Optional[dict] = None, hedge: bool = False, hedge_model: Optional[str] = None, function: str = "request_chatgpt_stream") -> Iterator[str]:
+    """
+    Streaming version of request_chatgpt. Yields the text deltas of the answer as soon as OpenAI sends them.
+    Same parameters, retries and backup model as request_chatgpt - as long as the first token didn't arrive.
+
+    Args:
+        stats (dict, optional): Filled when the stream is over with: model, attempts, ttft (seconds to the first token),
+        latency (seconds), completion_tokens and tokens_per_sec. Also 'error' if the stream broke after the first token
+        and 'hedged' if a second request was sent.
+        hedge (bool, optional): If the first token doesn't arrive within the HEDGE_PERCENTILE of the recent times to first token,
+            sends a second request and streams whichever starts first - the other stream is closed. Defaults to False.
+        hedge_model (str, optional): Model of the second request, e.g. MODEL_CHAT_BACKUP. Defaults to the same model.
+        function (str, optional): Name of the call in the metrics (and for the hedge delay) - request_chatgpt passes its own for its hedged requests.
+
+    Yields:
+        str: The text deltas. A single OPEN_AI_ISSUE if no answer despite max_attempts.
+
+    Note:
+        The request is only sent when the iteration starts. Once a token was yielded, a failure ends the stream (logged) as we can't take back what the caller already received.
+    """
+    stop = stop_list if (stop_list and len(stop_list) < 4) else ""
+    stats = stats if stats is not None else {}
+    start = time.perf_counter()
+    requested_model = model
+    messages, prompt_tokens = get_chat_messages(current_chat, max_tokens, model)
+    if messages is None:
+        stats.update({"model": model, "attempts": 0, "ttft": None, "latency": round(time.perf_counter() - start, 4), "error": OPEN_AI_ISSUE})
+        record_call(function, model, model, start, 0, error=True)
+        yield OPEN_AI_ISSUE
+        return
+    cache_key, cached = lookup_completion_cache(messages, max_tokens, model, temperature, top_p, stop)
+    if cached is not None:
+        latency = round(time.perf_counter() - start, 4)
+        stats.update({"model": model, "attempts": 0, "ttft": latency, "latency": latency, "completion_tokens": None, "tokens_per_sec": None, "cache_hit": True})
+        record_call(function, model, model, start, 0, cache_hits=1, ttft=latency)
+        yield cached
+        return
+    attempts = 0
+    hedged = False
+    while attempts < max_attempts:
+        first_token_at = None
+        try:
+            messages, prompt_tokens = get_chat_messages(current_chat, max_tokens, model) # The backup model may have a smaller window
+            if messages is None:
+                raise ValueError(f"The conversation doesn't fit the window of {model}")
+            metered = rate_limiter.has_limit(model) or (hedge and rate_limiter.has_limit(hedge_model or model))
+            tokens = estimate_chat_tokens(messages, max_tokens, model, prompt_tokens) if metered else 0
+            if rate_limiter.has_limit(model):
+                rate_limiter.acquire(model, tokens)
+            request = {
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": int(max_tokens),
+                "top_p": top_p,
+                "frequency_penalty": 0,
+                "presence_penalty": 0,
+                "stop": stop,
+                "stream": True,
+                "stream_options": {"include_usage": True},
+            }
+            if hedge:
+                model, response, hedged_attempt = open_hedged_stream(request, model, hedge_model or model, get_hedge_delay(function, requested_model, ttft=True), tokens)
+                hedged = hedged or hedged_attempt
+            else:
+                response = get_client().chat.completions.create(model=model, **request)
+            parts = []
+            usage = None
+            for chunk in response:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if first_token_at is None:
+                    delta = (delta or "").lstrip()  # Same as the strip() of request_chatgpt
+                    if not delta:
+                        continue
+                    first_token_at = time.perf_counter()
+                elif not delta:
+                    continue
+                parts.append(delta)
+                yield delta
+            end = time.perf_counter()
+            store_completion_cache(cache_key, "".join(parts).rstrip())
+            completion_tokens = usage.completion_tokens if usage is not None else calculate_token("".join(parts), model)
+            generation_time = end - first_token_at if first_token_at is not None else 0
+            stats.update({
+                "model": model,
+                "attempts": attempts + 1,
+                "ttft": round(first_token_at - start, 4) if first_token_at is not None else None,
+                "latency": round(end - start, 4),
+                "completion_tokens": completion_tokens,
+                "tokens_per_sec": round(completion_tokens / generation_time, 2) if generation_time > 0 else None,
+            })
+            if hedged:
+                stats["hedged"] = True
+            record_call(function, requested_model, model, start, attempts + 1, usage, ttft=stats["ttft"], hedged=hedged)
+            return
+        except Exception as e:
+            if first_token_at is not None:
+                log_issue(e, request_chatgpt_stream, f"The stream broke after the first token with the model {model}")
+                stats.update({"model": model, "attempts": attempts + 1, "ttft": round(first_token_at - start, 4), "latency": round(time.perf_counter() - start, 4), "error": str(e)})
+                record_call(function, requested_model, model, start, attempts + 1, usage, error=True, ttft=stats["ttft"], hedged=hedged)
+                return
+            attempts += 1
+            model = handle_failed_chat_attempt(e, attempts, max_attempts, model)
+    if check_co():
+        print(f" ** We have an issue with Open AI using the model {model}")
+        log_issue(f"No answer despite {max_attempts} attempts", request_chatgpt_stream, "Open AI is down")
+    stats.update({"model": model, "attempts": attempts, "ttft": None, "latency": round(time.perf_counter() - start, 4), "error": OPEN_AI_ISSUE})
+    record_call(function, requested_model, model, start, attempts, error=True, hedged=hedged)
+    yield OPEN_AI_ISSUE
+
+# *************************************************************************************************
+# ****************************************** ASYNC API CALLS **************************************
+# *************************************************************************************************
+
+# Same behaviour and return conventions as the regular API calls, built on the AsyncOpenAI client
+# so one event loop can drive many requests at once.
+
+async def aask_question_gpt(question:str, role:str = "", model:str = MODEL_CHAT, max_tokens:int = MAX_TOKEN_OUTPUT_DEFAULT, verbose:bool = True, temperature=0, top_p=1, json_on: bool = False) -> str:
+    """
+    Async version of ask_question_gpt. Queries an OpenAI GPT model with a specific question.
+
+    Returns:
+        str: The model's reply to the question, "" if the input doesn't fit the window or OPEN_AI_ISSUE.
+    """
+    conversation = Conversation(role, model)
+    conversation.add(question, "user")
+    if not fits_token_window(conversation.total_tokens, model, max_tokens):
+        return ""
+    if verbose:
+        print(f"Completion ~ {max_tokens} tokens. Request ~ {conversation.total_tokens} tokens.\nContext provided to GPT is:\n{conversation.messages}")
+    return await arequest_chatgpt(conversation, max_tokens=max_tokens, model=model, temperature=temperature, top_p=top_p, json_on=json_on)
+
+async def aembed_text(text:str, max_attempts:int=3, model=MODEL_EMB_LARGE, dimensions: Optional[int] = None) -> Optional[list[float]]:
+    """
+    Async version of embed_text. Returns the embedding of one chunk of text or None if issue.
+    """
+    try:
+        if text == "": return
+        if not isinstance(text, str):
+            log_warning("You need to input a string", aembed_text, f"You inputed {type(text)}")
+            return
+        start = time.perf_counter()
+        cache = _embedding_cache
+        if cache is not None:
+            cached = cache.get(text, model, dimensions)
+            if cached is not None:
+                record_call("aembed_text", model, model, start, 0, cache_hits=1)
+                return cached
+        attempts = 0
+        while attempts < max_attempts:
+            try:
+                if rate_limiter.has_limit(model):
+                    await rate_limiter.aacquire(model, calculate_token(text, model))
+                response = await get_aclient().embeddings.create(
+                    model=model,
+                    input=text,
+                    encoding_format="float",
+                    dimensions=dimensions or openai.NOT_GIVEN,
+                    )
+                res = response.data[0].embedding
+                record_call("aembed_text", model, model, start, attempts + 1, getattr(response, "usage", None))
+                if cache is not None:
+                    cache.put(text, res, model, dimensions)
+                return res
+            except Exception as e:
+                if is_rate_limit_error(e):
+                    rate_limiter.penalize(model, get_rate_limit_delay(e, attempts + 1))
+                elif not await asyncio.to_thread(check_co):
+                    log_warning("Warning: You don't have internet. Embedding will not work", aembed_text)
+                    record_call("aembed_text", model, model, start, attempts + 1, error=True)
+                    return
+                attempts += 1
+                log_warning(f"We faced {e} * Attempt: #{attempts}/ {max_attempts}", aembed_text)
+        log_issue(f"No answer despite {max_attempts} attempts", aembed_text, f"This was the text: {text[:100]}")
+        record_call("aembed_text", model, model, start, attempts, error=True)
+    except Exception as e:
+        log_issue(e, aembed_text, f"""For text {text[:300] + ('...' if len(text)> 300 else '')}""")
+
+async def ahedged_chat_completion(request: dict, model: str, hedge_model: str, delay: float, tokens: int = 0) -> tuple:
+    """
+    Sends a chat request to model and, if it didn't answer after delay seconds, the same request to hedge_model.
+    The first answer wins and the other request is cancelled (its task, so its HTTP request is closed).
+
+    Args:
+        request (dict): The arguments of get_aclient().chat.completions.create except the model.
+        tokens (int, optional): Size of the request for the rate limiter of hedge_model.
+
+    Returns:
+        tuple: (response, model of the winner, True if the second request was sent). Raises the error of the last request if both failed.
+    """
+    primary = asyncio.ensure_future(get_aclient().chat.completions.create(model=model, **request))
+    tasks = {primary: model}
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if not done:
+            if rate_limiter.has_limit(hedge_model):
+                await rate_limiter.aacquire(hedge_model, tokens)
+            tasks[asyncio.ensure_future(get_aclient().chat.completions.create(model=hedge_model, **request))] = hedge_model
+        pending = set(tasks)
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), tasks[task], len(tasks) > 1
+            if not pending:
+                raise next(iter(done)).exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def arequest_chatgpt(current_chat: Union[list, Conversation], max_tokens: int, stop_list=False, max_attempts=3, model=MODEL_CHAT, temperature=0, top_p=1, json_on=False, hedge: bool = False, hedge_model: Optional[str] = None) -> str:
+    """
+    Async version of request_chatgpt. Calls the ChatGPT OpenAI completion endpoint with specified parameters.
+    Falls back to MODEL_CHAT_BACKUP after the second failed attempt.
+    With hedge, a second request (to hedge_model if given) is sent if the answer takes longer than the usual latency
+    (see get_hedge_delay) and the slower of the two is cancelled.
+
+    Returns:
+        str: The response text or 'OPEN_AI_ISSUE' if an error occurs (e.g., if OpenAI service is down).
+    """
+    stop = stop_list if (stop_list and len(stop_list) < 4) else ""
+    start = time.perf_counter()
+    requested_model = model
+    messages, prompt_tokens = get_chat_messages(current_chat, max_tokens, model)
+    if messages is None:
+        record_call("arequest_chatgpt", model, model, start, 0, error=True)
+        return OPEN_AI_ISSUE
+    cache_key, cached = lookup_completion_cache(messages, max_tokens, model, temperature, top_p, stop)
+    if cached is not None:
+        record_call("arequest_chatgpt", model, model, start, 0, cache_hits=1)
+        return cached
+    attempts = 0
+    valid = False
+    rep = OPEN_AI_ISSUE
+    usage = None
+    hedged = False
+    while attempts < max_attempts and not valid:
+        try:
+            messages, prompt_tokens = get_chat_messages(current_chat, max_tokens, model) # The backup model may have a smaller window
+            if messages is None:
+                raise ValueError(f"The conversation doesn't fit the window of {model}")
+            metered = rate_limiter.has_limit(model) or (hedge and rate_limiter.has_limit(hedge_model or model))
+            tokens = estimate_chat_tokens(messages, max_tokens, model, prompt_tokens) if metered else 0
+            if rate_limiter.has_limit(model):
+                await rate_limiter.aacquire(model, tokens)
+            request = {
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": int(max_tokens),
+                "top_p": top_p,
+                "frequency_penalty": 0,
+                "presence_penalty": 0,
+                "stop": stop,
+            }
+            if hedge:
+                response, model, hedged_attempt = await ahedged_chat_completion(request, model, hedge_model or model, get_hedge_delay("arequest_chatgpt", requested_model), tokens)
+                hedged = hedged or hedged_attempt
+            else:
+                response = await get_aclient().chat.completions.create(model=model, **request)
+            rep = response.choices[0].message.content
+            rep = rep.strip()
+            usage = getattr(response, "usage", None)
+            valid = True
+            store_completion_cache(cache_key, rep)
+        except Exception as e:
+            attempts += 1
+            model = handle_failed_chat_attempt(e, attempts, max_attempts, model)
+    if rep == OPEN_AI_ISSUE and await asyncio.to_thread(check_co):
+        print(f" ** We have an issue with Open AI using the model {model}")
+        log_issue(f"No answer despite {max_attempts} attempts", arequest_chatgpt, "Open AI is down")
+    record_call("arequest_chatgpt", requested_model, model, start, attempts + valid, usage, error=not valid, hedged=hedged)
+    return rep
+
 # *************************************************************************************************
 # *************************************************************************************************
 
@@ -0,0 +1,125 @@
+# Client-side rate limiting - to run at the provider quota instead of bouncing off it.
+
+
+from typing import Optional
+
+import threading
+import asyncio
+import time
+import re
+
+
+# ****************************************** TOKEN BUCKETS ****************************************
+
+class TokenBucket:
+    """
+    Bucket refilled continuously with per_minute units per minute, holding at most per_minute units.
+    Callers reserve units and get back how long they must wait before using them, so concurrent callers queue fairly.
+    """
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60  # units per second
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        """
+        Takes amount units from the bucket (the level can go negative) and returns the seconds to wait before using them.
+        Must be called under the lock of the RateLimiter.
+        """
+        self.level = min(self.per_minute, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= min(amount, self.per_minute)  # A request larger than the bucket would otherwise wait forever
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+class RateLimiter:
+    """
+    Meters requests per minute and tokens per minute for each model. Shared by all the threads (and event loops) of the process.
+    Models without a limit are never delayed.
+
+    Args:
+        limits (dict, optional): {model: (requests_per_minute, tokens_per_minute)}. Use None for a limit you don't want to meter.
+    """
+    def __init__(self, limits: Optional[dict[str, tuple[Optional[int], Optional[int]]]] = None):
+        self._lock = threading.Lock()
+        self._buckets: dict[str, tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {}
+        self._blocked_until: dict[str, float] = {}
+        for model, (rpm, tpm) in (limits or {}).items():
+            self.set_limit(model, rpm, tpm)
+
+    def set_limit(self, model: str, rpm: Optional[int] = None, tpm: Optional[int] = None) -> None:
+        """
+        Sets (or replaces) the requests per minute and tokens per minute of a model. Both None removes the limit.
+        """
+        with self._lock:
+            if rpm is None and tpm is None:
+                self._buckets.pop(model, None)
+                return
+            self._buckets[model] = (TokenBucket(rpm) if rpm else None, TokenBucket(tpm) if tpm else None)
+
+    def has_limit(self, model: str) -> bool:
+        """
+        Returns True if the calls to this model are metered. Lets callers skip the token estimation otherwise.
+        """
+        return model in self._buckets or self._blocked_until.get(model, 0.0) > time.monotonic()
+
+    def reserve(self, model: str, tokens: int = 0) -> float:
+        """
+        Reserves one request and tokens for the model. Returns the seconds to wait before sending it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._blocked_until.get(model, 0.0) - now)
+            rpm_bucket, tpm_bucket = self._buckets.get(model, (None, None))
+            if rpm_bucket is not None:
+                wait = max(wait, rpm_bucket.reserve(1, now))
+            if tpm_bucket is not None:
+                wait = max(wait, tpm_bucket.reserve(tokens, now))
+            return wait
+
+    def acquire(self, model: str, tokens: int = 0) -> float:
+        """
+        Blocks until the request can be sent. Returns the time waited in seconds.
+        """
+        wait = self.reserve(model, tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def aacquire(self, model: str, tokens: int = 0) -> float:
+        """
+        Async version of acquire - waits without blocking the event loop.
+        """
+        wait = self.reserve(model, tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def penalize(self, model: str, seconds: float) -> None:
+        """
+        Holds every request to the model for the given seconds. To call when the provider answers with a rate limit error,
+        so all the threads back off together instead of retrying one by one.
+        """
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self._blocked_until.get(model, 0.0):
+                self._blocked_until[model] = until
+
+# ****************************************** HELPERS **********************************************
+
+def get_retry_after(error_message: str, default: float) -> float:
+    """
+    Extracts the delay suggested by OpenAI in a rate limit error ("Please try again in 1.2s" / "in 350ms").
+    Returns default if there is none.
+    """
+    match = re.search(r"try again in (\d+(?:\.\d+)?)(ms|s)", error_message)
+    if not match:
+        return default
+    value = float(match.group(1))
+    return value / 1000 if match.group(2) == "ms" else value
+
+# *************************************************************************************************
+# *************************************************************************************************
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,523 @@
+# Storage and search of embeddings - float32 (or quantized) matrices on disk instead of millions of Python lists in RAM.
+
+
+from .config import VECTOR_SEARCH_BLOCK_ROWS, VECTOR_SEARCH_BLOCK_ROWS_QUANTIZED, IVF_NPROBE, IVF_TRAIN_ITERATIONS, IVF_TRAIN_SAMPLE
+from .base import log_issue, log_warning
+
+
+from typing import Optional, Any, Callable
+
+import numpy as np
+import threading
+import json
+import math
+import os
+
+
+NO_RESULTS = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+STORE_DTYPES = ("float32", "float16", "int8")
+
+
+# ****************************************** STORE ************************************************
+
+class EmbeddingStore:
+    """
+    Append-only store of embeddings in a folder. The vectors are rows of a memory-mapped file, so opening
+    a store of millions of vectors is instant and a search only pages in the block it is scoring.
+
+    Each row has an id and optional JSON metadata, kept in a parallel records file. The ids are not required to be unique -
+    get() returns the last row added with an id.
+
+    Files of the folder:
+        - store.json: the dimensions and dtype of the vectors.
+        - vectors.bin: the vectors, one row after the other. They are normalized so the dot product is the cosine similarity.
+        - scales.bin: float32 scale of each row - int8 stores only.
+        - records.jsonl: {"id", "metadata"} of each row, one JSON per line.
+        - offsets.bin: uint64 end offset of each line of records.jsonl - gives the number of rows and a direct access to any record.
+
+    Args:
+        path (str): The folder of the store. Created if it doesn't exist.
+        dimensions (int, optional): Size of the vectors. Read from the store if it exists, otherwise taken from the first add().
+        dtype (str, optional): How the vectors are stored - "float32", "float16" (half the size) or "int8" (a quarter of the size,
+            each vector is scaled to [-127, 127] and keeps its scale). Read from the store if it exists. Defaults to "float32".
+
+    Note:
+        The scores of a quantized store are computed on the quantized vectors - the error on a score is ~1e-5 in float16 and ~1e-3 in int8.
+        int8 searches about as fast as float32, float16 is several times slower (NumPy converts float16 in software).
+        Combined with the dimensions of embed_text, the size per vector goes from 12KB (3072 x float32) down to 260 bytes (256 x int8).
+    """
+    def __init__(self, path: str, dimensions: Optional[int] = None, dtype: Optional[str] = None):
+        self.path = os.path.expanduser(path)
+        os.makedirs(self.path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._id_rows: Optional[dict[str, int]] = None
+        self.dimensions = dimensions
+        settings_path = os.path.join(self.path, "store.json")
+        settings = {"dimensions": dimensions, "dtype": dtype or "float32"}
+        if os.path.exists(settings_path):
+            with open(settings_path, "r") as f:
+                settings = json.load(f)
+            for name, asked in (("dimensions", dimensions), ("dtype", dtype)):
+                if asked is not None and asked != settings[name]:
+                    raise ValueError(f"The store at {self.path} holds vectors with {name} {settings[name]}, not {asked}")
+        if settings["dtype"] not in STORE_DTYPES:
+            raise ValueError(f"dtype must be one of {STORE_DTYPES}, not {settings['dtype']}")
+        self.dimensions = settings["dimensions"]
+        self.dtype = np.dtype(settings["dtype"])
+        self._ends = self._read_offsets()
+        self._truncate_partial_writes()
+
+    # Internal helpers - all called under the lock (or from __init__)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _read_offsets(self) -> np.ndarray:
+        path = self._file("offsets.bin")
+        if not os.path.exists(path) or os.path.getsize(path) < 8:
+            return np.zeros(0, dtype=np.uint64)
+        return np.fromfile(path, dtype=np.uint64, count=os.path.getsize(path) // 8)
+
+    def _truncate_partial_writes(self) -> None:
+        # offsets.bin is written last by add(): a crash in the middle of an add leaves extra bytes in the other files.
+        count = len(self._ends)
+        expected = {
+            "offsets.bin": count * 8,
+            "records.jsonl": int(self._ends[-1]) if count else 0,
+            "vectors.bin": count * self.dimensions * self.dtype.itemsize if self.dimensions else 0,
+            "scales.bin": count * 4,
+        }
+        for name, size in expected.items():
+            path = self._file(name)
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                log_warning(f"Dropping the partial write at the end of {path}", EmbeddingStore)
+                os.truncate(path, size)
+
+    def _save_settings(self) -> None:
+        with open(self._file("store.json"), "w") as f:
+            json.dump({"dimensions": self.dimensions, "dtype": self.dtype.name}, f)
+
+    def _quantize(self, matrix: np.ndarray) -> tuple[np.ndarray, Optional[np.ndarray]]:
+        # Returns the rows in the dtype of the store and their scales (int8 only)
+        if self.dtype != np.int8:
+            return matrix.astype(self.dtype), None
+        scales = np.abs(matrix).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        return np.rint(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    # Public API
+
+    def __len__(self) -> int:
+        return len(self._ends)
+
+    def add(self, ids: list[str], vectors: list[Optional[list[float]]], metadatas: Optional[list[Optional[dict]]] = None) -> Optional[list[int]]:
+        """
+        Appends vectors (e.g. the output of embed_texts) with their ids and metadata. Returns the row of each added vector.
+        None vectors (failed embeddings) are skipped and get None as row. Returns None if the vectors can't be added.
+        """
+        if metadatas is None:
+            metadatas = [None] * len(ids)
+        if not len(ids) == len(vectors) == len(metadatas):
+            log_issue(ValueError("ids, vectors and metadatas must have the same length"), self.add, f"{len(ids)} ids, {len(vectors)} vectors, {len(metadatas)} metadatas")
+            return
+        kept = [i for i, vector in enumerate(vectors) if vector is not None]
+        if len(kept) < len(vectors):
+            log_warning(f"Skipping {len(vectors) - len(kept)} None vectors", self.add)
+        rows: list[Optional[int]] = [None] * len(ids)
+        if not kept: return rows
+        try:
+            matrix = normalize_rows(np.asarray([vectors[i] for i in kept], dtype=np.float64))
+        except Exception as e:
+            log_issue(e, self.add, "The vectors must be lists of floats of the same size")
+            return
+        with self._lock:
+            if self.dimensions is None:
+                self.dimensions = matrix.shape[1]
+                self._save_settings()
+            elif not os.path.exists(self._file("store.json")):
+                self._save_settings()
+            if matrix.shape[1] != self.dimensions:
+                log_issue(ValueError(f"Vectors of {matrix.shape[1]} dimensions in a store of {self.dimensions}"), self.add, f"Store at {self.path}")
+                return
+            lines = [(json.dumps({"id": ids[i], "metadata": metadatas[i]}, ensure_ascii=False) + "\n").encode("utf-8") for i in kept]
+            start = int(self._ends[-1]) if len(self._ends) else 0
+            ends = start + np.cumsum([len(line) for line in lines], dtype=np.uint64)
+            first_row = len(self._ends)
+            quantized, scales = self._quantize(matrix)
+            with open(self._file("vectors.bin"), "ab") as f:
+                f.write(quantized.tobytes())
+            if scales is not None:
+                with open(self._file("scales.bin"), "ab") as f:
+                    f.write(scales.tobytes())
+            with open(self._file("records.jsonl"), "ab") as f:
+                f.write(b"".join(lines))
+            with open(self._file("offsets.bin"), "ab") as f:
+                f.write(ends.tobytes())
+            self._ends = np.concatenate([self._ends, ends])
+            self._matrix = self._scales = None
+            for offset, i in enumerate(kept):
+                rows[i] = first_row + offset
+                if self._id_rows is not None:
+                    self._id_rows[ids[i]] = first_row + offset
+        return rows
+
+    def vectors(self) -> np.ndarray:
+        """
+        Returns the read-only (rows, dimensions) matrix of the normalized vectors, in the dtype of the store (use get_vectors for float32).
+        Memory-mapped - nothing is read until used.
+        """
+        with self._lock:
+            if self._matrix is None or len(self._matrix) != len(self._ends):
+                if len(self._ends) == 0:
+                    self._matrix = np.zeros((0, self.dimensions or 0), dtype=self.dtype)
+                else:
+                    self._matrix = np.memmap(self._file("vectors.bin"), dtype=self.dtype, mode="r", shape=(len(self._ends), self.dimensions))
+            return self._matrix
+
+    def scales(self) -> Optional[np.ndarray]:
+        """
+        Returns the memory-mapped scale of each row of an int8 store - the vector is vectors()[row] * scales()[row]. None for the float stores.
+        """
+        if self.dtype != np.int8: return
+        with self._lock:
+            if self._scales is None or len(self._scales) != len(self._ends):
+                if len(self._ends) == 0:
+                    self._scales = np.zeros(0, dtype=np.float32)
+                else:
+                    self._scales = np.memmap(self._file("scales.bin"), dtype=np.float32, mode="r", shape=(len(self._ends),))
+            return self._scales
+
+    def get_vectors(self, rows) -> np.ndarray:
+        """
+        Returns the float32 vectors of some rows (a slice or an array of rows) - dequantized if the store is quantized.
+        """
+        vectors = np.asarray(self.vectors()[rows], dtype=np.float32)
+        scales = self.scales()
+        if scales is not None:
+            vectors *= np.asarray(scales[rows])[..., None]
+        return vectors
+
+    def score_rows(self, rows, query: np.ndarray) -> np.ndarray:
+        """
+        Returns the cosine similarity between a prepared query and some rows (a slice or an array of rows).
+        Computed on the stored vectors: the int8 rows are multiplied by the query first and by their scale after.
+        """
+        scores = np.asarray(self.vectors()[rows]).astype(np.float32, copy=False) @ query
+        scales = self.scales()
+        if scales is not None:
+            scores *= np.asarray(scales[rows])
+        return scores
+
+    def get_record(self, row: int) -> dict[str, Any]:
+        """
+        Returns {"id", "metadata"} of a row. Reads only that line of records.jsonl.
+        """
+        start = int(self._ends[row - 1]) if row > 0 else 0
+        end = int(self._ends[row])
+        with open(self._file("records.jsonl"), "rb") as f:
+            f.seek(start)
+            return json.loads(f.read(end - start))
+
+    def get_row(self, id: str) -> Optional[int]:
+        """
+        Returns the row of an id or None if it is not in the store.
+        The first call reads all the records to build the id index - the other methods never need it.
+        """
+        with self._lock:
+            if self._id_rows is None:
+                self._id_rows = {}
+                if len(self._ends):
+                    with open(self._file("records.jsonl"), "rb") as f:
+                        for row, line in enumerate(f):
+                            if row >= len(self._ends): break
+                            self._id_rows[json.loads(line)["id"]] = row
+            return self._id_rows.get(id)
+
+    def get(self, id: str) -> Optional[dict[str, Any]]:
+        """
+        Returns {"id", "row", "vector", "metadata"} of an id or None if it is not in the store. The vector is the normalized one.
+        """
+        row = self.get_row(id)
+        if row is None: return
+        record = self.get_record(row)
+        return {"id": record["id"], "row": row, "vector": self.get_vectors(row), "metadata": record["metadata"]}
+
+    def search(self, query: list[float], k: int = 10, block_rows: int = VECTOR_SEARCH_BLOCK_ROWS) -> list[dict[str, Any]]:
+        """
+        Exact top-k cosine similarity search. Scores block_rows rows at a time so the memory used doesn't grow with the store.
+
+        Args:
+            query (list[float]): The query embedding, e.g. from embed_text. It doesn't need to be normalized.
+            k (int, optional): Number of results.
+            block_rows (int, optional): Rows scored at once.
+
+        Returns:
+            list[dict]: {"id", "row", "score", "metadata"} of the k most similar vectors, best first.
+        """
+        rows, scores = self.search_rows(query, k, block_rows)
+        return self.get_results(rows, scores)
+
+    def get_results(self, rows: np.ndarray, scores: np.ndarray) -> list[dict[str, Any]]:
+        """
+        Turns the (rows, scores) of a search into the list of {"id", "row", "score", "metadata"}.
+        """
+        results = []
+        for row, score in zip(rows.tolist(), scores.tolist()):
+            record = self.get_record(row)
+            results.append({"id": record["id"], "row": row, "score": score, "metadata": record["metadata"]})
+        return results
+
+    def search_rows(self, query: list[float], k: int = 10, block_rows: int = VECTOR_SEARCH_BLOCK_ROWS) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Same as search() but returns (rows, scores) as arrays without reading the records. Empty arrays if the query is invalid.
+        """
+        q = self.prepare_query(query)
+        if q is None or len(self) == 0 or k <= 0:
+            return NO_RESULTS
+        if self.dtype != np.float32:
+            block_rows = min(block_rows, VECTOR_SEARCH_BLOCK_ROWS_QUANTIZED)
+        return top_k_blocks(lambda start, end: self.score_rows(slice(start, end), q), len(self), k, block_rows)
+
+    def prepare_query(self, query: list[float]) -> Optional[np.ndarray]:
+        """
+        Returns the normalized float32 query, or None (and logs why) if it doesn't fit the store.
+        """
+        q = normalize_rows(np.asarray(query, dtype=np.float64).reshape(1, -1))[0]
+        if self.dimensions is not None and q.shape[0] != self.dimensions:
+            log_issue(ValueError(f"Query of {q.shape[0]} dimensions in a store of {self.dimensions}"), self.prepare_query, f"Store at {self.path}")
+            return
+        return q
+
+# ****************************************** ANN INDEX ********************************************
+
+class IVFIndex:
+    """
+    Approximate nearest neighbour index over an EmbeddingStore (inverted file): a k-means groups the vectors in nlist clusters
+    and a search only scores the vectors of the nprobe clusters closest to the query.
+    nprobe is the recall / latency knob - nprobe = nlist is an exact search, nprobe = 1 is the fastest.
+
+    The index only holds the centroids and the rows of each cluster, the vectors stay in the store.
+    Rows added to the store after train() are assigned to their cluster without retraining - by update(), called by the searches.
+    Saved next to the store with save() and reopened with IVFIndex.load(store).
+
+    Args:
+        store (EmbeddingStore): The store to index.
+        nlist (int, optional): Number of clusters. Defaults to 4 * sqrt(rows of the store) when trained.
+        nprobe (int, optional): Default number of clusters scanned by a search.
+    """
+    FILE_NAME = "ivf.npz"
+
+    def __init__(self, store: EmbeddingStore, nlist: Optional[int] = None, nprobe: int = IVF_NPROBE):
+        self.store = store
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids: Optional[np.ndarray] = None
+        self.indexed_rows = 0
+        self._lists: list[np.ndarray] = []
+        self._lock = threading.Lock()
+
+    def is_trained(self) -> bool:
+        """
+        Returns True once train() (or load()) gave the index its centroids.
+        """
+        return self.centroids is not None
+
+    def train(self, sample_size: int = IVF_TRAIN_SAMPLE, iterations: int = IVF_TRAIN_ITERATIONS, seed: int = 0) -> "IVFIndex":
+        """
+        Learns the centroids with a spherical k-means on a random sample of the store, then indexes all its rows.
+        Call it again to retrain from scratch when the content of the store has drifted. Returns the index.
+        """
+        nb_rows = len(self.store)
+        if nb_rows == 0:
+            log_warning("The store is empty - nothing to train on", self.train, f"Store at {self.store.path}")
+            return self
+        rng = np.random.default_rng(seed)
+        nlist = min(self.nlist or max(1, int(4 * math.sqrt(nb_rows))), nb_rows)
+        sample_rows = np.sort(rng.choice(nb_rows, size=min(nb_rows, max(sample_size, nlist)), replace=False))
+        centroids = spherical_kmeans(self.store.get_vectors(sample_rows), nlist, iterations, rng)
+        with self._lock:
+            self.nlist = nlist
+            self.centroids = centroids
+            self._lists = [np.zeros(0, dtype=np.int64) for _ in range(nlist)]
+            self.indexed_rows = 0
+        self.update()
+        return self
+
+    def update(self, block_rows: int = VECTOR_SEARCH_BLOCK_ROWS) -> int:
+        """
+        Assigns the rows added to the store since the last update to their nearest cluster. Returns the number of rows added.
+        """
+        if not self.is_trained():
+            log_issue(ValueError("The index must be trained first"), self.update, f"Store at {self.store.path}")
+            return 0
+        nb_rows = len(self.store)
+        with self._lock:
+            start = self.indexed_rows
+            if start >= nb_rows: return 0
+            new_rows: list[list[np.ndarray]] = [[] for _ in range(self.nlist)]
+            for block_start in range(start, nb_rows, block_rows):
+                assignments = assign_clusters(self.store.get_vectors(slice(block_start, min(nb_rows, block_start + block_rows))), self.centroids)
+                order = np.argsort(assignments, kind="stable")
+                counts = np.bincount(assignments, minlength=self.nlist)
+                for list_id, rows in enumerate(np.split(order + block_start, np.cumsum(counts)[:-1])):
+                    if len(rows):
+                        new_rows[list_id].append(rows)
+            for list_id, parts in enumerate(new_rows):
+                if parts:
+                    self._lists[list_id] = np.concatenate([self._lists[list_id], *parts])
+            self.indexed_rows = nb_rows
+            return nb_rows - start
+
+    def cluster_sizes(self) -> np.ndarray:
+        """
+        Returns the number of rows of each cluster - a search scans the sum of the sizes of its nprobe clusters.
+        """
+        return np.array([len(rows) for rows in self._lists], dtype=np.int64)
+
+    def search(self, query: list[float], k: int = 10, nprobe: Optional[int] = None) -> list[dict[str, Any]]:
+        """
+        Approximate top-k cosine similarity search. Same output as EmbeddingStore.search().
+
+        Args:
+            query (list[float]): The query embedding, e.g. from embed_text.
+            k (int, optional): Number of results.
+            nprobe (int, optional): Clusters to scan. Defaults to self.nprobe.
+        """
+        return self.store.get_results(*self.search_rows(query, k, nprobe))
+
+    def search_rows(self, query: list[float], k: int = 10, nprobe: Optional[int] = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Same as search() but returns (rows, scores) as arrays without reading the records.
+        """
+        if not self.is_trained():
+            log_issue(ValueError("The index must be trained first"), self.search_rows, f"Store at {self.store.path}")
+            return NO_RESULTS
+        if len(self.store) > self.indexed_rows:
+            self.update()
+        q = self.store.prepare_query(query)
+        if q is None or k <= 0:
+            return NO_RESULTS
+        probes = top_k(self.centroids @ q, min(nprobe or self.nprobe, self.nlist))
+        rows = np.sort(np.concatenate([self._lists[list_id] for list_id in probes]))  # Sorted rows read the memmap sequentially
+        if not len(rows):
+            return NO_RESULTS
+        scores = self.store.score_rows(rows, q)
+        winners = top_k(scores, k)
+        return rows[winners], scores[winners]
+
+    def save(self, path: Optional[str] = None) -> None:
+        """
+        Saves the index - by default in the folder of the store. The file is replaced atomically.
+        """
+        if not self.is_trained():
+            log_issue(ValueError("The index must be trained first"), self.save, f"Store at {self.store.path}")
+            return
+        path = path or os.path.join(self.store.path, self.FILE_NAME)
+        with self._lock:
+            sizes = np.array([len(rows) for rows in self._lists], dtype=np.int64)
+            with open(path + ".tmp", "wb") as f:
+                np.savez(f, centroids=self.centroids, rows=np.concatenate(self._lists), sizes=sizes, indexed_rows=self.indexed_rows, nprobe=self.nprobe)
+            os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, store: EmbeddingStore, path: Optional[str] = None) -> Optional["IVFIndex"]:
+        """
+        Reopens an index saved with save() and indexes the rows added to the store since. Returns None if there is no usable index.
+        """
+        path = path or os.path.join(store.path, cls.FILE_NAME)
+        if not os.path.exists(path): return
+        try:
+            with np.load(path) as data:
+                centroids, rows, sizes = data["centroids"], data["rows"], data["sizes"]
+                indexed_rows, nprobe = int(data["indexed_rows"]), int(data["nprobe"])
+        except Exception as e:
+            log_issue(e, cls.load, f"Index at {path}")
+            return
+        if indexed_rows > len(store) or centroids.shape[1] != store.dimensions:
+            log_warning("The index doesn't match the store anymore - train a new one", cls.load, f"Index at {path}")
+            return
+        index = cls(store, len(centroids), nprobe)
+        index.centroids = centroids
+        index._lists = np.split(rows, np.cumsum(sizes)[:-1])
+        index.indexed_rows = indexed_rows
+        index.update()
+        return index
+
+# ****************************************** HELPERS **********************************************
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """
+    Returns the rows scaled to a norm of 1, as float32. Zero rows stay zero.
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+def assign_clusters(vectors: np.ndarray, centroids: np.ndarray, block_rows: int = 4096) -> np.ndarray:
+    """
+    Returns the index of the most similar centroid of each vector. By blocks so the score matrix stays small.
+    """
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_rows):
+        assignments[start:start + block_rows] = np.argmax(vectors[start:start + block_rows] @ centroids.T, axis=1)
+    return assignments
+
+def spherical_kmeans(vectors: np.ndarray, nb_clusters: int, iterations: int = IVF_TRAIN_ITERATIONS, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """
+    K-means for normalized vectors with the cosine similarity: the centroids are the normalized means of their members.
+    Empty clusters are reseeded with random vectors. Returns the (nb_clusters, dimensions) centroids.
+    """
+    rng = rng or np.random.default_rng(0)
+    centroids = vectors[rng.choice(len(vectors), size=nb_clusters, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assignments = assign_clusters(vectors, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=nb_clusters)
+        filled = np.flatnonzero(counts)
+        sums = np.zeros_like(centroids)
+        sums[filled] = np.add.reduceat(vectors[order], np.concatenate([[0], np.cumsum(counts[filled])[:-1]]), axis=0)
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), size=len(empty), replace=False)]
+        new_centroids = normalize_rows(sums)
+        if np.array_equal(new_centroids, centroids): break
+        centroids = new_centroids
+    return centroids
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Returns the indexes of the k highest scores, best first. O(n) selection then a sort of the k winners only.
+    """
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+def top_k_blocks(score_block: Callable[[int, int], np.ndarray], nb_rows: int, k: int, block_rows: int = VECTOR_SEARCH_BLOCK_ROWS) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns (rows, scores) of the k rows with the highest scores, best first.
+    score_block(start, end) returns the scores of the rows start to end - it is called block_rows rows at a time
+    and only the running top k is kept between blocks.
+    """
+    best_rows = np.zeros(0, dtype=np.int64)
+    best_scores = np.zeros(0, dtype=np.float32)
+    for start in range(0, nb_rows, block_rows):
+        scores = score_block(start, min(nb_rows, start + block_rows))
+        winners = top_k(scores, k)
+        best_rows = np.concatenate([best_rows, winners + start])
+        best_scores = np.concatenate([best_scores, scores[winners]])
+        if len(best_scores) > k:
+            keep = top_k(best_scores, k)
+            best_rows, best_scores = best_rows[keep], best_scores[keep]
+    order = top_k(best_scores, k)
+    return best_rows[order], best_scores[order]
+
+# *************************************************************************************************
+# *************************************************************************************************
+
+if __name__ == "__main__":
+    pass
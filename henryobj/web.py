@@ -1,9 +1,12 @@
 #   Functions related to fetching content from the web
 
 
-from .base import log_issue, remove_excess, remove_non_printable
-from .config import HTTP_URL_PATTERN, HEADERS
-from .oai import print_len_token_price
+from .base import log_issue, log_warning, remove_excess, remove_non_printable, lazy_import
+from .cache import HTTPCache
+from .config import (
+    HTTP_URL_PATTERN, HEADERS, HTML_PARSER, HTTP_CACHE_PATH, CRAWL_MAX_CONCURRENCY, CRAWL_MAX_PER_HOST, CRAWL_TIMEOUT, CRAWL_MAX_ATTEMPTS, CRAWL_RETRY_STATUSES, CRAWL_BACKOFF,
+    CRAWL_PARSE_WORKERS
+)
 
 
 from urllib.parse import urlparse, urlunparse, quote, unquote
@@ -11,16 +14,21 @@ from requests.adapters import HTTPAdapter
 from requests.exceptions import SSLError
 from urllib3.util.retry import Retry
 from urllib.parse import urljoin
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, NavigableString, CData
 from collections import deque
-from typing import Optional
+from typing import NamedTuple, Optional, Union
 
 import concurrent.futures
+import importlib.util
+import threading
 import requests
+import asyncio
 import random
 import time
 import re
 
+httpx = lazy_import("httpx") # Only needed by acrawl_website
+
 # ****** SET UP SESSION OBJECT FOR SCRAPPING *******
 
 """
@@ -46,56 +54,140 @@ def create_session(max_retries: int = 3, backoff_factor: float = 0.3, status_for
     session.headers.update(HEADERS)
     return session
 
-session = create_session()
+_SESSION_LOCK = threading.Lock()
+
+def get_session() -> requests.Session:
+    """
+    Returns the session shared by the crawling functions, created on the first call. Assign web.session to use another one.
+    """
+    global session
+    try:
+        return session
+    except NameError: # Not created yet - there is no session = ... at the module level
+        pass
+    with _SESSION_LOCK:
+        if "session" not in globals():
+            session = create_session()
+    return session
+
+def __getattr__(name: str):
+    # web.session keeps working - it is created on first access (PEP 562)
+    if name == "session":
+        return get_session()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# ****************** HTTP CACHE ******************
+
+# Opt-in - see enable_http_cache()
+_http_cache: Optional[HTTPCache] = None
+
+def disable_http_cache() -> None:
+    """
+    Stops using the HTTP cache. The cached pages stay on disk.
+    """
+    global _http_cache
+    if _http_cache is not None:
+        _http_cache.close()
+    _http_cache = None
+
+def enable_http_cache(path: str = HTTP_CACHE_PATH) -> HTTPCache:
+    """
+    Puts an on-disk cache in front of fetch_page, fetch_content_url and the crawls: a page already crawled is asked again with
+    If-None-Match / If-Modified-Since and, if it didn't change (304), its cleaned text and links come from the cache - no download, no parsing.
+    Returns the cache so you can check its stats().
+    """
+    global _http_cache
+    disable_http_cache()
+    _http_cache = HTTPCache(path)
+    return _http_cache
+
+def get_http_cache() -> Optional[HTTPCache]:
+    """
+    Returns the HTTP cache in use or None if the cache is not enabled.
+    """
+    return _http_cache
 
 # ****************** FUNCS ******************
 
+TAGS_TO_DECOMPOSE = ["header", "script", "nav", "style", "popup", "footer", "button", "form", "link", "img", "video"]
+REVIEW_CLASS_PATTERN = re.compile(r'data-verified-.*|review.*')
+CITATION_ID_PATTERN = re.compile(r'.*cite_note')
+JS_NEEDED_MESSAGE = "You need to enable JavaScript to run this app."
+TEXT_STRING_TYPES = (NavigableString, CData) # The strings get_text() returns - not the comments, scripts, doctype...
+
+class CleaningRules(NamedTuple):
+    """
+    What clean_soup removes from a page, with its patterns compiled once - see get_cleaning_rules.
+
+    Args:
+        tags (frozenset): Names of the tags removed with their content.
+        attributes (tuple): (attribute, pattern, tag name or None) - a tag (of that name) with a value of the attribute matching the pattern (re.match) is removed with its content.
+        remove_long_sentences (bool): Whether remove_long_sentences runs on the text.
+    """
+    tags: frozenset
+    attributes: tuple
+    remove_long_sentences: bool = False
+
+    def removes(self, name: str, attrs: dict) -> bool:
+        """
+        True if a tag with this name and these attributes is removed. attrs is the dict of BeautifulSoup or selectolax.
+        """
+        if name in self.tags:
+            return True
+        for attribute, pattern, tag_name in self.attributes:
+            if tag_name is not None and tag_name != name:
+                continue
+            value = attrs.get(attribute)
+            if value is None:
+                continue
+            if isinstance(value, str): # BeautifulSoup splits the classes, selectolax doesn't
+                value = value.split() if attribute == "class" else (value,)
+            if any(pattern.match(v) for v in value):
+                return True
+        return False
+
+# We keep the meta tag as it creates a big loss for Wikipedia
+_HIDDEN_RULE = ("aria-hidden", re.compile(r'true\Z'), None)
+DEFAULT_CLEANING_RULES = CleaningRules(frozenset(TAGS_TO_DECOMPOSE), (_HIDDEN_RULE, ("class", REVIEW_CLASS_PATTERN, "div")))
+# Special websites - a domain applies to its subdomains too (en.wikipedia.org)
+SITE_CLEANING_RULES = {
+    "wikipedia.org": CleaningRules(frozenset(TAGS_TO_DECOMPOSE), (_HIDDEN_RULE, ("id", CITATION_ID_PATTERN, None)), remove_long_sentences=True),
+}
+
 # Removes about 60% of the content
-def clean_soup(soup: BeautifulSoup, url: Optional[str] = None) -> str:
+def clean_soup(soup: BeautifulSoup, url: Optional[str] = None, verbose: bool = False) -> str:
     """
     Clean and extract text from a BeautifulSoup object.
 
     Args:
         soup (BeautifulSoup): The parsed HTML or XML document to be cleaned.
-        url (Optional): Default is None. Allows to have special rules for special websites.
+        url (Optional): Default is None. Allows to have special rules for special websites (see SITE_CLEANING_RULES).
+        verbose (bool): Prints the length, tokens and price of the text before and after cleaning - it tokenizes the page twice.
 
     Returns:
         str: The cleaned text content extracted from the soup.
     """
-    if ("You need to enable JavaScript to run this app." in soup.get_text()):
+    if verbose:
+        from .oai import print_len_token_price # Local - so importing web.py doesn't import openai
+        # Performance tracker
+        print(" * Before cleaning:     ", end ="")
+        print_len_token_price(soup.get_text())
+
+    rules = get_cleaning_rules(url)
+    prune_soup(soup, rules)
+
+    text = soup.get_text()
+    if JS_NEEDED_MESSAGE in text:
         # Here, we would need to use selenium and do a headless browser
         log_issue("Couldn't get the data of a wepage - JS needed", clean_soup)
-    
-    # Performance tracker
-    print(" * Before cleaning:     ", end ="")
-    print_len_token_price(soup.get_text())
-    
-    # Normal cleaner - we keep the meta tag as it creates a big loss for Wikipedia
-    for a in soup.find_all('a'):  
-        if not is_useful_link(a):
-            a.decompose()
-    tags_to_decompose = ["header", "script", "nav", "style", "popup", "footer", "button", "form", "link", "img", "video"]
-    for tag in soup(tags_to_decompose):
-        tag.decompose()
-    for tag in soup(lambda tag: tag.has_attr("aria-hidden") and tag["aria-hidden"] == "true"):
-        tag.decompose()
-    
-    # special cases can be listed with elif here
-    remove_long = False
-    if "wikipedia.org" in url:
-        remove_citations(soup)
-        remove_long = True
-    else:
-        remove_reviews(soup)
-    
-    text = soup.get_text()
-    if remove_long: text = remove_long_sentences(text)
+    if rules.remove_long_sentences: text = remove_long_sentences(text)
     text = remove_non_printable(text)
     text = remove_excess(text)
 
-    # Performance tracker
-    print(" ** After cleaning:     ", end ="*")
-    print_len_token_price(text)
+    if verbose:
+        # Performance tracker
+        print(" ** After cleaning:     ", end ="*")
+        print_len_token_price(text)
 
     return text
 
@@ -134,6 +226,12 @@ def content_type_is_text(content_type):
     else:
         return False
 
+def count_text_chars(text: str) -> int:
+    """
+    Number of characters of a text that are not whitespace - what is_useful_link compares.
+    """
+    return len("".join(text.split()))
+
 def crawl_handle_fetch_result(future, data_name, memory_store) -> None:
     """
     Handles fetched data and stores it in-memory.
@@ -142,118 +240,196 @@ def crawl_handle_fetch_result(future, data_name, memory_store) -> None:
     if content is not None:
         memory_store[data_name] = content
 
-def crawl_website(url: str, how_many_pages = 30, memory_store = None) -> dict:
+def crawl_website(url: str, how_many_pages = 30, memory_store = None, parser: Optional[str] = None) -> dict:
     """
     Crawl website starting from a given URL. Stores data in-memory. Return the dictionnary with all the content.
+
+    Note:
+        Each page is downloaded once and parsed once (see fetch_page) - the links to follow come with its text.
+        With the HTTP cache (see enable_http_cache), the pages that didn't change since the last crawl are neither downloaded nor parsed.
+        parser is the HTML backend (see get_html_parser), HTML_PARSER by default.
     """
-    submitted = 0
+    stored = 0
     if not memory_store:
         memory_store = {}  # In-memory storage for crawled data
     local_domain = urlparse(url).netloc 
     queue = deque([url])
     seen = set([url])
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        while queue:
-            url = queue.pop()
-            if not check_valid_url(url):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=CRAWL_MAX_PER_HOST) as executor:
+        futures = {}
+        while (queue or futures) and stored < how_many_pages:
+            # No more pages in flight than pages still needed
+            while queue and len(futures) < min(CRAWL_MAX_PER_HOST, how_many_pages - stored):
+                page_url = queue.pop()
+                if check_valid_url(page_url):
+                    futures[executor.submit(fetch_page, page_url, local_domain, parser)] = page_url
+            if not futures:
                 continue
-            response = session.head(url, headers=HEADERS)
-            content_type = response.headers.get("content-type", "")
-            if not content_type_is_text(content_type):
-                continue
-            data_name = clean_url_into_title(url)
-            future = executor.submit(fetch_content_url, url)
-            submitted += 1
-            if submitted == how_many_pages:
-                break
-            future.add_done_callback(lambda future: wrap_handle_fetch_result(future, data_name, memory_store))
-            for link in fetch_domain_links(local_domain, url):
-                if link not in seen:
-                    queue.append(link)
-                    seen.add(link)
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                page_url = futures.pop(future)
+                text, links = future.result()
+                if text is not None and stored < how_many_pages:
+                    memory_store[clean_url_into_title(page_url)] = text
+                    stored += 1
+                for link in links:
+                    if link not in seen:
+                        queue.append(link)
+                        seen.add(link)
     return memory_store
 
-def fetch_hyperlinks(url: str) -> list[str]:
+def fetch_hyperlinks(url: str, parser: Optional[str] = None) -> list[str]:
     """
     Fetch and return all hyperlinks from a given URL, filtering out non-HTML content and irrelevant links.
     """
-    try:
-        response = requests.get(url, headers=HEADERS)
-        if not response.headers.get('Content-Type', '').startswith('text/html'):
-            return []
-        html = response.text
-    except Exception as e:
-        log_issue(e, fetch_hyperlinks, f"Couldn't fetch the links of url {url}")
+    html = fetch_html(url)
+    if html is None:
         return []
-
-    soup = BeautifulSoup(html, 'html.parser')
-    links = [link.get('href') for link in soup.find_all('a') if link.get('href')]
-
-    filtered_links = [link for link in links if not (
-        link.startswith(('javascript:', 'mailto:', '#')) or '://' not in link and not link.startswith('/')
-    )]
-    return filtered_links
+    if get_html_parser(parser) == "selectolax":
+        return get_hyperlinks_from_lexbor(parse_lexbor(html))
+    soup = BeautifulSoup(html, get_html_parser(parser))
+    return get_hyperlinks_from_soup(soup)
 
 # Fetch URL - works as a standalone
 # Might want to test the driver version with selenium - driver = webdriver.Firefox()
-def fetch_content_url(url: str, attempt: int = 0) -> Optional[str]:
+def fetch_content_url(url: str, attempt: int = 0, parser: Optional[str] = None) -> Optional[str]:
     """
-    Fetch and clean content from a webpage.
+    Fetch and clean content from a webpage. Goes through the HTTP cache if it is enabled (see enable_http_cache).
     """
-    print(f"Doing {url}") # @ to be removed when prod
-    try:
-        data = session.get(url, timeout=5)  # Using session object instead of requests
-        if data.status_code == 200:
-            soup = BeautifulSoup(data.text, "html.parser")
-            clean = clean_soup(soup, url)
-            return clean
-        elif data.status_code == 429 and attempt < 2:
-            # in case of too many requests (429 is rate limiting), we wait and attempt again using exponential backoff
-            attempt += 1
-            sleep_time = (2 ** attempt) + random.uniform(0, 1)
-            time.sleep(sleep_time)
-            return fetch_content_url(url, attempt)
-        else:
-            # "URL could not be accessed:" - @ ToDecide if we want to do smth with it
-            return None
-    except SSLError as e:
-        log_issue(e, fetch_content_url, f"SSL/TLS error for url {url}")
+    if _http_cache is not None:
+        return fetch_page(url, parser=parser)[0]
+    html = fetch_html(url, attempt)
+    if html is None:
         return None
+    try:
+        return clean_html(html, url, parser)
     except Exception as e:
         log_issue(e, fetch_content_url, f"For url {url}")
         return None
 
-def is_useful_link(tag):
+def fetch_html(url: str, attempt: int = 0) -> Optional[str]:
+    """
+    Downloads a page with the shared session and returns its HTML. None if it can't be fetched or is not text.
+    The content type is read from the headers of the GET - the body of a PDF or an image is not downloaded.
+    """
+    return fetch_html_conditional(url, attempt=attempt)[1]
+
+def fetch_html_conditional(url: str, entry: Optional[dict] = None, attempt: int = 0) -> tuple[int, Optional[str], dict]:
+    """
+    fetch_html revalidating a page of the HTTP cache: entry (see HTTPCache.get) gives the If-None-Match / If-Modified-Since headers.
+    Returns (status, html, headers of the response) - (304, None, headers) if the page didn't change, (200, html, headers) if it
+    was downloaded and (0, None, {}) if it can't be fetched or is not text.
+    """
+    try:
+        with get_session().get(url, timeout=5, stream=True, headers=HTTPCache.conditional_headers(entry)) as data:  # Using session object instead of requests
+            if data.status_code == 304 and entry is not None:
+                return 304, None, data.headers
+            if data.status_code == 200:
+                if not content_type_is_text(data.headers.get("content-type", "")):
+                    return 0, None, {}
+                return 200, data.text, data.headers
+            elif data.status_code == 429 and attempt < 2:
+                # in case of too many requests (429 is rate limiting), we wait and attempt again using exponential backoff
+                attempt += 1
+                sleep_time = (2 ** attempt) + random.uniform(0, 1)
+                time.sleep(sleep_time)
+            else:
+                # "URL could not be accessed:" - @ ToDecide if we want to do smth with it
+                return 0, None, {}
+        return fetch_html_conditional(url, entry, attempt)
+    except SSLError as e:
+        log_issue(e, fetch_html_conditional, f"SSL/TLS error for url {url}")
+        return 0, None, {}
+    except Exception as e:
+        log_issue(e, fetch_html_conditional, f"For url {url}")
+        return 0, None, {}
+
+def fetch_page(url: str, local_domain: Optional[str] = None, parser: Optional[str] = None) -> tuple[Optional[str], set[str]]:
+    """
+    Downloads a page once and parses it once. Returns (cleaned text, urls of local_domain it links to) - (None, empty set) if it
+    can't be fetched, is not text or fails to parse. local_domain defaults to the domain of url.
+
+    Note:
+        With the HTTP cache (see enable_http_cache), a page already crawled is only revalidated: if it didn't change, its text
+        and links come from the cache. The cached links are the ones of the domain of url.
+    """
+    local_domain = local_domain or urlparse(url).netloc
+    cache = _http_cache
+    if cache is None:
+        html = fetch_html(url)
+        if html is None:
+            return None, set()
+        try:
+            return parse_page(html, url, local_domain, parser)
+        except Exception as e:
+            log_issue(e, fetch_page, f"For url {url}")
+            return None, set()
+    parser = get_html_parser(parser)
+    entry = cache.get(url, parser)
+    status, html, headers = fetch_html_conditional(url, entry)
+    if status == 304:
+        cache.record_hit(entry)
+        return entry["text"], set(entry["links"])
+    if html is None:
+        return None, set()
+    try:
+        text, links = parse_page(html, url, local_domain, parser)
+    except Exception as e:
+        log_issue(e, fetch_page, f"For url {url}")
+        return None, set()
+    size = len(html.encode("utf-8"))
+    cache.record_miss(size)
+    cache.put(url, text, links, size, parser, headers.get("etag"), headers.get("last-modified"))
+    return text, links
+
+def is_useful_link(tag, link_chars: Optional[int] = None, parent_chars: Optional[int] = None) -> bool:
     """
     Mini function to check if a link is surrounded with content, hence useful, or alone.
     Return True if useful, False otherwise.
+
+    Note:
+        link_chars and parent_chars are the text characters (count_text_chars) of the link and of its parent. prune_soup counts them
+        while walking the page, so the test is O(1) - they are computed here if not given.
     """
-   # Check previous and next siblings
-    prev_sibling = tag.previous_sibling
-    next_sibling = tag.next_sibling
-    if prev_sibling and prev_sibling.string and prev_sibling.string.strip() != '':
-        return True
-    if next_sibling and next_sibling.string and next_sibling.string.strip() != '':
-        return True
-    # Check if link is in the middle of the parent's text (excluding the link's own text)
     parent = tag.parent
-    if parent:
-        text_without_link = parent.get_text().replace(tag.get_text(), '').strip()
-        if text_without_link:
-            return True
-    return False
+    if parent is None:
+        return False
+    if link_chars is None:
+        link_chars = count_text_chars(tag.get_text())
+    if parent_chars is None:
+        parent_chars = count_text_chars(parent.get_text())
+    # The parent has text outside of the link - before it, after it or around it
+    return parent_chars > link_chars
 
 def fetch_domain_links(local_domain, url):
     """
     Returns the list of all unique urls of a given domain. Search start from a specific page (url).
     Doesn't return links that are not part of the domain.
     """
+    raw_links = fetch_hyperlinks(url)
+    if raw_links is None:
+        print("No hyperlink", fetch_domain_links, f"For {url} and {local_domain}")
+        return []
+    return get_domain_links(local_domain, url, raw_links)
+
+def get_cleaning_rules(url: Optional[str] = None) -> CleaningRules:
+    """
+    Returns the rules of clean_soup for a page: the ones of its domain in SITE_CLEANING_RULES, DEFAULT_CLEANING_RULES otherwise.
+    """
+    host = (urlparse(url).hostname or "") if url else ""
+    while host:
+        rules = SITE_CLEANING_RULES.get(host)
+        if rules is not None:
+            return rules
+        host = host.partition(".")[2]
+    return DEFAULT_CLEANING_RULES
+
+def get_domain_links(local_domain: str, url: str, raw_links: list[str]) -> set[str]:
+    """
+    Returns the unique absolute urls of local_domain among the links found on the page url (see get_hyperlinks_from_soup).
+    """
     clean_links = set()
     try:
-        raw_links = fetch_hyperlinks(url)
-        if raw_links is None:
-            print("No hyperlink", fetch_domain_links, f"For {url} and {local_domain}")
-            return []
         for link in set(raw_links):
             if link is None:
                 continue
@@ -266,7 +442,7 @@ def fetch_domain_links(local_domain, url):
             else:
                 if link.startswith("/") and not link.startswith("//"):
                     link = link[1:]
-                    valid_link = f"https://{local_domain}/{link}"
+                    valid_link = f"{urlparse(url).scheme or 'https'}://{local_domain}/{link}" # Same scheme as the page
                 elif link.startswith("#") or link.startswith("mailto:"):
                     continue
                 else:
@@ -276,14 +452,79 @@ def fetch_domain_links(local_domain, url):
                     valid_link = valid_link[:-1]
                 clean_links.add(valid_link)
     except Exception as e:
-        log_issue(e, fetch_domain_links, f"For {url} and {local_domain}")
+        log_issue(e, get_domain_links, f"For {url} and {local_domain}")
     return clean_links
 
+def filter_hyperlinks(links: list[Optional[str]]) -> list[str]:
+    """
+    Removes the empty, javascript:, mailto: and # links - and the relative ones not starting with /.
+    """
+    return [link for link in links if link and not (
+        link.startswith(('javascript:', 'mailto:', '#')) or '://' not in link and not link.startswith('/')
+    )]
+
+def get_hyperlinks_from_soup(soup: BeautifulSoup) -> list[str]:
+    """
+    Returns the hyperlinks of a parsed page, without the javascript:, mailto: and # ones.
+    """
+    return filter_hyperlinks([link.get('href') for link in soup.find_all('a')])
+
 def get_primary_lang_code(lang_data: str) -> str:
     # Split the lang_data by comma and extract the main language code of the first segment
     primary_lang_code = lang_data.split(",")[0].split("-")[0]
     return primary_lang_code
 
+def parse_page(html: str, url: str, local_domain: str, parser: Optional[str] = None) -> tuple[str, set[str]]:
+    """
+    Parses a page once and returns (cleaned text, urls of local_domain it links to).
+    The links are taken before clean_soup as it removes the navigation. parser is the HTML backend (see get_html_parser).
+    """
+    parser = get_html_parser(parser)
+    if parser == "selectolax":
+        tree = parse_lexbor(html)
+        links = get_domain_links(local_domain, url, get_hyperlinks_from_lexbor(tree))
+        return clean_lexbor_tree(tree, url), links
+    soup = BeautifulSoup(html, parser)
+    links = get_domain_links(local_domain, url, get_hyperlinks_from_soup(soup))
+    return clean_soup(soup, url), links
+
+def prune_soup(soup: BeautifulSoup, rules: CleaningRules = DEFAULT_CLEANING_RULES) -> BeautifulSoup:
+    """
+    Removes in place, in one traversal, the tags matched by the rules and the links that are alone (see is_useful_link).
+
+    Note:
+        The tree is walked depth first with a stack - no recursion limit on deeply nested pages. A tag matched by the rules is
+        removed as soon as it is reached, without visiting its content. Once the children of a tag are done, its count of text
+        characters is known and the links among them are tested in O(1) - against the page as served, minus the removed tags.
+    """
+    stack = [[soup, 0, 0, []]] # tag, index of the next child, text characters, [(link child, its text characters)]
+    while stack:
+        frame = stack[-1]
+        tag, index = frame[0], frame[1]
+        contents = tag.contents
+        if index < len(contents):
+            child = contents[index]
+            if isinstance(child, NavigableString):
+                frame[1] = index + 1
+                if type(child) in TEXT_STRING_TYPES:
+                    frame[2] += count_text_chars(child)
+            elif rules.removes(child.name, child.attrs):
+                child.decompose() # The next child takes its index
+            else:
+                frame[1] = index + 1
+                stack.append([child, 0, 0, []])
+            continue
+        stack.pop()
+        chars = frame[2]
+        for link, link_chars in frame[3]:
+            if not is_useful_link(link, link_chars, chars):
+                link.decompose()
+        if stack:
+            stack[-1][2] += chars
+            if tag.name == "a":
+                stack[-1][3].append((tag, chars))
+    return soup
+
 def remove_citations(soup: BeautifulSoup) -> BeautifulSoup:
     """
     Remove citation tags from a BeautifulSoup object.
@@ -313,11 +554,10 @@ def remove_reviews(soup : BeautifulSoup) -> BeautifulSoup:
     """
     Slightly risky function which removes the reviews from a Shopify store.
     """
-    pattern = re.compile(r'data-verified-.*|review.*')
     for div in soup.find_all('div'):
         if div.attrs is not None: 
             div_class = div.get('class')
-            if div_class is not None and any(pattern.match(class_) for class_ in div_class):
+            if div_class is not None and any(REVIEW_CLASS_PATTERN.match(class_) for class_ in div_class):
                 div.decompose()
     return soup
 
@@ -374,6 +614,261 @@ def get_local_domain(from_url):
     except Exception as e:
         log_issue(e, get_local_domain, f"For {from_url}")
 
+# ****************** HTML PARSERS ******************
+
+# The backends of parse_page / clean_html. html.parser and lxml build a BeautifulSoup, selectolax a lexbor tree (C, no Python objects per node).
+HTML_PARSERS = ("html.parser", "lxml", "selectolax")
+_PARSER_AVAILABLE: dict[str, bool] = {"html.parser": True}
+
+def clean_html(html: str, url: Optional[str] = None, parser: Optional[str] = None, verbose: bool = False) -> str:
+    """
+    Parses a page with the HTML backend and returns its cleaned text - see clean_soup.
+    """
+    parser = get_html_parser(parser)
+    if parser == "selectolax":
+        return clean_lexbor_tree(parse_lexbor(html), url, verbose)
+    return clean_soup(BeautifulSoup(html, parser), url, verbose)
+
+def clean_lexbor_tree(tree, url: Optional[str] = None, verbose: bool = False) -> str:
+    """
+    Same as clean_soup for a selectolax LexborHTMLParser - same rules, so the same text.
+
+    Note:
+        The tags matched by the rules are removed by lexbor (strip_tags, then a CSS query per attribute rule), from the last to
+        the first: selectolax must not touch a node whose ancestor is already gone. Then every link is tested before any is
+        removed, with the text of each parent counted once - the same test as prune_soup.
+    """
+    root = tree.root
+    if root is None: return ""
+    if verbose:
+        from .oai import print_len_token_price # Local - so importing web.py doesn't import openai
+        # Performance tracker
+        print(" * Before cleaning:     ", end ="")
+        print_len_token_price(root.text(separator=""))
+
+    rules = get_cleaning_rules(url)
+    tree.strip_tags(list(rules.tags))
+    for attribute, _, tag_name in rules.attributes:
+        for node in reversed(tree.css(f'{tag_name or ""}[{attribute}]')):
+            if rules.removes(node.tag, node.attributes):
+                node.decompose()
+
+    parent_chars = {} # mem_id of a parent -> its text characters
+    useless = []
+    for link in tree.css("a"):
+        parent = link.parent
+        chars = parent_chars.get(parent.mem_id)
+        if chars is None:
+            chars = parent_chars[parent.mem_id] = count_text_chars(parent.text(separator=""))
+        if not is_useful_lexbor_link(link, count_text_chars(link.text(separator="")), chars):
+            useless.append(link)
+    for link in reversed(useless):
+        link.decompose()
+
+    text = root.text(separator="")
+    if JS_NEEDED_MESSAGE in text:
+        log_issue("Couldn't get the data of a wepage - JS needed", clean_lexbor_tree)
+    if rules.remove_long_sentences: text = remove_long_sentences(text)
+    text = remove_non_printable(text)
+    text = remove_excess(text)
+
+    if verbose:
+        # Performance tracker
+        print(" ** After cleaning:     ", end ="*")
+        print_len_token_price(text)
+
+    return text
+
+def get_html_parser(parser: Optional[str] = None) -> str:
+    """
+    Returns the HTML backend to use - parser, HTML_PARSER by default. Falls back to "html.parser" (with a warning) if its package isn't installed.
+    """
+    parser = parser or HTML_PARSER
+    if parser not in HTML_PARSERS:
+        raise ValueError(f"Unknown HTML parser {parser!r} - use one of {HTML_PARSERS}")
+    available = _PARSER_AVAILABLE.get(parser)
+    if available is None:
+        available = _PARSER_AVAILABLE[parser] = importlib.util.find_spec(parser) is not None
+        if not available:
+            log_warning(f"{parser} is not installed (pip install {parser}) - html.parser is used instead", get_html_parser)
+    return parser if available else "html.parser"
+
+def get_hyperlinks_from_lexbor(tree) -> list[str]:
+    """
+    Same as get_hyperlinks_from_soup for a selectolax LexborHTMLParser.
+    """
+    return filter_hyperlinks([node.attributes.get("href") for node in tree.css("a")])
+
+def is_useful_lexbor_link(node, link_chars: Optional[int] = None, parent_chars: Optional[int] = None) -> bool:
+    """
+    Same as is_useful_link for a lexbor node.
+    """
+    parent = node.parent
+    if parent is None:
+        return False
+    if link_chars is None:
+        link_chars = count_text_chars(node.text(separator=""))
+    if parent_chars is None:
+        parent_chars = count_text_chars(parent.text(separator=""))
+    return parent_chars > link_chars
+
+def parse_lexbor(html: str):
+    """
+    Returns the selectolax LexborHTMLParser of a page. selectolax is optional - see HTML_PARSER.
+    """
+    from selectolax.lexbor import LexborHTMLParser
+    return LexborHTMLParser(html)
+
+# ****************** ASYNC CRAWL ******************
+
+async def acrawl_website(url: Union[str, list[str]], how_many_pages: int = 30, memory_store: Optional[dict] = None, max_concurrency: int = CRAWL_MAX_CONCURRENCY,
+                         max_per_host: int = CRAWL_MAX_PER_HOST, timeout: float = CRAWL_TIMEOUT, max_attempts: int = CRAWL_MAX_ATTEMPTS, parse_workers: int = CRAWL_PARSE_WORKERS, parser: Optional[str] = None,
+                         stats: Optional[dict] = None) -> dict:
+    """
+    Async version of crawl_website. max_concurrency workers share a frontier of urls, each page is downloaded once (GET)
+    and its text and links come from one parse - run in threads (or processes) so the downloads go on meanwhile.
+    With the HTTP cache (see enable_http_cache), the pages that didn't change since the last crawl are neither downloaded nor parsed.
+
+    Args:
+        url (str or list of str): The start page(s). Each start page is crawled within its own domain.
+        how_many_pages (int, optional): Pages stored in memory_store before stopping. Defaults to 30.
+        memory_store (dict, optional): Filled with {clean_url_into_title(url): cleaned text}, like crawl_website. A new dict if None.
+        max_concurrency (int, optional): Pages fetched at once, all hosts together. Defaults to CRAWL_MAX_CONCURRENCY.
+        max_per_host (int, optional): Pages fetched at once from the same host. Defaults to CRAWL_MAX_PER_HOST.
+        timeout (float, optional): Seconds per request. Defaults to CRAWL_TIMEOUT.
+        max_attempts (int, optional): Attempts per page on CRAWL_RETRY_STATUSES and network errors. Defaults to CRAWL_MAX_ATTEMPTS.
+        parse_workers (int, optional): Processes parsing the pages - parsing takes ~10ms of CPU per page so threads cap the crawl
+            at ~100 pages/sec whatever the concurrency. 0 (CRAWL_PARSE_WORKERS) parses in threads.
+        parser (str, optional): The HTML backend (see get_html_parser). Defaults to HTML_PARSER.
+        stats (dict, optional): Filled with the pages fetched / not_modified (304 - from the HTTP cache) / stored / skipped (not text) / failed,
+            the retries, the duration and pages_per_sec.
+
+    Returns:
+        dict: memory_store.
+
+    Example:
+        pages = asyncio.run(acrawl_website("https://example.com", how_many_pages=500))
+    """
+    if not memory_store:
+        memory_store = {}  # In-memory storage for crawled data
+    start = time.perf_counter()
+    counters = {"fetched": 0, "not_modified": 0, "stored": 0, "skipped": 0, "failed": 0, "retries": 0}
+    cache = _http_cache
+    frontier: asyncio.Queue = asyncio.Queue()
+    seen = set()
+    for start_url in [url] if isinstance(url, str) else url:
+        if start_url not in seen:
+            seen.add(start_url)
+            frontier.put_nowait(start_url)
+    host_limits: dict[str, asyncio.Semaphore] = {}
+    loop = asyncio.get_running_loop()
+    parser = get_html_parser(parser) # Resolved once - and here, so a missing backend is reported once
+    parse_pool = concurrent.futures.ProcessPoolExecutor(parse_workers) if parse_workers > 0 else None # None is the default thread pool of the loop
+    limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+
+    async with httpx.AsyncClient(headers=HEADERS, timeout=timeout, follow_redirects=True, limits=limits) as client:
+        async def crawl_page(page_url: str) -> None:
+            local_domain = urlparse(page_url).netloc
+            host_limit = host_limits.setdefault(local_domain, asyncio.Semaphore(max_per_host))
+            entry = await loop.run_in_executor(None, cache.get, page_url, parser) if cache is not None else None # SQLite off the loop
+            async with host_limit:
+                status, html, headers, final_url = await afetch_page_conditional(client, page_url, entry, max_attempts, counters)
+            if final_url != page_url:
+                # Redirected - the links are resolved against (and the page is stored under) the url it was served from
+                if final_url in seen: return
+                seen.add(final_url)
+                page_url, local_domain = final_url, urlparse(final_url).netloc
+            if status == 304:
+                cache.record_hit(entry)
+                text, links = entry["text"], set(entry["links"])
+            elif html is None:
+                return
+            else:
+                text, links = await loop.run_in_executor(parse_pool, parse_page, html, page_url, local_domain, parser)
+                if cache is not None:
+                    size = len(html.encode("utf-8"))
+                    cache.record_miss(size)
+                    await loop.run_in_executor(None, cache.put, page_url, text, links, size, parser, headers.get("etag"), headers.get("last-modified"))
+            if text and counters["stored"] < how_many_pages:
+                memory_store[clean_url_into_title(page_url)] = text
+                counters["stored"] += 1
+            for link in links:
+                if link not in seen:
+                    seen.add(link)
+                    frontier.put_nowait(link)
+
+        async def worker() -> None:
+            while True:
+                page_url = await frontier.get()
+                try:
+                    # Once enough pages are stored, the rest of the frontier is only drained
+                    if counters["stored"] < how_many_pages and check_valid_url(page_url):
+                        await crawl_page(page_url)
+                except Exception as e:
+                    counters["failed"] += 1
+                    log_issue(e, acrawl_website, f"For url {page_url}")
+                finally:
+                    frontier.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(max_concurrency)]
+        try:
+            await frontier.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if parse_pool is not None: # Waits for the parses in flight off the loop
+                await loop.run_in_executor(None, lambda: parse_pool.shutdown(cancel_futures=True))
+
+    if stats is not None:
+        duration = time.perf_counter() - start
+        stats.update(counters, duration=duration, pages_per_sec=counters["stored"] / duration if duration else 0.0)
+    return memory_store
+
+async def afetch_page(client, url: str, max_attempts: int = CRAWL_MAX_ATTEMPTS, counters: Optional[dict] = None) -> Optional[str]:
+    """
+    Downloads a page with an httpx.AsyncClient and returns its HTML. None if it is not text (the body is not downloaded) or can't be fetched.
+    Retries with an exponential backoff on CRAWL_RETRY_STATUSES and network errors. counters (see acrawl_website) is updated if given.
+    """
+    return (await afetch_page_conditional(client, url, None, max_attempts, counters))[1]
+
+async def afetch_page_conditional(client, url: str, entry: Optional[dict] = None, max_attempts: int = CRAWL_MAX_ATTEMPTS, counters: Optional[dict] = None) -> tuple[int, Optional[str], dict, str]:
+    """
+    afetch_page revalidating a page of the HTTP cache - same arguments and result as fetch_html_conditional, plus those of afetch_page.
+    The url the page was served from comes last: the client may follow redirects, the links of the page are relative to it.
+    """
+    counters = counters if counters is not None else {}
+    def count(name: str) -> None:
+        counters[name] = counters.get(name, 0) + 1
+
+    headers = HTTPCache.conditional_headers(entry)
+    for attempt in range(1, max_attempts + 1):
+        try:
+            async with client.stream("GET", url, headers=headers) as response:
+                if response.status_code not in CRAWL_RETRY_STATUSES or attempt == max_attempts:
+                    final_url = str(response.url)
+                    if response.status_code == 304 and entry is not None:
+                        count("not_modified")
+                        return 304, None, response.headers, final_url
+                    # The content type comes from the GET - no HEAD request before it
+                    if response.status_code != 200:
+                        count("failed")
+                        return 0, None, {}, final_url
+                    if not content_type_is_text(response.headers.get("content-type", "")):
+                        count("skipped")
+                        return 0, None, {}, final_url
+                    await response.aread()
+                    count("fetched")
+                    return 200, response.text, response.headers, final_url
+        except httpx.TransportError as e:
+            if attempt == max_attempts:
+                count("failed")
+                log_issue(e, afetch_page_conditional, f"For url {url}")
+                return 0, None, {}, url
+        count("retries")
+        await asyncio.sleep(CRAWL_BACKOFF * 2 ** (attempt - 1) + random.uniform(0, CRAWL_BACKOFF))
+    return 0, None, {}, url
+
 # *************************************************************
 if __name__ == "__main__":
     pass
\ No newline at end of file
@@ -12,8 +12,10 @@ setup(
         "openai>=1.33.0",
         "tiktoken>=0.5.2",
         "requests>=2.31.0",
+        "httpx",
         "bs4",
-        "pathspec"
+        "pathspec",
+        "numpy"
     ],
     long_description=long_description,
     long_description_content_type="text/markdown",
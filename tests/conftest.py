@@ -0,0 +1,53 @@
+# Fixtures shared by the tests - a clock to drive the TTLs and rate limits, and a tokenizer that works offline.
+
+import pytest
+
+
+class FakeClock:
+    """
+    Stands for the time module of a submodule: time() / monotonic() only move when the test (or sleep) advances them.
+    """
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+        self.slept = 0.0
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.slept += seconds
+        self.now += seconds
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def tokenizer_model(monkeypatch) -> str:
+    """
+    Returns the name of a model registered with a tiktoken encoding where each byte is a token (a few merges for common pairs), built locally:
+    the real encodings are downloaded on first use, which the tests can't rely on.
+    """
+    import tiktoken
+    from henryobj import oai
+    ranks = {bytes([i]): i for i in range(256)}
+    for rank, pair in enumerate([b" t", b"th", b"he", b"in", b"er", b"an", b" a", b"re", b"on"], 256):
+        ranks[pair] = rank
+    encoder = tiktoken.Encoding(
+        name="test_bytes",
+        pat_str=r"""'s|'t|'re|'ve|'m|'ll|'d| ?\w+| ?\d+| ?[^\s\w]+|\s+(?!\S)|\s+""",
+        mergeable_ranks=ranks,
+        special_tokens={"<|endoftext|>": 1000},
+    )
+    monkeypatch.setitem(oai._ENCODERS, "test-model", encoder)
+    return "test-model"
@@ -0,0 +1,121 @@
+# BatchJob run end to end on LocalBatchTransport - parts, results, retries, resuming and the failures of the transport.
+
+import json
+import os
+
+import pytest
+
+from henryobj import batch
+from henryobj.batch import BatchJob, BatchTransport, LocalBatchTransport
+
+
+def echo(body: dict) -> dict:
+    question = body["messages"][-1]["content"]
+    if question.startswith("fail"):
+        raise ValueError("The model refused")
+    return {"choices": [{"message": {"content": f" Answer to {question} "}}], "usage": {"prompt_tokens": 3, "completion_tokens": 4}}
+
+@pytest.fixture
+def retries(monkeypatch):
+    # The requests retried by BatchJob.retry_failed - answered without any API call
+    sent = []
+    def request_chatgpt(messages, max_tokens, **kwargs):
+        sent.append(messages[-1]["content"])
+        return f"Retried {messages[-1]['content']}"
+    monkeypatch.setattr(batch.oai, "request_chatgpt", request_chatgpt)
+    return sent
+
+def add_questions(job: BatchJob, questions: list[str]) -> None:
+    for question in questions:
+        assert job.add_messages(question, [{"role": "user", "content": question}])
+
+def test_transport_must_implement_every_method():
+    class Partial(BatchTransport):
+        def upload(self, path): return "file"
+    with pytest.raises(TypeError):
+        Partial()
+    LocalBatchTransport() # The provided transports implement all of them
+
+def test_run(tmp_path, retries):
+    job = BatchJob(str(tmp_path / "job"), LocalBatchTransport(str(tmp_path / "provider"), echo))
+    add_questions(job, ["q1", "q2", "fail3"])
+    answers = job.run(poll_interval=0.01, timeout=10)
+    assert answers == {"q1": "Answer to q1", "q2": "Answer to q2", "fail3": "Retried fail3"}
+    assert retries == ["fail3"]
+    assert job.progress() == {"requests": 3, "submitted": 3, "results": 3, "answered": 3}
+    sources = {(result["custom_id"], result["source"]) for result in job.results()}
+    assert ("fail3", "batch") in sources and ("fail3", "retry") in sources
+
+def test_custom_ids_are_unique(tmp_path):
+    job = BatchJob(str(tmp_path), LocalBatchTransport(str(tmp_path / "provider"), echo))
+    assert job.add_messages("a", [{"role": "user", "content": "Hi"}])
+    assert not job.add_messages("a", [{"role": "user", "content": "Hi again"}])
+    assert len(job) == 1
+
+def test_requests_are_split_in_parts(tmp_path, monkeypatch, retries):
+    monkeypatch.setattr(batch, "BATCH_MAX_REQUESTS", 2)
+    job = BatchJob(str(tmp_path / "job"), LocalBatchTransport(str(tmp_path / "provider"), echo))
+    add_questions(job, [f"q{i}" for i in range(5)])
+    assert len(job.submit()) == 3
+    assert [(part["start"], part["end"]) for part in job.state["parts"]] == [(0, 2), (2, 4), (4, 5)]
+    assert job.wait(poll_interval=0.01, timeout=10)
+    assert job.get_answers() == {f"q{i}": f"Answer to q{i}" for i in range(5)}
+    assert retries == []
+
+def test_resume_doesnt_send_or_download_twice(tmp_path, retries):
+    submitted = []
+    class CountingTransport(LocalBatchTransport):
+        def submit(self, file_id, *args, **kwargs):
+            submitted.append(file_id)
+            return super().submit(file_id, *args, **kwargs)
+    provider = str(tmp_path / "provider")
+    job = BatchJob(str(tmp_path / "job"), CountingTransport(provider, echo))
+    add_questions(job, ["q1", "q2"])
+    job.run(poll_interval=0.01, timeout=10)
+    # A new process on the same folders
+    resumed = BatchJob(str(tmp_path / "job"), CountingTransport(provider, echo))
+    assert resumed.run(poll_interval=0.01, timeout=10) == {"q1": "Answer to q1", "q2": "Answer to q2"}
+    assert len(submitted) == 1
+    assert len(list(resumed.results())) == 2
+    # New requests go in a new part
+    add_questions(resumed, ["q3"])
+    assert resumed.run(poll_interval=0.01, timeout=10)["q3"] == "Answer to q3"
+    assert len(submitted) == 2
+
+def test_partial_lines_are_dropped(tmp_path):
+    job = BatchJob(str(tmp_path), LocalBatchTransport(str(tmp_path / "provider"), echo))
+    add_questions(job, ["q1"])
+    with open(tmp_path / "requests.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"custom_id": "q2", "meth') # Interrupted write
+    reopened = BatchJob(str(tmp_path), LocalBatchTransport(str(tmp_path / "provider"), echo))
+    assert len(reopened) == 1
+    assert reopened.add_messages("q2", [{"role": "user", "content": "q2"}])
+    with open(tmp_path / "requests.jsonl", "r", encoding="utf-8") as f:
+        assert [json.loads(line)["custom_id"] for line in f] == ["q1", "q2"]
+
+def test_failed_local_batch_is_retried(tmp_path, retries):
+    class BrokenTransport(LocalBatchTransport):
+        def _answer(self, line):
+            raise OSError("No space left on device")
+    transport = BrokenTransport(str(tmp_path / "provider"), echo)
+    job = BatchJob(str(tmp_path / "job"), transport)
+    add_questions(job, ["q1", "q2"])
+    assert job.run(poll_interval=0.01, timeout=10) == {"q1": "Retried q1", "q2": "Retried q2"}
+    assert job.state["parts"][0]["status"] == "failed"
+    assert transport._threads == {}
+
+def test_local_transport_files(tmp_path):
+    transport = LocalBatchTransport(str(tmp_path), echo)
+    requests = tmp_path / "requests.jsonl"
+    requests.write_text("".join(json.dumps({"custom_id": f"c{i}", "body": {"messages": [{"role": "user", "content": q}]}}) + "\n" for i, q in enumerate(["ok", "fail"])))
+    batch_id = transport.submit(transport.upload(str(requests)))
+    transport._threads[batch_id].join(10)
+    info = transport.retrieve(batch_id)
+    assert info["status"] == "completed"
+    output = [json.loads(line) for line in transport.iter_lines(info["output_file_id"])]
+    errors = [json.loads(line) for line in transport.iter_lines(info["error_file_id"])]
+    assert [item["custom_id"] for item in output] == ["c0"] and output[0]["response"]["status_code"] == 200
+    assert [item["custom_id"] for item in errors] == ["c1"] and errors[0]["error"]["code"] == "ValueError"
+    with pytest.raises(ValueError):
+        transport.submit("file-missing")
+    assert os.path.exists(os.path.join(str(tmp_path), batch_id + ".json"))
@@ -0,0 +1,131 @@
+# EmbeddingCache (LRU on disk), CompletionCache (memory LRU + disk, TTL) and HTTPCache (validators, normalized urls).
+
+import pytest
+
+from henryobj import cache
+from henryobj.cache import EmbeddingCache, CompletionCache, HTTPCache
+
+
+@pytest.fixture
+def cache_clock(clock, monkeypatch):
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+# ****************************************** EMBEDDINGS *******************************************
+
+def test_embedding_round_trip_is_exact(tmp_path):
+    store = EmbeddingCache(str(tmp_path / "emb.sqlite"))
+    embedding = [0.1, -0.2, 1 / 3]
+    store.put("Some  text\n", embedding, "model")
+    assert store.get("Some text", "model") == embedding # Whitespace is normalized, float64 kept as is
+    assert store.get("Some text", "model", dimensions=256) is None
+    assert store.get("Some text", "other-model") is None
+    assert store.stats()["hits"] == 1 and store.stats()["misses"] == 2
+
+def test_embedding_get_many_keeps_the_order(tmp_path):
+    store = EmbeddingCache(str(tmp_path / "emb.sqlite"))
+    store.put_many(["a", "b", "c"], [[1.0], None, [3.0]], "model")
+    assert store.get_many(["c", "b", "a"], "model") == [[3.0], None, [1.0]]
+    assert store.stats()["entries"] == 2
+
+def test_embedding_evicts_the_least_recently_used(tmp_path, cache_clock):
+    store = EmbeddingCache(str(tmp_path / "emb.sqlite"), max_entries=2)
+    store.put("a", [1.0], "model")
+    cache_clock.advance(1)
+    store.put("b", [2.0], "model")
+    cache_clock.advance(1)
+    assert store.get("a", "model") == [1.0] # a is now more recent than b
+    cache_clock.advance(1)
+    store.put("c", [3.0], "model")
+    assert store.get("b", "model") is None
+    assert store.get("a", "model") == [1.0] and store.get("c", "model") == [3.0]
+    assert store.stats()["entries"] == 2
+
+def test_embedding_cache_persists(tmp_path):
+    path = str(tmp_path / "emb.sqlite")
+    store = EmbeddingCache(path)
+    store.put("a", [1.0, 2.0], "model")
+    store.close()
+    reopened = EmbeddingCache(path)
+    assert reopened.get("a", "model") == [1.0, 2.0]
+    assert reopened.stats()["entries"] == 1
+
+# ****************************************** COMPLETIONS ******************************************
+
+def test_completion_key_depends_on_the_request():
+    messages = [{"role": "user", "content": "Hi"}]
+    key = CompletionCache.make_key("model", messages, 10, 0, 1, "")
+    assert key == CompletionCache.make_key("model", [dict(messages[0])], 10, 0, 1, None)
+    assert key != CompletionCache.make_key("model", messages, 11, 0, 1, "")
+    assert key != CompletionCache.make_key("other", messages, 10, 0, 1, "")
+    assert CompletionCache.is_cacheable(0) and not CompletionCache.is_cacheable(0.7)
+
+def test_completion_memory_tier_is_an_lru(tmp_path):
+    completions = CompletionCache(None, ttl=None, memory_entries=2)
+    completions.put("a", "A")
+    completions.put("b", "B")
+    assert completions.get("a") == "A" # b is now the least recently used
+    completions.put("c", "C")
+    assert completions.get("b") is None
+    assert completions.get("a") == "A" and completions.get("c") == "C"
+    assert completions.stats()["memory_entries"] == 2
+
+def test_completion_disk_tier_is_promoted(tmp_path):
+    completions = CompletionCache(str(tmp_path / "completions.sqlite"), ttl=None, memory_entries=1)
+    completions.put("a", "A")
+    completions.put("b", "B") # a only on disk now
+    assert completions.get("a") == "A"
+    assert completions.get("a") == "A"
+    stats = completions.stats()
+    assert stats["disk_hits"] == 1 and stats["memory_hits"] == 1
+
+def test_completion_ttl(tmp_path, cache_clock):
+    completions = CompletionCache(str(tmp_path / "completions.sqlite"), ttl=60, memory_entries=10)
+    completions.put("a", "A")
+    cache_clock.advance(59)
+    assert completions.get("a") == "A"
+    cache_clock.advance(2)
+    assert completions.get("a") is None # Expired in memory and on disk
+    assert completions.purge_expired() == 1
+    assert completions.stats()["misses"] == 1
+
+def test_completion_cache_persists(tmp_path):
+    path = str(tmp_path / "completions.sqlite")
+    completions = CompletionCache(path, ttl=None)
+    completions.put("a", "A")
+    completions.close()
+    assert CompletionCache(path, ttl=None).get("a") == "A"
+
+# ****************************************** HTTP *************************************************
+
+def test_http_key_is_normalized():
+    assert HTTPCache.make_key("HTTPS://Example.COM:443#top") == "https://example.com/"
+    assert HTTPCache.make_key("http://example.com:8080/a?b=1#c") == "http://example.com:8080/a?b=1"
+
+def test_http_conditional_headers():
+    assert HTTPCache.conditional_headers(None) == {}
+    entry = {"etag": '"v1"', "last_modified": None}
+    assert HTTPCache.conditional_headers(entry) == {"If-None-Match": '"v1"'}
+
+def test_http_put_and_get(tmp_path):
+    pages = HTTPCache(str(tmp_path / "http.sqlite"))
+    pages.put("https://example.com/a#x", "Text", {"https://example.com/b", "https://example.com/a"}, 120, "html.parser", etag='"v1"')
+    entry = pages.get("https://EXAMPLE.com/a")
+    assert entry["text"] == "Text" and entry["links"] == ["https://example.com/a", "https://example.com/b"]
+    assert entry["etag"] == '"v1"' and entry["size"] == 120
+    assert pages.get("https://example.com/a", parser="lxml") is None # Parsed with another backend
+
+def test_http_page_without_validators_is_dropped(tmp_path):
+    pages = HTTPCache(str(tmp_path / "http.sqlite"))
+    pages.put("https://example.com/a", "Text", [], 10, "html.parser", last_modified="Mon, 01 Jan 2024 00:00:00 GMT")
+    pages.put("https://example.com/a", "New text", [], 10, "html.parser")
+    assert pages.get("https://example.com/a") is None
+
+def test_http_stats(tmp_path):
+    pages = HTTPCache(str(tmp_path / "http.sqlite"))
+    pages.put("https://example.com/a", "Text", [], 100, "html.parser", etag='"v1"')
+    pages.record_miss(100)
+    pages.record_hit(pages.get("https://example.com/a"))
+    stats = pages.stats()
+    assert (stats["hits"], stats["misses"], stats["bytes_saved"], stats["bytes_downloaded"], stats["entries"]) == (1, 1, 100, 100, 1)
+    assert stats["hit_rate"] == 0.5
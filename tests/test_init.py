@@ -0,0 +1,65 @@
+# _LAZY_NAMES of henryobj/__init__.py against the public names the submodules actually define.
+
+import subprocess
+import importlib
+import ast
+import sys
+import os
+
+import pytest
+
+import henryobj
+
+
+PACKAGE_PATH = os.path.dirname(henryobj.__file__)
+
+
+def defined_names(submodule: str) -> set[str]:
+    """
+    Public names defined at the top level of a submodule - functions, classes and assignments, without the lazy_import modules.
+    """
+    with open(os.path.join(PACKAGE_PATH, f"{submodule}.py"), "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    names = set()
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            value = node.value
+            if isinstance(value, ast.Call) and getattr(value.func, "id", None) == "lazy_import":
+                continue
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            names.update(target.id for target in targets if isinstance(target, ast.Name))
+    return {name for name in names if not name.startswith("_")}
+
+@pytest.mark.parametrize("submodule", list(henryobj._LAZY_NAMES))
+def test_every_public_name_is_listed(submodule):
+    eager = set(vars(henryobj)) # Imported by __init__ itself (e.g. the metrics registry)
+    missing = defined_names(submodule) - set(henryobj._LAZY_NAMES[submodule]) - eager
+    assert not missing, f"Add {sorted(missing)} to _LAZY_NAMES[{submodule!r}]"
+
+@pytest.mark.parametrize("submodule", list(henryobj._LAZY_NAMES))
+def test_every_listed_name_exists(submodule):
+    module = importlib.import_module(f"henryobj.{submodule}")
+    # client, aclient and session are built by the __getattr__ of their submodule
+    absent = [name for name in henryobj._LAZY_NAMES[submodule] if name not in henryobj._NOT_CACHED and not hasattr(module, name)]
+    assert not absent
+
+def test_no_name_is_listed_twice():
+    names = [name for names in henryobj._LAZY_NAMES.values() for name in names]
+    assert len(names) == len(set(names))
+
+def test_metrics_is_the_registry():
+    from henryobj.metrics import MetricsRegistry
+    assert isinstance(henryobj.metrics, MetricsRegistry)
+
+def test_config_constants_and_unknown_names():
+    from henryobj import config
+    assert henryobj.MODEL_CHAT == config.MODEL_CHAT
+    with pytest.raises(AttributeError):
+        henryobj.not_a_name_of_henryobj
+
+def test_base_names_dont_import_the_heavy_dependencies():
+    code = "import sys, henryobj; henryobj.clean_text; print(sorted(m for m in ('openai', 'tiktoken', 'requests', 'bs4', 'httpx', 'henryobj.oai') if m in sys.modules))"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=os.path.dirname(PACKAGE_PATH)).stdout
+    assert output.strip() == "[]"
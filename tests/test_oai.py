@@ -0,0 +1,155 @@
+# Token counts (and their fallback without a tokenizer), Conversation and the chunkers - nothing here calls the API.
+
+import types
+
+import pytest
+
+from henryobj import oai
+from henryobj.config import CHAT_MESSAGE_OVERHEAD, CHAT_REPLY_OVERHEAD
+from henryobj.oai import Conversation, iter_chunk_text, new_chunk_text
+
+
+SENTENCES = " ".join(f"Sentence number {i} talks about the weather in town {i % 7}." for i in range(300))
+
+
+@pytest.fixture
+def no_tokenizer(monkeypatch):
+    """
+    Makes every encoding fail to load, as without the cached encodings and without network. Returns the warnings logged.
+    """
+    def fail(name):
+        raise ConnectionError("Can't download the encoding")
+    monkeypatch.setattr(oai, "tiktoken", types.SimpleNamespace(encoding_for_model=fail, get_encoding=fail))
+    monkeypatch.setattr(oai, "_ENCODERS", {})
+    monkeypatch.setattr(oai, "_encoder_failure_logged", False)
+    warnings = []
+    monkeypatch.setattr(oai, "log_warning", lambda warning, func, additional_info="": warnings.append(warning))
+    return warnings
+
+# ****************************************** TOKENS ***********************************************
+
+def test_calculate_token(tokenizer_model):
+    encoder = oai.get_encoder(tokenizer_model)
+    assert oai.calculate_token("Hello there <|endoftext|>", tokenizer_model) == len(encoder.encode_ordinary("Hello there <|endoftext|>"))
+    texts = ["a", "The weather is nice.", "", 42]
+    assert oai.calculate_tokens_batch(texts, tokenizer_model, num_threads=2) == [oai.calculate_token(str(text), tokenizer_model) for text in texts]
+
+def test_without_tokenizer_counts_are_estimated(no_tokenizer):
+    assert oai.get_encoder("model-a") is None
+    assert oai.calculate_token("Hello there", "model-a") == oai.estimate_token_from_char_classes("Hello there")
+    assert oai.calculate_token("Hello there", "model-b", estimate_unknown=False) == -1
+    assert oai.calculate_tokens_batch(["a b", "c"], "model-c") == oai.calculate_tokens_aproximatively_batch(["a b", "c"])
+    assert oai.calculate_tokens_batch(["a b", "c"], "model-c", estimate_unknown=False) == [-1, -1]
+    assert len(no_tokenizer) == 1 # Once per process, whatever the number of models
+
+def test_unknown_model_uses_the_fallback_encoding(monkeypatch):
+    fallback = object()
+    def encoding_for_model(name):
+        raise KeyError(name)
+    monkeypatch.setattr(oai, "tiktoken", types.SimpleNamespace(encoding_for_model=encoding_for_model, get_encoding=lambda name: fallback))
+    monkeypatch.setattr(oai, "_ENCODERS", {})
+    assert oai.get_encoder("not-a-model") is fallback
+
+def test_approximate_count_is_on_the_safe_side(tokenizer_model):
+    # The test encoder has almost one token per byte - the estimate only has to be positive and grow with the text
+    short, long = oai.calculate_token_aproximatively("Hello"), oai.calculate_token_aproximatively("Hello " * 100)
+    assert 0 < short < long
+    assert oai.calculate_tokens_aproximatively_batch(["Hello", "Hello " * 100]) == [short, long]
+
+# ****************************************** CONVERSATION *****************************************
+
+def test_conversation_running_total(tokenizer_model):
+    conversation = Conversation("You are a bot", tokenizer_model)
+    role_tokens = oai.calculate_token("You are a bot", tokenizer_model) + CHAT_MESSAGE_OVERHEAD
+    assert conversation.total_tokens == CHAT_REPLY_OVERHEAD + role_tokens
+    tokens = conversation.add("Hello", "user")
+    assert tokens == oai.calculate_token("Hello", tokenizer_model) + CHAT_MESSAGE_OVERHEAD
+    assert conversation.add("Hi", "system") is None
+    conversation.set_role("You are a very helpful bot")
+    assert conversation.messages[0]["content"] == "You are a very helpful bot" and len(conversation) == 2
+    assert conversation.total_tokens == CHAT_REPLY_OVERHEAD + sum(conversation.tokens)
+
+def test_conversation_total_without_tokenizer(no_tokenizer):
+    conversation = Conversation("You are a bot", "model-a")
+    conversation.add("Hello")
+    assert all(tokens > CHAT_MESSAGE_OVERHEAD for tokens in conversation.tokens)
+    assert conversation.total_tokens == CHAT_REPLY_OVERHEAD + sum(conversation.tokens)
+
+def test_fit_drops_the_oldest_unpinned(tokenizer_model):
+    conversation = Conversation("Role", tokenizer_model)
+    for i in range(6):
+        conversation.add(f"Message {i} " * 20, "user" if i % 2 == 0 else "assistant")
+    conversation.pin(1)
+    window = oai.get_max_token_window(tokenizer_model)
+    # Room for the pinned messages and the last two
+    needed = CHAT_REPLY_OVERHEAD + conversation.tokens[0] + conversation.tokens[1] + sum(conversation.tokens[-2:])
+    messages = conversation.fit(window - needed)
+    assert [message["content"] for message in messages] == [conversation.messages[i]["content"] for i in (0, 1, 5, 6)]
+    assert conversation.fit(window) is None # Not even the pinned messages fit
+    assert len(conversation) == 7 # fit() doesn't change the conversation
+
+def test_trim(tokenizer_model):
+    conversation = Conversation("Role", tokenizer_model)
+    for i in range(4):
+        conversation.add(f"Message {i} " * 20)
+    window = oai.get_max_token_window(tokenizer_model)
+    assert conversation.trim(window - conversation.total_tokens) == 0
+    assert conversation.trim(window - CHAT_REPLY_OVERHEAD - conversation.tokens[0] - conversation.tokens[-1]) == 3
+    assert [message["content"] for message in conversation.messages] == ["Role", ("Message 3 " * 20).strip()]
+    assert conversation.total_tokens == CHAT_REPLY_OVERHEAD + sum(conversation.tokens)
+
+# ****************************************** CHUNKS ***********************************************
+
+def test_chunks_are_spans_of_the_text(tokenizer_model):
+    chunks = list(iter_chunk_text(SENTENCES, 100, model=tokenizer_model))
+    assert len(chunks) > 10
+    encoder = oai.get_encoder(tokenizer_model)
+    previous_end = 0
+    for chunk in chunks:
+        assert SENTENCES[chunk["start"]:chunk["end"]] == chunk["text"]
+        assert chunk["start"] >= previous_end
+        assert chunk["tokens"] <= 105
+        assert abs(chunk["tokens"] - len(encoder.encode_ordinary(chunk["text"]))) <= 2 # The whitespace stripped at the edges
+        previous_end = chunk["end"]
+    assert all(chunk["text"].endswith(".") for chunk in chunks) # Cut at the end of a sentence
+    assert " ".join(chunk["text"] for chunk in chunks).split() == SENTENCES.split() # Nothing lost
+
+def test_long_sentence_is_cut_between_words(tokenizer_model):
+    text = " ".join(f"word{i}" for i in range(2000))
+    chunks = list(iter_chunk_text(text, 50, model=tokenizer_model))
+    assert " ".join(chunk["text"] for chunk in chunks).split() == text.split()
+    assert all(chunk["tokens"] <= 52 for chunk in chunks)
+
+def test_overlap(tokenizer_model):
+    chunks = list(iter_chunk_text(SENTENCES, 100, overlap=20, model=tokenizer_model))
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert previous["start"] < chunk["start"] < previous["end"]
+        overlap = SENTENCES[chunk["start"]:previous["end"]]
+        assert len(oai.get_encoder(tokenizer_model).encode_ordinary(overlap)) <= 21
+        assert SENTENCES[chunk["start"] - 1] == " " # Starts on a word
+
+def test_streamed_text_gives_the_same_chunks(tokenizer_model):
+    whole = list(iter_chunk_text(SENTENCES, 100, model=tokenizer_model))
+    pieces = (SENTENCES[i:i + 333] for i in range(0, len(SENTENCES), 333))
+    streamed = list(iter_chunk_text(pieces, 100, model=tokenizer_model, window_chars=1500))
+    assert streamed == whole
+
+def test_chunk_edge_cases(tokenizer_model):
+    assert list(iter_chunk_text("", 100, model=tokenizer_model)) == []
+    assert list(iter_chunk_text("   \n", 100, model=tokenizer_model)) == []
+    assert [chunk["text"] for chunk in iter_chunk_text(" Short text. ", 100, model=tokenizer_model)] == ["Short text."]
+    with pytest.raises(ValueError):
+        list(iter_chunk_text(SENTENCES, 0, model=tokenizer_model))
+
+def test_new_chunk_text(tokenizer_model):
+    assert new_chunk_text("Short text.", 100, tokenizer_model) == ["Short text."]
+    chunks = new_chunk_text(SENTENCES, 100, tokenizer_model)
+    assert chunks == [chunk["text"] for chunk in iter_chunk_text(SENTENCES, 100, model=tokenizer_model)]
+
+def test_new_chunk_text_without_tokenizer(no_tokenizer):
+    assert new_chunk_text("Short text.", 100, "model-a") == ["Short text."]
+    chunks = new_chunk_text(SENTENCES, 100, "model-a")
+    assert len(chunks) > 1
+    assert " ".join(chunks).split() == SENTENCES.split()
+    with pytest.raises(RuntimeError):
+        list(iter_chunk_text(SENTENCES, 100, model="model-a"))
@@ -0,0 +1,85 @@
+# RateLimiter - token buckets per model, penalties and the Retry-After parsing.
+
+import asyncio
+
+import pytest
+
+from henryobj import ratelimit
+from henryobj.ratelimit import RateLimiter, TokenBucket, get_retry_after
+
+
+@pytest.fixture
+def limiter_clock(clock, monkeypatch):
+    monkeypatch.setattr(ratelimit, "time", clock)
+    return clock
+
+def test_unlimited_model_never_waits(limiter_clock):
+    limiter = RateLimiter()
+    assert not limiter.has_limit("model")
+    assert all(limiter.acquire("model", 10_000) == 0 for _ in range(100))
+    assert limiter_clock.slept == 0
+
+def test_requests_per_minute(limiter_clock):
+    limiter = RateLimiter({"model": (60, None)}) # One request per second once the burst is used
+    assert limiter.has_limit("model")
+    assert [limiter.reserve("model") for _ in range(60)] == [0.0] * 60
+    assert limiter.reserve("model") == pytest.approx(1.0)
+    assert limiter.reserve("model") == pytest.approx(2.0) # Queued behind the previous caller
+    limiter_clock.advance(10)
+    assert limiter.reserve("model") == 0.0
+
+def test_tokens_per_minute(limiter_clock):
+    limiter = RateLimiter({"model": (None, 600)}) # 10 tokens per second
+    assert limiter.reserve("model", 600) == 0.0
+    assert limiter.reserve("model", 50) == pytest.approx(5.0)
+    assert limiter.acquire("model", 0) == pytest.approx(5.0) # Waits for the debt of the previous reservation
+    assert limiter_clock.slept == pytest.approx(5.0)
+
+def test_request_larger_than_the_bucket_doesnt_wait_forever(limiter_clock):
+    limiter = RateLimiter({"model": (None, 100)})
+    assert limiter.reserve("model", 1_000_000) == 0.0
+    assert limiter.reserve("model", 1) == pytest.approx(0.6)
+
+def test_bucket_refills_up_to_its_size():
+    bucket = TokenBucket(60)
+    bucket.reserve(60, now=bucket.updated)
+    assert bucket.reserve(0, now=bucket.updated + 3600) == 0.0
+    assert bucket.level == 60
+
+def test_set_limit_replaces_and_removes(limiter_clock):
+    limiter = RateLimiter({"model": (1, None)})
+    limiter.reserve("model")
+    assert limiter.reserve("model") > 0
+    limiter.set_limit("model", rpm=1000)
+    assert limiter.reserve("model") == 0.0
+    limiter.set_limit("model")
+    assert not limiter.has_limit("model")
+
+def test_penalize_holds_every_caller(limiter_clock):
+    limiter = RateLimiter()
+    limiter.penalize("model", 5)
+    assert limiter.has_limit("model")
+    assert limiter.reserve("model") == pytest.approx(5.0)
+    limiter.penalize("model", 1) # A shorter penalty doesn't shorten the current one
+    assert limiter.reserve("model") == pytest.approx(5.0)
+    limiter_clock.advance(5)
+    assert not limiter.has_limit("model")
+
+def test_aacquire_waits_without_blocking(limiter_clock, monkeypatch):
+    waits = []
+    async def fake_sleep(seconds):
+        waits.append(seconds)
+    monkeypatch.setattr(ratelimit.asyncio, "sleep", fake_sleep)
+    limiter = RateLimiter({"model": (60, None)})
+    for _ in range(60):
+        limiter.reserve("model")
+    assert asyncio.run(limiter.aacquire("model")) == pytest.approx(1.0)
+    assert waits == [pytest.approx(1.0)] and limiter_clock.slept == 0
+
+@pytest.mark.parametrize("message, expected", [
+    ("Rate limit reached. Please try again in 1.2s.", 1.2),
+    ("Please try again in 350ms. Visit ...", 0.35),
+    ("Rate limit reached.", 7.0),
+])
+def test_get_retry_after(message, expected):
+    assert get_retry_after(message, 7.0) == pytest.approx(expected)
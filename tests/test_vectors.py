@@ -0,0 +1,163 @@
+# EmbeddingStore (memory-mapped round trip, exact search, quantization, recovery) and IVFIndex (recall, persistence).
+
+import numpy as np
+import pytest
+
+from henryobj.vectors import EmbeddingStore, IVFIndex, normalize_rows, top_k, top_k_blocks
+
+
+def random_vectors(rows: int, dimensions: int = 32, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(rows, dimensions))
+
+def clustered_vectors(rows: int, clusters: int = 20, dimensions: int = 32, seed: int = 0) -> np.ndarray:
+    # Points around a few directions - the shape of real embeddings an IVF index relies on
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimensions))
+    return centers[rng.integers(clusters, size=rows)] + 0.3 * rng.normal(size=(rows, dimensions))
+
+def exact_rows(vectors: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    scores = normalize_rows(vectors) @ normalize_rows(query.reshape(1, -1))[0]
+    return np.argsort(-scores, kind="stable")[:k]
+
+# ****************************************** STORE ************************************************
+
+def test_round_trip(tmp_path):
+    vectors = random_vectors(50)
+    store = EmbeddingStore(str(tmp_path))
+    rows = store.add([f"id{i}" for i in range(50)], vectors.tolist(), [{"n": i} for i in range(50)])
+    assert rows == list(range(50))
+    reopened = EmbeddingStore(str(tmp_path))
+    assert len(reopened) == 50 and reopened.dimensions == 32
+    assert isinstance(reopened.vectors(), np.memmap)
+    np.testing.assert_allclose(reopened.vectors(), normalize_rows(vectors), rtol=1e-6)
+    record = reopened.get("id7")
+    assert record["row"] == 7 and record["metadata"] == {"n": 7}
+    np.testing.assert_allclose(record["vector"], normalize_rows(vectors[7:8])[0], rtol=1e-6)
+
+def test_none_vectors_are_skipped_and_last_id_wins(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    assert store.add(["a", "b", "a"], [[1.0, 0.0], None, [0.0, 1.0]]) == [0, None, 1]
+    assert store.get("b") is None
+    assert store.get("a")["row"] == 1
+    assert store.add(["c"], [[1.0, 0.0, 0.0]]) is None # Wrong dimensions
+    assert len(store) == 2
+
+def test_settings_must_match(tmp_path):
+    EmbeddingStore(str(tmp_path), dtype="int8").add(["a"], [[1.0, 2.0]])
+    with pytest.raises(ValueError):
+        EmbeddingStore(str(tmp_path), dtype="float32")
+    with pytest.raises(ValueError):
+        EmbeddingStore(str(tmp_path), dimensions=3)
+    with pytest.raises(ValueError):
+        EmbeddingStore(str(tmp_path / "other"), dtype="float64")
+
+def test_partial_write_is_dropped(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.add(["a", "b"], random_vectors(2, 4).tolist())
+    # A crash after writing the vectors and the records but before offsets.bin
+    with open(tmp_path / "vectors.bin", "ab") as f:
+        f.write(b"\x00" * 10)
+    with open(tmp_path / "records.jsonl", "ab") as f:
+        f.write(b'{"id": "c"')
+    reopened = EmbeddingStore(str(tmp_path))
+    assert len(reopened) == 2
+    assert reopened.add(["c"], random_vectors(1, 4, seed=1).tolist()) == [2]
+    assert reopened.get("c")["row"] == 2 and reopened.get("b")["row"] == 1
+
+@pytest.mark.parametrize("block_rows", [7, 1000])
+def test_search_is_exact(tmp_path, block_rows):
+    vectors = random_vectors(200)
+    store = EmbeddingStore(str(tmp_path))
+    store.add([f"id{i}" for i in range(200)], vectors.tolist())
+    query = random_vectors(1, seed=1)[0]
+    results = store.search(query.tolist(), k=10, block_rows=block_rows)
+    assert [result["row"] for result in results] == exact_rows(vectors, query, 10).tolist()
+    assert [result["id"] for result in results] == [f"id{row}" for row in exact_rows(vectors, query, 10)]
+    assert all(a["score"] >= b["score"] for a, b in zip(results, results[1:]))
+
+def test_search_edge_cases(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    assert store.search([1.0, 0.0]) == []
+    store.add(["a"], [[1.0, 0.0]])
+    assert store.search([1.0, 0.0, 0.0]) == [] # Wrong dimensions
+    assert store.search([1.0, 0.0], k=0) == []
+    assert len(store.search([1.0, 0.0], k=5)) == 1
+
+@pytest.mark.parametrize("dtype, tolerance", [("float16", 1e-3), ("int8", 2e-2)])
+def test_quantized_scores(tmp_path, dtype, tolerance):
+    vectors = random_vectors(100)
+    store = EmbeddingStore(str(tmp_path), dtype=dtype)
+    store.add([f"id{i}" for i in range(100)], vectors.tolist())
+    query = random_vectors(1, seed=1)[0]
+    rows, scores = EmbeddingStore(str(tmp_path)).search_rows(query.tolist(), k=100)
+    expected = normalize_rows(vectors) @ normalize_rows(query.reshape(1, -1))[0]
+    np.testing.assert_allclose(scores, expected[rows], atol=tolerance)
+    np.testing.assert_allclose(store.get_vectors(slice(0, 100)), normalize_rows(vectors), atol=tolerance)
+
+# ****************************************** ANN INDEX ********************************************
+
+@pytest.fixture
+def clustered_store(tmp_path):
+    vectors = clustered_vectors(2000)
+    store = EmbeddingStore(str(tmp_path))
+    store.add([f"id{i}" for i in range(len(vectors))], vectors.tolist())
+    return store, vectors
+
+def test_ivf_recall(clustered_store):
+    store, vectors = clustered_store
+    index = IVFIndex(store, nlist=40).train(seed=0)
+    assert index.cluster_sizes().sum() == len(store)
+    queries = clustered_vectors(50, seed=1)
+    recall = {}
+    for nprobe in (1, 8, 40):
+        found = [len(set(index.search_rows(q.tolist(), 10, nprobe)[0].tolist()) & set(exact_rows(vectors, q, 10).tolist())) for q in queries]
+        recall[nprobe] = sum(found) / (10 * len(queries))
+    assert recall[40] == 1.0 # Every cluster scanned - an exact search
+    assert recall[8] >= 0.9
+    assert recall[1] <= recall[8]
+
+def test_ivf_indexes_new_rows(clustered_store):
+    store, _ = clustered_store
+    index = IVFIndex(store, nlist=20).train()
+    store.add(["new"], [clustered_vectors(1, seed=2)[0].tolist()])
+    results = index.search(store.get("new")["vector"].tolist(), k=1, nprobe=20)
+    assert results[0]["id"] == "new"
+    assert index.indexed_rows == len(store)
+
+def test_ivf_save_and_load(clustered_store):
+    store, _ = clustered_store
+    index = IVFIndex(store, nlist=20, nprobe=5).train()
+    index.save()
+    store.add(["new"], [clustered_vectors(1, seed=3)[0].tolist()])
+    loaded = IVFIndex.load(EmbeddingStore(store.path))
+    assert loaded.nlist == 20 and loaded.nprobe == 5
+    assert loaded.indexed_rows == len(store) # The row added after save() is indexed on load
+    np.testing.assert_array_equal(loaded.centroids, index.centroids)
+    query = clustered_vectors(1, seed=4)[0].tolist()
+    np.testing.assert_array_equal(loaded.search_rows(query, 10)[0], index.search_rows(query, 10)[0])
+
+def test_ivf_must_be_trained(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.add(["a"], [[1.0, 0.0]])
+    index = IVFIndex(store)
+    assert not index.is_trained()
+    assert index.search([1.0, 0.0]) == []
+    assert IVFIndex.load(store) is None
+
+# ****************************************** HELPERS **********************************************
+
+def test_top_k():
+    scores = np.random.default_rng(0).normal(size=1000).astype(np.float32)
+    np.testing.assert_array_equal(top_k(scores, 10), np.argsort(-scores)[:10])
+    assert len(top_k(scores[:3], 10)) == 3
+
+def test_top_k_blocks_matches_a_full_sort():
+    scores = np.random.default_rng(0).normal(size=1000).astype(np.float32)
+    rows, best = top_k_blocks(lambda start, end: scores[start:end], len(scores), 25, block_rows=64)
+    np.testing.assert_array_equal(rows, np.argsort(-scores)[:25])
+    np.testing.assert_array_equal(best, scores[rows])
+
+def test_normalize_rows_keeps_zero_rows():
+    normalized = normalize_rows(np.array([[3.0, 4.0], [0.0, 0.0]]))
+    np.testing.assert_allclose(normalized, [[0.6, 0.8], [0.0, 0.0]])
+    assert normalized.dtype == np.float32